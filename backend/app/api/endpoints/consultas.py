@@ -1,116 +1,98 @@
-from fastapi import APIRouter, Depends
+import threading
+import time
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import APIRouter, Depends, Query
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc, and_
-from app.db.database import get_db
-from app.db import models, schemas
+from sqlalchemy import func, desc, and_, case
+from app.db.database import get_db, SessionLocal
+from app.db import models, schemas, versoes
+from app.core.config import settings
+from app.core.cache import CacheResultados
+from app.services import snapshot_service, distribuicao_service
+from app.services.estatisticas_ano_service import verificar_reprovacao_aluno, indicadores_retencao
 
 router = APIRouter()
 
-def verificar_reprovacao_aluno(ano_escolar: int, negativas: int, notas_aluno, id_pt, id_mat):
-    """
-    Aplica as regras oficiais de retenção conforme definido em turmas.py.
-    """
-    if 5 <= ano_escolar <= 8:
-        return negativas > 3
-    elif ano_escolar == 9:
-        if negativas > 2:
-            return True
-        if negativas == 2:
-            # Verifica se as negativas são simultaneamente em PT e MAT
-            tem_nega_pt = any(n.Nota_Final < 10 and n.Disc_id == id_pt for n in notas_aluno)
-            tem_nega_mat = any(n.Nota_Final < 10 and n.Disc_id == id_mat for n in notas_aluno)
-            return tem_nega_pt and tem_nega_mat
-        return False
-    elif 10 <= ano_escolar <= 11:
-        tem_nota_critica = any(n.Nota_Final < 6 for n in notas_aluno)
-        return negativas > 2 or tem_nota_critica
-    elif ano_escolar == 12:
-        return negativas > 0
-    return False
+# Resultados por (ano_letivo, top_n), invalidados quando mudam notas, matrículas, turmas ou atribuições
+cache_consultas = CacheResultados("consultas")
+VERSOES_CONSULTAS = ("notas", "matriculas", "turmas", "atribuicoes")
 
 @router.get("/", response_model=schemas.ConsultasGeraisResponse)
-def obter_consultas_estatisticas(ano_letivo: str = None, db: Session = Depends(get_db)):
+def obter_consultas_estatisticas(ano_letivo: str = None, top_n: int = Query(5, ge=1, le=50), db: Session = Depends(get_db)):
     if not ano_letivo:
         ultima_t = db.query(models.Turma).order_by(desc(models.Turma.AnoLetivo)).first()
         ano_letivo = ultima_t.AnoLetivo if ultima_t else "2024/2025"
 
-    # CORREÇÃO AQUI: Usar .first() em vez de .scalar() para evitar o erro MultipleResultsFound
-    id_pt = db.query(models.Disciplina.Disc_id).filter(models.Disciplina.Nome.ilike("%português%")).first()
-    id_mat = db.query(models.Disciplina.Disc_id).filter(models.Disciplina.Nome.ilike("%matemática%")).first()
-    
-    # Extrair apenas o ID se o objeto existir
-    id_pt = id_pt[0] if id_pt else None
-    id_mat = id_mat[0] if id_mat else None
-
-    # 1. MELHORES ALUNOS (Top 5 por Turma)
-    query_base = db.query(
-        models.Aluno.Aluno_id, models.Aluno.Nome, models.Turma.Turma, models.Turma.Ano, models.Turma.Turma_id,
-        func.avg(models.Nota.Nota_Final).label('media')
-    ).join(models.Matricula, models.Aluno.Aluno_id == models.Matricula.Aluno_id)\
-     .join(models.Turma, models.Matricula.Turma_id == models.Turma.Turma_id)\
-     .join(models.Nota, and_(models.Nota.Aluno_id == models.Aluno.Aluno_id, models.Nota.Ano_letivo == models.Turma.AnoLetivo))\
-     .filter(models.Turma.AnoLetivo == ano_letivo)\
-     .group_by(models.Aluno.Aluno_id, models.Turma.Turma_id)\
-     .order_by(models.Turma.Ano, models.Turma.Turma, desc('media'))
-
-    resultados_alunos = query_base.all()
-    lista_top_alunos = []
-    contagem = {}
-
-    for a in resultados_alunos:
-        tid = a[4]
-        contagem[tid] = contagem.get(tid, 0)
-        if contagem[tid] < 5:
-            lista_top_alunos.append({
-                "aluno_id": a[0], "nome": a[1], "turma": f"{a[3]}º{a[2]}", "media": round(float(a[5]), 2) if a[5] else 0.0
-            })
-            contagem[tid] += 1
+    return cache_consultas.obter(
+        db, (ano_letivo, top_n), versoes.versoes_atuais(db, VERSOES_CONSULTAS),
+        calcular=lambda _sessao: calcular_estatisticas(ano_letivo, top_n),
+        obter_versao=lambda sessao: versoes.versoes_atuais(sessao, VERSOES_CONSULTAS)
+    )
+
+@router.get("/cache/metricas")
+def obter_metricas_cache():
+    return {cache.nome: cache.metricas() for cache in (cache_consultas, cache_distribuicao)}
+
+# --- SECÇÕES (independentes: cada uma corre em paralelo com a sua própria sessão) ---
 
+def _secao_top_alunos(db: Session, ano_letivo: str, top_n: int) -> dict:
+    # 1. MELHORES ALUNOS (Top N por Turma) - lido dos resumos materializados
+    # ROW_NUMBER() por turma: só as N primeiras linhas de cada turma saem da base de dados
+    ranking = db.query(
+        models.ResumoAlunoAno.Aluno_id, models.ResumoAlunoAno.Turma_id, models.ResumoAlunoAno.Media,
+        func.row_number().over(
+            partition_by=models.ResumoAlunoAno.Turma_id,
+            order_by=(desc(models.ResumoAlunoAno.Media), models.ResumoAlunoAno.Aluno_id)
+        ).label('posicao')
+    ).filter(models.ResumoAlunoAno.Ano_letivo == ano_letivo, models.ResumoAlunoAno.Turma_id.isnot(None)).subquery()
+
+    resultados_alunos = db.query(
+        models.Aluno.Aluno_id, models.Aluno.Nome, models.Turma.Turma, models.Turma.Ano, ranking.c.Media
+    ).join(ranking, ranking.c.Aluno_id == models.Aluno.Aluno_id)\
+     .join(models.Turma, ranking.c.Turma_id == models.Turma.Turma_id)\
+     .filter(ranking.c.posicao <= top_n)\
+     .order_by(models.Turma.Ano, models.Turma.Turma, ranking.c.posicao).all()
+
+    lista_top_alunos = [{
+        "aluno_id": a[0], "nome": a[1], "turma": f"{a[3]}º{a[2]}", "media": round(float(a[4]), 2) if a[4] else 0.0
+    } for a in resultados_alunos]
+
+    return {"top_alunos_turma": lista_top_alunos}
+
+def _secao_reprovacoes(db: Session, ano_letivo: str, top_n: int) -> dict:
     # 2. ALUNOS REPROVADOS
-    alunos_ano = db.query(models.Aluno).join(models.Matricula).join(models.Turma)\
-                   .filter(models.Turma.AnoLetivo == ano_letivo).all()
-    
+    indicadores = indicadores_retencao(db, ano_letivo)
+
     lista_reprovados = []
-    for aluno in alunos_ano:
-        notas = db.query(models.Nota).filter(models.Nota.Aluno_id == aluno.Aluno_id, models.Nota.Ano_letivo == ano_letivo).all()
-        negativas = sum(1 for n in notas if n.Nota_Final < 10)
-        
-        matricula = next((m for m in aluno.matriculas if m.turma.AnoLetivo == ano_letivo), None)
-        if not matricula: continue
-        
-        if verificar_reprovacao_aluno(matricula.turma.Ano, negativas, notas, id_pt, id_mat):
+    for aluno_id, nome, ano_escolar, letra, negativas, nega_pt, nega_mat, critica in indicadores:
+        negativas = int(negativas or 0)
+        if verificar_reprovacao_aluno(ano_escolar, negativas, bool(nega_pt), bool(nega_mat), bool(critica)):
             lista_reprovados.append({
-                "aluno_id": aluno.Aluno_id,
-                "nome": aluno.Nome,
-                "turma": f"{matricula.turma.Ano}º{matricula.turma.Turma}",
-                "ano": matricula.turma.Ano,
+                "aluno_id": aluno_id,
+                "nome": nome,
+                "turma": f"{ano_escolar}º{letra}",
+                "ano": ano_escolar,
                 "negativas": negativas,
                 "motivo": "Retenção por avaliação insuficiente"
             })
 
     lista_reprovados.sort(key=lambda x: (x['ano'], x['turma']))
 
-    # 3. PERFORMANCE DE PROFESSORES
+    return {"alunos_reprovacao": lista_reprovados}
+
+def _secao_professores(db: Session, ano_letivo: str, top_n: int) -> dict:
+    # 3. PERFORMANCE DE PROFESSORES (resumos professor/disciplina/ano)
     profs_media = db.query(
         models.Professor.Professor_id, models.Professor.Nome, models.Disciplina.Nome.label('disc_nome'),
-        func.avg(models.Nota.Nota_Final).label('m')
-    ).select_from(models.Professor)\
-     .join(models.TurmaDisciplina, models.Professor.Professor_id == models.TurmaDisciplina.Professor_id)\
-     .join(models.Disciplina, models.TurmaDisciplina.Disc_id == models.Disciplina.Disc_id)\
-     .join(models.Turma, models.TurmaDisciplina.Turma_id == models.Turma.Turma_id)\
-     .join(models.Matricula, models.Turma.Turma_id == models.Matricula.Turma_id)\
-     .join(models.Nota, and_(
-         models.Nota.Aluno_id == models.Matricula.Aluno_id,
-         models.Nota.Disc_id == models.Disciplina.Disc_id,
-         models.Nota.Ano_letivo == models.Turma.AnoLetivo
-     ))\
-     .filter(models.Turma.AnoLetivo == ano_letivo)\
-     .group_by(models.Professor.Professor_id, models.Disciplina.Disc_id)\
+        models.ResumoProfessorDisciplina.Media.label('m')
+    ).select_from(models.ResumoProfessorDisciplina)\
+     .join(models.Professor, models.ResumoProfessorDisciplina.Professor_id == models.Professor.Professor_id)\
+     .join(models.Disciplina, models.ResumoProfessorDisciplina.Disc_id == models.Disciplina.Disc_id)\
+     .filter(models.ResumoProfessorDisciplina.Ano_letivo == ano_letivo)\
      .order_by(desc('m')).all()
 
     return {
-        "top_alunos_turma": lista_top_alunos,
-        "alunos_reprovacao": lista_reprovados,
         "top_professores": [
             {"professor_id": p[0], "nome": p[1], "disciplina": p[2], "media_alunos": round(float(p[3]), 2) if p[3] else 0.0} 
             for p in profs_media[:10]
@@ -119,4 +101,168 @@ def obter_consultas_estatisticas(ano_letivo: str = None, db: Session = Depends(g
             {"professor_id": p[0], "nome": p[1], "disciplina": p[2], "media_alunos": round(float(p[3]), 2) if p[3] else 0.0} 
             for p in reversed(profs_media[-5:])
         ]
-    }
\ No newline at end of file
+    }
+
+SECOES = {
+    "top_alunos": _secao_top_alunos,
+    "reprovacoes": _secao_reprovacoes,
+    "professores": _secao_professores,
+}
+
+# Um lugar por secção para cada pedido simultâneo: pedidos concorrentes não ficam em fila uns atrás dos outros
+_executor_secoes = ThreadPoolExecutor(
+    max_workers=len(SECOES) * max(1, settings.CONSULTAS_PEDIDOS_PARALELOS), thread_name_prefix="consultas"
+)
+
+def _executar_secao(secao, ano_letivo: str, top_n: int):
+    inicio = time.perf_counter()
+    with SessionLocal() as db:
+        resultado = secao(db, ano_letivo, top_n)
+    return resultado, round((time.perf_counter() - inicio) * 1000, 1)
+
+def calcular_estatisticas(ano_letivo: str, top_n: int) -> dict:
+    """Corre as secções em paralelo: a latência passa a ser a da secção mais lenta e não a soma."""
+    inicio = time.perf_counter()
+    with SessionLocal() as db:
+        snapshot_service.garantir_snapshot_atual(db)
+    futuros = {nome: _executor_secoes.submit(_executar_secao, secao, ano_letivo, top_n) for nome, secao in SECOES.items()}
+
+    resposta, tempos = {}, {}
+    for nome, futuro in futuros.items():
+        resultado, tempos[nome] = futuro.result()
+        resposta.update(resultado)
+
+    resposta["metadados"] = {
+        "ano_letivo": ano_letivo,
+        "tempos_ms": tempos,
+        "total_ms": round((time.perf_counter() - inicio) * 1000, 1)
+    }
+    return resposta
+
+# --- TENDÊNCIAS PLURIANUAIS ---
+# Médias e taxas de negativas por disciplina, turma (ex: "9ºA") e professor em todos os anos letivos.
+# Anos fechados (anteriores ao corrente) não mudam: são calculados uma vez e guardados em memória.
+# O ano corrente é recalculado apenas quando mudam as versões dos dados.
+
+_tendencias_fechadas: dict = {}       # ano_letivo -> agregados
+_tendencias_corrente: dict = {}       # (ano_letivo, versões) -> agregados
+_lock_tendencias = threading.Lock()
+
+def _agregar_tendencias(db: Session, anos) -> dict:
+    """Duas passagens agrupadas pelo snapshot de notas (disciplina/turma e professor) para todos os anos pedidos."""
+    F, TD = models.FactoNota, models.TurmaDisciplina
+    metricas = (func.count(F.Nota_Final), func.sum(F.Nota_Final), func.sum(case((F.Nota_Final < 10, 1), else_=0)))
+    filtros = (F.Ano_letivo.in_(list(anos)), F.Nota_Final.isnot(None))
+    linhas = db.query(F.Ano_letivo, F.Disc_id, F.Ano_escolar, F.Turma, *metricas).filter(*filtros)\
+        .group_by(F.Ano_letivo, F.Disc_id, F.Ano_escolar, F.Turma).all()
+    # Cada nota conta para todos os professores da disciplina na turma (como em ResumosProfessorDisciplina)
+    linhas_professores = db.query(F.Ano_letivo, TD.Professor_id, *metricas).select_from(F)\
+        .join(TD, and_(TD.Turma_id == F.Turma_id, TD.Disc_id == F.Disc_id)).filter(*filtros)\
+        .group_by(F.Ano_letivo, TD.Professor_id).all()
+
+    # Os totais (qtd, soma, negativas) somam-se exatamente por cada dimensão
+    agregados = {ano: {"disciplinas": {}, "turmas": {}, "professores": {}} for ano in anos}
+    def _somar(ano, dimensao, chave, qtd, soma, negativas):
+        if chave is None: return
+        total = agregados[ano][dimensao].setdefault(chave, [0, 0, 0])
+        total[0] += qtd; total[1] += int(soma or 0); total[2] += int(negativas or 0)
+
+    for ano, disc_id, ano_escolar, letra, *totais in linhas:
+        _somar(ano, "disciplinas", disc_id, *totais)
+        _somar(ano, "turmas", f"{ano_escolar}º{letra}" if ano_escolar else None, *totais)
+    for ano, prof_id, *totais in linhas_professores:
+        _somar(ano, "professores", prof_id, *totais)
+    return agregados
+
+def _serie(agregados: dict, anos, dimensao: str, nomes: dict) -> list:
+    chaves = sorted({c for ano in anos for c in agregados[ano][dimensao]}, key=str)
+    resultado = []
+    for chave in chaves:
+        serie = []
+        for ano in anos:
+            total = agregados[ano][dimensao].get(chave)
+            if not total: continue
+            qtd, soma, negativas = total
+            serie.append({
+                "ano_letivo": ano, "qtd_notas": qtd,
+                "media": round(soma / qtd, 2), "taxa_negativas": round(negativas / qtd, 3)
+            })
+        resultado.append({"id": chave, "nome": nomes.get(chave, chave), "serie": serie})
+    return resultado
+
+@router.get("/tendencias")
+def obter_tendencias(db: Session = Depends(get_db)):
+    snapshot_service.garantir_snapshot_atual(db)
+
+    anos = sorted(a for (a,) in db.query(models.FactoNota.Ano_letivo).distinct().all() if a)
+    ano_corrente = db.query(func.max(models.Turma.AnoLetivo)).scalar()
+    chave_corrente = (ano_corrente, versoes.versoes_atuais(db, VERSOES_CONSULTAS))
+
+    with _lock_tendencias:
+        agregados = {ano: _tendencias_fechadas[ano] for ano in anos if ano in _tendencias_fechadas}
+        if chave_corrente in _tendencias_corrente:
+            agregados[ano_corrente] = _tendencias_corrente[chave_corrente]
+    em_cache = sorted(agregados)
+
+    em_falta = [ano for ano in anos if ano not in agregados]
+    if em_falta:
+        novos = _agregar_tendencias(db, em_falta)
+        agregados.update(novos)
+        with _lock_tendencias:
+            for ano, dados in novos.items():
+                if ano == ano_corrente:
+                    _tendencias_corrente.clear()
+                    _tendencias_corrente[chave_corrente] = dados
+                elif ano_corrente and ano < ano_corrente:
+                    _tendencias_fechadas[ano] = dados
+
+    disciplinas = dict(db.query(models.Disciplina.Disc_id, models.Disciplina.Nome).all())
+    professores = dict(db.query(models.Professor.Professor_id, models.Professor.Nome).all())
+    return {
+        "anos": anos,
+        "disciplinas": _serie(agregados, anos, "disciplinas", disciplinas),
+        "turmas": _serie(agregados, anos, "turmas", {}),
+        "professores": _serie(agregados, anos, "professores", professores),
+        "metadados": {"ano_corrente": ano_corrente, "anos_em_cache": em_cache, "anos_calculados": em_falta}
+    }
+
+# --- DISTRIBUIÇÃO DE NOTAS ---
+
+cache_distribuicao = CacheResultados("distribuicao")
+
+def calcular_distribuicao(db: Session, ano_letivo: Optional[str], dimensoes) -> dict:
+    snapshot_service.garantir_snapshot_atual(db)
+    nomes = {
+        "disciplina": dict(db.query(models.Disciplina.Disc_id, models.Disciplina.Nome).all()),
+        "professor": dict(db.query(models.Professor.Professor_id, models.Professor.Nome).all()),
+    }
+
+    resposta = {"ano_letivo": ano_letivo, "escala": [0, 20]}
+    for dimensao in dimensoes:
+        grupos = distribuicao_service.histogramas(db, dimensao, ano_letivo)
+        itens = []
+        for chave, contagens in grupos.items():
+            if dimensao == "turma":
+                identificador, nome = f"{chave[0]}º{chave[1]}", f"{chave[0]}º{chave[1]}"
+            else:
+                identificador, nome = chave, nomes[dimensao].get(chave, str(chave))
+            itens.append({"id": identificador, "nome": nome, **distribuicao_service.resumo_distribuicao(contagens)})
+        resposta[dimensao] = sorted(itens, key=lambda i: str(i["nome"]))
+    return resposta
+
+@router.get("/distribuicao")
+def obter_distribuicao(
+    ano_letivo: Optional[str] = None,
+    dimensao: Optional[str] = Query(None, pattern="^(disciplina|turma|professor)$"),
+    db: Session = Depends(get_db)
+):
+    """
+    Histogramas (0-20), média, desvio padrão, mediana e percentis por disciplina, turma e professor.
+    Sem ano_letivo: todos os anos. Sem dimensao: as três.
+    """
+    dimensoes = (dimensao,) if dimensao else tuple(distribuicao_service.DIMENSOES)
+    return cache_distribuicao.obter(
+        db, (ano_letivo, dimensoes), versoes.versoes_atuais(db, VERSOES_CONSULTAS),
+        calcular=lambda sessao: calcular_distribuicao(sessao, ano_letivo, dimensoes),
+        obter_versao=lambda sessao: versoes.versoes_atuais(sessao, VERSOES_CONSULTAS)
+    )
@@ -1,34 +1,142 @@
-from fastapi import APIRouter, Depends
+import time
+from datetime import date
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from app.db.database import get_db
-from app.db import models
+from sqlalchemy import event, func
+from app.db.database import get_db, SessionLocal
+from app.db import models, contadores
+from app.core import eventos
+from app.core.cache import CacheResultados
+from app.services import estatisticas_ano_service
 
 router = APIRouter()
 
-@router.get("/stats")
-def get_dashboard_stats(db: Session = Depends(get_db)):
-    # 1. Contar Alunos
-    total_students = db.query(models.Aluno).count()
+# A página inicial é o pedido mais frequente: os números vêm de memória.
+# A "versão" da cache é a janela de TTL_DASHBOARD segundos: dentro da janela é um hit; na janela
+# seguinte devolve o valor anterior e recalcula em segundo plano (uma vez, seja qual for a carga).
+TTL_DASHBOARD = 15
 
-    # 2. Contar Staff (excluindo professores se quiseres, ou tudo)
-    total_staff = db.query(models.Staff).count()
-    total_teachers = db.query(models.Professor).count()
+cache_dashboard = CacheResultados("dashboard", max_entradas=4, max_idade_stale=300)
 
-    # 3. Calcular Saldo Financeiro (Receitas - Despesas)
-    # Soma de todas as receitas
-    total_revenue = db.query(func.sum(models.Transacao.Valor))\
-        .filter(models.Transacao.Tipo == models.TipoTransacaoEnum.Receita).scalar() or 0
-    
-    # Soma de todas as despesas
-    total_expenses = db.query(func.sum(models.Transacao.Valor))\
-        .filter(models.Transacao.Tipo == models.TipoTransacaoEnum.Despesa).scalar() or 0
+def _janela_ttl(_db=None) -> int:
+    return int(time.time() // TTL_DASHBOARD)
 
-    current_balance = total_revenue - total_expenses
+def calcular_estatisticas(db: Session, hoje: date) -> dict:
+    """
+    Leituras por chave primária: contadores mantidos pelo ORM (app/db/contadores.py)
+    e totais do mês no razão de saldos mensais (uma linha por investimento).
+    """
+    valores = contadores.valores(db)
+    receita_mes, despesa_mes = db.query(
+        func.coalesce(func.sum(models.SaldoMensal.Receita_Total), 0),
+        func.coalesce(func.sum(models.SaldoMensal.Despesa_Total), 0)
+    ).filter(models.SaldoMensal.Ano == hoje.year, models.SaldoMensal.Mes == hoje.month).one()
 
+    receita_total, despesa_total = valores[contadores.RECEITA_TOTAL], valores[contadores.DESPESA_TOTAL]
     return {
-        "total_students": total_students,
-        "total_staff": total_staff + total_teachers, # Juntamos staff e professores
-        "financial_balance": float(current_balance),
-        "monthly_revenue": float(total_revenue) # Simplificado para o exemplo
-    }
\ No newline at end of file
+        "total_students": int(valores[contadores.ALUNOS]),
+        "total_staff": int(valores[contadores.STAFF] + valores[contadores.PROFESSORES]), # Juntamos staff e professores
+        "total_teachers": int(valores[contadores.PROFESSORES]),
+        "financial_balance": float(receita_total - despesa_total),
+        "total_revenue": float(receita_total),
+        "total_expenses": float(despesa_total),
+        "monthly_revenue": float(receita_mes),
+        "monthly_expenses": float(despesa_mes),
+        "mes": hoje.strftime("%Y-%m"),
+    }
+
+def _juntar(gerais: dict, do_ano: Optional[dict]) -> dict:
+    stats = dict(gerais)
+    stats["total_students_all"] = stats["total_students"]
+    if do_ano:
+        stats.update({
+            "ano_letivo": do_ano["ano_letivo"],
+            "total_students": do_ano["alunos_matriculados"],
+            "total_classes": do_ano["turmas"],
+            "teachers_with_classes": do_ano["professores_atribuidos"],
+            "students_evaluated": do_ano["alunos_avaliados"],
+            "pass_rate": do_ano["taxa_aprovacao"],
+        })
+    return stats
+
+@router.get("/stats")
+def get_dashboard_stats(ano_letivo: Optional[str] = None, db: Session = Depends(get_db)):
+    """
+    Totais gerais (cache TTL) e, por ano letivo (omissão: o corrente), alunos matriculados, turmas,
+    professores com atribuições e taxa de aprovação - em vez de todos os alunos alguma vez inseridos.
+    """
+    hoje = date.today()
+    gerais = cache_dashboard.obter(
+        db, hoje, _janela_ttl(),
+        calcular=lambda sessao: calcular_estatisticas(sessao, hoje),
+        obter_versao=_janela_ttl
+    )
+    do_ano = estatisticas_ano_service.estatisticas_do_ano(db, ano_letivo)
+    if ano_letivo and do_ano is None:
+        raise HTTPException(status_code=404, detail=f"Ano letivo {ano_letivo} não encontrado")
+    return _juntar(gerais, do_ano)
+
+# --- ATUALIZAÇÃO EM TEMPO REAL (SSE) ---
+# Em vez de cada cliente repetir GET /stats, o servidor recalcula e publica no canal "dashboard"
+# quando há escritas relevantes. Rajadas de escritas (importações, processamento de vencimentos)
+# são agrupadas pelo Debounce: um recálculo por rajada, seja qual for o número de clientes.
+
+MODELOS_DASHBOARD = (models.Aluno, models.Matricula, models.Nota, models.Staff, models.Professor, models.Transacao)
+
+_ultimas_publicadas: Optional[dict] = None
+
+def _publicar_estatisticas():
+    global _ultimas_publicadas
+    hoje = date.today()
+    with SessionLocal() as db:
+        gerais = calcular_estatisticas(db, hoje)
+        cache_dashboard.atualizar(hoje, _janela_ttl(), gerais)
+        stats = _juntar(gerais, estatisticas_ano_service.atualizar_ano_corrente(db))
+    if stats != _ultimas_publicadas:  # ex: escrita anulada por outra na mesma rajada
+        _ultimas_publicadas = stats
+        eventos.publicar(eventos.CANAL_DASHBOARD, {"tipo": "stats", "stats": stats})
+
+produtor_dashboard = eventos.Debounce("dashboard", _publicar_estatisticas, espera=1.0, espera_maxima=5.0)
+
+@event.listens_for(Session, "after_flush")
+def _marcar_apos_flush(session, flush_context):
+    alterados = set(session.new) | set(session.deleted) | set(session.dirty)
+    if any(isinstance(o, MODELOS_DASHBOARD) for o in alterados):
+        session.info["dashboard_alterado"] = True
+
+@event.listens_for(Session, "do_orm_execute")
+def _marcar_escrita_em_massa(estado):
+    if (estado.is_insert or estado.is_update or estado.is_delete) and estado.bind_mapper is not None \
+            and issubclass(estado.bind_mapper.class_, MODELOS_DASHBOARD):
+        estado.session.info["dashboard_alterado"] = True
+
+@event.listens_for(Session, "after_commit")
+def _sinalizar_apos_commit(session):
+    # Só depois do commit: o produtor lê numa sessão própria e tem de ver os dados gravados
+    if session.info.pop("dashboard_alterado", False):
+        produtor_dashboard.sinalizar()
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_apos_rollback(session):
+    session.info.pop("dashboard_alterado", None)
+
+@router.get("/stream")
+async def stream_dashboard(request: Request, desde: Optional[str] = None):
+    """
+    Server-Sent Events com as estatísticas do ano corrente (evento 'stats'), enviados depois de cada
+    rajada de escritas em alunos, staff ou transações. Para retomar: header Last-Event-ID ou ?desde=.
+    Um evento 'reset' indica que houve eventos perdidos e as estatísticas devem ser pedidas a /stats.
+    """
+    ultimo_id = request.headers.get("last-event-id") or desde
+    return StreamingResponse(
+        eventos.stream_sse(eventos.CANAL_DASHBOARD, ultimo_id, request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/anos-letivos")
+def get_estatisticas_anos_letivos(db: Session = Depends(get_db)):
+    """Evolução por ano letivo (anos fechados pré-calculados; o corrente em cache)."""
+    return list(estatisticas_ano_service.estatisticas_anos(db).values())
@@ -1,116 +1,191 @@
 from typing import Optional, List
-from fastapi import APIRouter, Depends, Query, HTTPException
+from fastapi import APIRouter, Depends, Query, HTTPException, Response, UploadFile, File
 from sqlalchemy.orm import Session
-from sqlalchemy import func, extract, and_
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
 from datetime import date
 
 from app.db.database import get_db
 from app.db.models import Financiamento, Transacao, TipoTransacaoEnum
 from app.db import schemas
+from app.db import versoes
+from app.core.cache import CacheResultados
+from app.services import saldos_service  # Também regista os eventos que mantêm o razão
+from app.services import extratos_service, previsao_service
 
 
 router = APIRouter()
 
+MAX_MESES_SERIE = 120
+
 # --- FUNÇÕES AUXILIARES ---
 
-def calcular_investimento_individual(db: Session, investimento: Financiamento, ano: int, mes: Optional[int] = None):
+def calcular_balanco(db: Session, ano: int, mes: Optional[int] = None) -> dict:
     """
-    Calcula a matemática de um único investimento (Lab, Projeto, etc), convertendo decimais para float.
+    Totais do período e detalhe dos investimentos lidos do razão de saldos (saldos_service):
+    linhas já agregadas por mês/investimento, sem somar transações.
+    O Fin_id 0 são as transações sem investimento, que só contam para os totais gerais.
     """
-    # 1. Calcular gastos acumulados desde sempre para este centro de custo
-    query_acumulado = db.query(
-        func.sum(Transacao.Valor)
-    ).filter(
-        Transacao.Fin_id == investimento.Fin_id,
-        Transacao.Tipo == TipoTransacaoEnum.Despesa
-    )
-    gasto_acumulado = query_acumulado.scalar() or 0.0
-
-    valor_inicial = float(investimento.Valor or 0.0)
-    gasto_total = float(gasto_acumulado)
-    saldo_restante = valor_inicial - gasto_total
-
-    # 2. Calcular movimentos específicos do período solicitado
-    query_periodo = db.query(
-        Transacao.Tipo,
-        func.sum(Transacao.Valor)
-    ).filter(
-        Transacao.Fin_id == investimento.Fin_id,
-        extract('year', Transacao.Data) == ano
-    )
+    periodo = saldos_service.totais_periodo(db, ano, [mes] if mes else list(range(1, 13)))
+    acumulados = saldos_service.saldos_acumulados(db)
 
-    if mes:
-        query_periodo = query_periodo.filter(extract('month', Transacao.Data) == mes)
-
-    resultados_periodo = query_periodo.group_by(Transacao.Tipo).all()
-
-    receita_periodo = 0.0
-    despesa_periodo = 0.0
-
-    for tipo, valor in resultados_periodo:
-        if tipo == TipoTransacaoEnum.Receita:
-            receita_periodo = float(valor)
-        elif tipo == TipoTransacaoEnum.Despesa:
-            despesa_periodo = float(valor)
-
-    return schemas.BalancoInvestimento(
-        id=investimento.Fin_id,
-        tipo_investimento=investimento.Tipo or "Sem Nome",
-        ano_financiamento=investimento.Ano or 0,
-        valor_aprovado=valor_inicial,
-        total_receita_periodo=receita_periodo,
-        total_despesa_periodo=despesa_periodo,
-        total_gasto_acumulado=gasto_total,
-        saldo_restante=saldo_restante
-    )
-
-# --- ROTAS DE BALANÇO ---
-
-@router.get("/balanco/mensal", response_model=schemas.BalancoGeral)
-def balanco_mensal(ano: int, mes: int = Query(..., ge=1, le=12), db: Session = Depends(get_db)):
-    """Retorna o balanço de um mês específico."""
-    qry_geral = db.query(
-        Transacao.Tipo, func.sum(Transacao.Valor)
-    ).filter(
-        extract('year', Transacao.Data) == ano,
-        extract('month', Transacao.Data) == mes
-    ).group_by(Transacao.Tipo).all()
-
-    tot_rec = sum(float(v) for t, v in qry_geral if t == TipoTransacaoEnum.Receita)
-    tot_desp = sum(float(v) for t, v in qry_geral if t == TipoTransacaoEnum.Despesa)
-
-    investimentos = db.query(Financiamento).all()
-    lista_detalhada = [calcular_investimento_individual(db, inv, ano, mes) for inv in investimentos]
+    lista_detalhada = []
+    for inv in db.query(Financiamento).order_by(Financiamento.Fin_id).all():
+        receita_periodo, despesa_periodo = periodo.get(inv.Fin_id, (0.0, 0.0))
+        gasto_total = acumulados.get(inv.Fin_id, (0.0, 0.0))[1]
+        valor_inicial = float(inv.Valor or 0.0)
+        lista_detalhada.append(schemas.BalancoInvestimento(
+            id=inv.Fin_id,
+            tipo_investimento=inv.Tipo or "Sem Nome",
+            ano_financiamento=inv.Ano or 0,
+            valor_aprovado=valor_inicial,
+            total_receita_periodo=receita_periodo,
+            total_despesa_periodo=despesa_periodo,
+            total_gasto_acumulado=gasto_total,
+            saldo_restante=valor_inicial - gasto_total
+        ))
 
+    tot_rec = sum(v[0] for v in periodo.values())
+    tot_desp = sum(v[1] for v in periodo.values())
     return {
-        "periodo": f"{ano}-{mes:02d}",
+        "periodo": f"{ano}-{mes:02d}" if mes else str(ano),
         "total_receita": tot_rec,
         "total_despesa": tot_desp,
         "saldo": tot_rec - tot_desp,
         "detalhe_investimentos": lista_detalhada
     }
 
+# --- ROTAS DE BALANÇO ---
+
+@router.get("/balanco/mensal", response_model=schemas.BalancoGeral)
+def balanco_mensal(ano: int, mes: int = Query(..., ge=1, le=12), db: Session = Depends(get_db)):
+    """Retorna o balanço de um mês específico."""
+    return calcular_balanco(db, ano, mes)
+
 @router.get("/balanco/anual", response_model=schemas.BalancoGeral)
 def balanco_anual(ano: int, db: Session = Depends(get_db)):
     """Retorna o balanço anual acumulado."""
-    qry_geral = db.query(
-        Transacao.Tipo, func.sum(Transacao.Valor)
-    ).filter(extract('year', Transacao.Data) == ano).group_by(Transacao.Tipo).all()
+    return calcular_balanco(db, ano)
+
+# --- IMPORTAÇÃO DE EXTRATOS ---
+
+@router.post("/importar", response_model=schemas.ImportacaoExtrato)
+def importar_extrato(
+    file: UploadFile = File(...),
+    simular: bool = Query(False, description="Valida e conta sem gravar"),
+    db: Session = Depends(get_db)
+):
+    """
+    Importa um extrato bancário (CSV ou xlsx) de receitas e despesas numa única transação.
+    Linhas já importadas antes são ignoradas (hash do conteúdo); as inválidas são reportadas.
+    """
+    try:
+        return extratos_service.importar_extrato(db, file.filename, file.file, simular)
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail="O mesmo extrato está a ser importado em simultâneo. Tente novamente.")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Erro ao processar ficheiro: {e}")
+
+# --- SÉRIE MENSAL (GRÁFICOS) ---
+
+cache_series = CacheResultados("series_financas")
+
+def _ler_mes(valor: str):
+    try:
+        ano, mes = (int(p) for p in valor.split("-"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Mês inválido: {valor} (use AAAA-MM)")
+    if not 1 <= mes <= 12:
+        raise HTTPException(status_code=400, detail=f"Mês inválido: {valor} (use AAAA-MM)")
+    return ano, mes
+
+def _meses(inicio, fim):
+    ano, mes = inicio
+    while (ano, mes) <= fim:
+        yield ano, mes
+        ano, mes = (ano + 1, 1) if mes == 12 else (ano, mes + 1)
 
-    tot_rec = sum(float(v) for t, v in qry_geral if t == TipoTransacaoEnum.Receita)
-    tot_desp = sum(float(v) for t, v in qry_geral if t == TipoTransacaoEnum.Despesa)
+def calcular_serie_mensal(db: Session, inicio, fim) -> dict:
+    """Receita, despesa e saldo por mês (total e por investimento) a partir do razão de saldos mensais."""
+    linhas = saldos_service.totais_mensais(db, inicio, fim)
+    meses = list(_meses(inicio, fim))
 
-    investimentos = db.query(Financiamento).all()
-    lista_detalhada = [calcular_investimento_individual(db, inv, ano, None) for inv in investimentos]
+    def ponto(ano, mes, receita, despesa):
+        return schemas.PontoMensal(ano=ano, mes=mes, receita=receita, despesa=despesa, saldo=receita - despesa)
 
+    por_mes = {}
+    for (ano, mes, _), (receita, despesa) in linhas.items():  # Inclui o Fin_id 0 (sem investimento)
+        acumulado = por_mes.get((ano, mes), (0.0, 0.0))
+        por_mes[(ano, mes)] = (acumulado[0] + receita, acumulado[1] + despesa)
+    total = [ponto(ano, mes, *por_mes.get((ano, mes), (0.0, 0.0))) for ano, mes in meses]
+
+    investimentos = [
+        schemas.SerieInvestimento(
+            id=inv.Fin_id,
+            tipo_investimento=inv.Tipo or "Sem Nome",
+            pontos=[ponto(ano, mes, *linhas.get((ano, mes, inv.Fin_id), (0.0, 0.0))) for ano, mes in meses]
+        ) for inv in db.query(Financiamento).order_by(Financiamento.Fin_id).all()
+    ]
     return {
-        "periodo": str(ano),
-        "total_receita": tot_rec,
-        "total_despesa": tot_desp,
-        "saldo": tot_rec - tot_desp,
-        "detalhe_investimentos": lista_detalhada
+        "inicio": f"{inicio[0]}-{inicio[1]:02d}",
+        "fim": f"{fim[0]}-{fim[1]:02d}",
+        "total": total,
+        "investimentos": investimentos,
     }
 
+@router.get("/serie/mensal", response_model=schemas.SerieMensal)
+def serie_mensal(
+    ano: Optional[int] = None,
+    inicio: Optional[str] = Query(None, description="AAAA-MM (alternativa a `ano`)"),
+    fim: Optional[str] = Query(None, description="AAAA-MM (inclusive)"),
+    db: Session = Depends(get_db)
+):
+    """
+    Série mensal de receita/despesa/saldo de um ano (ou intervalo de meses), total e por investimento, numa chamada.
+    Os meses já fechados não mudam salvo escritas com data retroativa: o resultado fica em cache até à
+    próxima escrita de transações (versão "transacoes").
+    """
+    if inicio or fim:
+        if not (inicio and fim):
+            raise HTTPException(status_code=400, detail="Indique `inicio` e `fim` (AAAA-MM)")
+        intervalo = (_ler_mes(inicio), _ler_mes(fim))
+    else:
+        ano = ano or date.today().year
+        intervalo = ((ano, 1), (ano, 12))
+    if intervalo[0] > intervalo[1]:
+        raise HTTPException(status_code=400, detail="`inicio` posterior a `fim`")
+    if len(list(_meses(*intervalo))) > MAX_MESES_SERIE:
+        raise HTTPException(status_code=400, detail=f"Intervalo demasiado longo (máximo {MAX_MESES_SERIE} meses)")
+
+    return cache_series.obter(
+        db, intervalo, versoes.versao_atual(db, "transacoes"),
+        calcular=lambda sessao: calcular_serie_mensal(sessao, *intervalo),
+        obter_versao=lambda sessao: versoes.versao_atual(sessao, "transacoes")
+    )
+
+# --- PREVISÃO DE GASTO (BURN RATE) ---
+
+cache_previsao = CacheResultados("previsao_financas", max_entradas=4)
+
+def _versao_historico(db: Session, hoje: date):
+    # Versões mensais dos meses da série (versoes.nomes_periodo): escritas no mês corrente não a invalidam
+    return versoes.versoes_atuais(db, ["financiamentos"] + versoes.nomes_periodo("transacoes", *previsao_service.periodo_historico(hoje)))
+
+@router.get("/previsao", response_model=List[schemas.PrevisaoInvestimento])
+def previsao_investimentos(db: Session = Depends(get_db)):
+    """
+    Previsão por investimento: data de esgotamento e saldo no fim do ano, a partir da série mensal de despesa.
+    O ajuste dos meses fechados fica em cache até haver escritas nesses meses (ou em investimentos);
+    o gasto do mês corrente e os saldos são aplicados ao vivo em cada pedido.
+    """
+    hoje = date.today()
+    historico = cache_previsao.obter(
+        db, (hoje.year, hoje.month), _versao_historico(db, hoje),
+        calcular=lambda sessao: previsao_service.ajustar_historico(sessao, hoje),
+        obter_versao=lambda sessao: _versao_historico(sessao, hoje)
+    )
+    return previsao_service.calcular_previsao(db, hoje, historico)
+
 # --- CRUD DE INVESTIMENTOS (FINANCIAMENTOS) ---
 
 @router.get("/investimentos", response_model=List[schemas.FinanciamentoDisplay])
@@ -129,19 +204,78 @@ def criar_investimento(inv: schemas.FinanciamentoCreate, db: Session = Depends(g
 
 # --- CRUD DE DESPESAS (TRANSAÇÕES) ---
 
+def _ler_cursor(cursor: str):
+    """Cursor "AAAA-MM-DD:id" (ou "-:id" para despesas sem data) da última linha da página anterior."""
+    try:
+        data, transacao_id = cursor.split(":")
+        return (None if data == "-" else date.fromisoformat(data)), int(transacao_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
 @router.get("/despesas", response_model=List[schemas.DespesaHistorico])
-def listar_despesas(db: Session = Depends(get_db)):
-    """Lista todas as transações marcadas como Despesa."""
-    despesas = db.query(Transacao).filter(Transacao.Tipo == TipoTransacaoEnum.Despesa).order_by(Transacao.Data.desc()).all()
-    
+def listar_despesas(
+    response: Response,
+    investimento_id: Optional[int] = None,
+    fornecedor_id: Optional[int] = None,
+    data_inicio: Optional[date] = None,
+    data_fim: Optional[date] = None,
+    valor_min: Optional[float] = None,
+    valor_max: Optional[float] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db)
+):
+    """
+    Histórico de despesas, mais recentes primeiro, paginado por cursor (keyset sobre Data, Transacao_id):
+    cada página continua a partir da última linha da anterior sem OFFSET, usando o índice (Tipo, Data, Transacao_id).
+    O cursor da página seguinte vem no cabeçalho X-Proximo-Cursor (ausente na última página).
+    """
+    query = db.query(
+        Transacao.Transacao_id, Transacao.Descricao, Transacao.Valor, Transacao.Data,
+        Transacao.Fin_id, Transacao.Fornecedor_id, Financiamento.Tipo
+    ).outerjoin(Financiamento, Transacao.Fin_id == Financiamento.Fin_id).filter(Transacao.Tipo == TipoTransacaoEnum.Despesa)
+
+    if investimento_id is not None:
+        query = query.filter(Transacao.Fin_id == investimento_id)
+    if fornecedor_id is not None:
+        query = query.filter(Transacao.Fornecedor_id == fornecedor_id)
+    if data_inicio:
+        query = query.filter(Transacao.Data >= data_inicio)
+    if data_fim:
+        query = query.filter(Transacao.Data <= data_fim)
+    if valor_min is not None:
+        query = query.filter(Transacao.Valor >= valor_min)
+    if valor_max is not None:
+        query = query.filter(Transacao.Valor <= valor_max)
+
+    if cursor:
+        # Ordem descendente: as despesas sem data ficam no fim (como no MySQL)
+        data, transacao_id = _ler_cursor(cursor)
+        if data is None:
+            query = query.filter(Transacao.Data.is_(None), Transacao.Transacao_id < transacao_id)
+        else:
+            query = query.filter(or_(
+                Transacao.Data < data,
+                and_(Transacao.Data == data, Transacao.Transacao_id < transacao_id),
+                Transacao.Data.is_(None)
+            ))
+
+    linhas = query.order_by(Transacao.Data.desc(), Transacao.Transacao_id.desc()).limit(limit + 1).all()
+    if len(linhas) > limit:
+        linhas = linhas[:limit]
+        ultima = linhas[-1]
+        response.headers["X-Proximo-Cursor"] = f"{ultima.Data.isoformat() if ultima.Data else '-'}:{ultima.Transacao_id}"
+
     return [
         schemas.DespesaHistorico(
-            id=d.Transacao_id,
-            descricao=d.Descricao or "Sem descrição",
-            valor=float(d.Valor),
-            investimento_id=d.Fin_id,
-            investimento_nome=d.financiamento.Tipo if d.financiamento else "Geral"
-        ) for d in despesas
+            id=transacao_id,
+            descricao=descricao or "Sem descrição",
+            valor=float(valor or 0),
+            investimento_id=fin_id,
+            investimento_nome=nome_investimento or "Geral",
+            data=data,
+            fornecedor_id=fornecedor
+        ) for transacao_id, descricao, valor, data, fin_id, fornecedor, nome_investimento in linhas
     ]
 
 @router.post("/despesas", response_model=schemas.DespesaHistorico)
@@ -163,7 +297,9 @@ def criar_despesa(desp: schemas.DespesaCreate, db: Session = Depends(get_db)):
         descricao=nova.Descricao,
         valor=float(nova.Valor),
         investimento_id=nova.Fin_id,
-        investimento_nome=nova.financiamento.Tipo if nova.financiamento else "Geral"
+        investimento_nome=nova.financiamento.Tipo if nova.financiamento else "Geral",
+        data=nova.Data,
+        fornecedor_id=nova.Fornecedor_id
     )
 
 @router.delete("/despesas/{id}")
@@ -0,0 +1,139 @@
+from typing import List, Optional
+from datetime import date, timedelta
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from sqlalchemy import func, and_, case
+from sqlalchemy.exc import IntegrityError
+
+from app.db.database import get_db
+from app.db import models, schemas
+from app.db import versoes
+from app.core.cache import CacheResultados
+
+router = APIRouter()
+
+# --- CRUD DE FORNECEDORES ---
+
+@router.get("/", response_model=List[schemas.FornecedorDisplay])
+def listar_fornecedores(db: Session = Depends(get_db)):
+    return db.query(models.Fornecedor).order_by(models.Fornecedor.Nome).all()
+
+def _obter_fornecedor(db: Session, fornecedor_id: int) -> models.Fornecedor:
+    fornecedor = db.query(models.Fornecedor).filter(models.Fornecedor.Fornecedor_id == fornecedor_id).first()
+    if not fornecedor:
+        raise HTTPException(status_code=404, detail="Fornecedor não encontrado")
+    return fornecedor
+
+def _gravar(db: Session, fornecedor: models.Fornecedor) -> models.Fornecedor:
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail=f"Já existe um fornecedor com o NIF {fornecedor.NIF}")
+    db.refresh(fornecedor)
+    return fornecedor
+
+@router.get("/{fornecedor_id}", response_model=schemas.FornecedorDisplay)
+def obter_fornecedor(fornecedor_id: int, db: Session = Depends(get_db)):
+    return _obter_fornecedor(db, fornecedor_id)
+
+@router.post("/", response_model=schemas.FornecedorDisplay)
+def criar_fornecedor(dados: schemas.FornecedorCreate, db: Session = Depends(get_db)):
+    novo = models.Fornecedor(**dados.model_dump())
+    db.add(novo)
+    return _gravar(db, novo)
+
+@router.put("/{fornecedor_id}", response_model=schemas.FornecedorDisplay)
+def editar_fornecedor(fornecedor_id: int, dados: schemas.FornecedorCreate, db: Session = Depends(get_db)):
+    fornecedor = _obter_fornecedor(db, fornecedor_id)
+    for campo, valor in dados.model_dump().items():
+        setattr(fornecedor, campo, valor)
+    return _gravar(db, fornecedor)
+
+@router.delete("/{fornecedor_id}")
+def eliminar_fornecedor(fornecedor_id: int, db: Session = Depends(get_db)):
+    fornecedor = _obter_fornecedor(db, fornecedor_id)
+    if db.query(models.Transacao.Transacao_id).filter(models.Transacao.Fornecedor_id == fornecedor_id).first():
+        raise HTTPException(status_code=409, detail="O fornecedor tem transações associadas e não pode ser eliminado")
+    db.delete(fornecedor)
+    db.commit()
+    return {"message": "Fornecedor eliminado com sucesso"}
+
+# --- ANÁLISE DE GASTOS ---
+
+cache_gastos = CacheResultados("gastos_fornecedores")
+
+def intervalo_periodo(ano: Optional[int], mes: Optional[int], inicio: Optional[date], fim: Optional[date]):
+    """[início, fim] inclusivo: datas explícitas, um mês ou um ano (omissão: ano corrente)."""
+    if inicio or fim:
+        if not (inicio and fim) or inicio > fim:
+            raise HTTPException(status_code=400, detail="Indique `inicio` e `fim` (com inicio <= fim)")
+        return inicio, fim
+    ano = ano or date.today().year
+    if mes:
+        seguinte = date(ano + 1, 1, 1) if mes == 12 else date(ano, mes + 1, 1)
+        return date(ano, mes, 1), seguinte - timedelta(days=1)
+    return date(ano, 1, 1), date(ano, 12, 31)
+
+def calcular_gastos(db: Session, inicio: date, fim: date, top_n: int) -> dict:
+    """Despesa por fornecedor num só GROUP BY (índice Fornecedor_id, Data); top-N e contagem feitos no SQL."""
+    T = models.Transacao
+    no_periodo = and_(T.Tipo == models.TipoTransacaoEnum.Despesa, T.Data >= inicio, T.Data <= fim)
+
+    total_geral, sem_fornecedor = db.query(
+        func.coalesce(func.sum(T.Valor), 0),
+        func.coalesce(func.sum(case((T.Fornecedor_id.is_(None), T.Valor), else_=0)), 0)
+    ).filter(no_periodo).one()
+    total_geral = float(total_geral)
+
+    por_fornecedor = db.query(
+        T.Fornecedor_id, func.count().label("qtd"), func.sum(T.Valor).label("total"),
+        func.min(T.Data).label("primeira"), func.max(T.Data).label("ultima")
+    ).filter(no_periodo, T.Fornecedor_id.isnot(None)).group_by(T.Fornecedor_id).subquery()
+
+    qtd_fornecedores = db.query(func.count()).select_from(por_fornecedor).scalar()
+    linhas = db.query(por_fornecedor, models.Fornecedor.Nome, models.Fornecedor.NIF)\
+        .join(models.Fornecedor, models.Fornecedor.Fornecedor_id == por_fornecedor.c.Fornecedor_id)\
+        .order_by(por_fornecedor.c.total.desc()).limit(top_n).all()
+
+    fornecedores = [
+        schemas.GastoFornecedor(
+            id=fornecedor_id, nome=nome, nif=nif, qtd_transacoes=qtd, total=float(total),
+            percentagem=round(float(total) / total_geral * 100, 2) if total_geral else 0.0,
+            primeira_data=primeira, ultima_data=ultima
+        ) for fornecedor_id, qtd, total, primeira, ultima, nome, nif in linhas
+    ]
+    return {
+        "inicio": inicio,
+        "fim": fim,
+        "total": total_geral,
+        "sem_fornecedor": float(sem_fornecedor),
+        "qtd_fornecedores": qtd_fornecedores,
+        "fornecedores": fornecedores,
+    }
+
+def _versao_gastos(db: Session, inicio: date, fim: date):
+    return versoes.versoes_atuais(db, ["fornecedores"] + versoes.nomes_periodo("transacoes", inicio, fim))
+
+@router.get("/analise/gastos", response_model=schemas.GastosFornecedores)
+def gastos_por_fornecedor(
+    ano: Optional[int] = None,
+    mes: Optional[int] = Query(None, ge=1, le=12),
+    inicio: Optional[date] = None,
+    fim: Optional[date] = None,
+    top_n: int = Query(10, ge=1, le=100),
+    db: Session = Depends(get_db)
+):
+    """
+    Despesa por fornecedor no período (ano, mês ou intervalo de datas), ordenada por total.
+    Períodos já fechados ficam em cache até haver uma escrita de transações num dos seus meses (ou em massa
+    sem mês conhecido) ou de fornecedores; o período corrente é sempre calculado.
+    """
+    inicio, fim = intervalo_periodo(ano, mes, inicio, fim)
+    if fim >= date.today().replace(day=1):
+        return calcular_gastos(db, inicio, fim, top_n)
+    return cache_gastos.obter(
+        db, (inicio, fim, top_n), _versao_gastos(db, inicio, fim),
+        calcular=lambda sessao: calcular_gastos(sessao, inicio, fim, top_n),
+        obter_versao=lambda sessao: _versao_gastos(sessao, inicio, fim)
+    )
@@ -0,0 +1,49 @@
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from app.db.database import get_db
+from app.db import models, schemas
+from app.services import ordenados_service
+
+router = APIRouter()
+
+@router.post("/processar")
+def processar_ordenados(pedido: schemas.ProcessamentoOrdenados, db: Session = Depends(get_db)):
+    """
+    Gera os vencimentos do mês para todos os professores e staff (repetir o pedido não duplica).
+    Professores sem escalão e staff sem salário são ignorados e listados na resposta.
+    """
+    try:
+        criados = ordenados_service.processar_ordenados(db, pedido.ano, pedido.mes, pedido.data_pagamento, pedido.substituir)
+    except IntegrityError:
+        # Outro pedido processou o mesmo mês em simultâneo (índice único ux_ordenados_funcionario_mes)
+        db.rollback()
+        raise HTTPException(status_code=409, detail=f"Mês {pedido.ano}-{pedido.mes:02d} já processado (pedido concorrente)")
+    return {"message": f"Ordenados de {pedido.ano}-{pedido.mes:02d} processados.", **criados}
+
+@router.get("/", response_model=List[schemas.OrdenadoDisplay])
+def listar_ordenados(
+    ano: int,
+    mes: int = Query(..., ge=1, le=12),
+    tipo: Optional[models.TipoFuncionarioEnum] = None,
+    db: Session = Depends(get_db)
+):
+    query = db.query(models.Ordenado).filter(
+        models.Ordenado.Ano == ano, models.Ordenado.Mes == ordenados_service.mes_texto(mes)
+    )
+    if tipo:
+        query = query.filter(models.Ordenado.Tipo_Funcionario == tipo)
+    return query.order_by(models.Ordenado.Tipo_Funcionario, models.Ordenado.Funcionario_id).all()
+
+@router.get("/custos", response_model=List[schemas.CustoOrdenados])
+def custos_ordenados(
+    ano: int,
+    mes: Optional[int] = Query(None, ge=1, le=12),
+    dimensao: str = "departamento",
+    db: Session = Depends(get_db)
+):
+    """Custo de vencimentos por departamento ou por escalão (ano inteiro ou um mês)."""
+    if dimensao not in ordenados_service.DIMENSOES_CUSTO:
+        raise HTTPException(status_code=400, detail=f"Dimensão inválida. Use: {', '.join(ordenados_service.DIMENSOES_CUSTO)}")
+    return ordenados_service.custos(db, ano, mes, dimensao)
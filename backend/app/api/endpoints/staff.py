@@ -5,6 +5,7 @@ from sqlalchemy.orm import Session, joinedload
 from app.db.database import get_db
 from app.db import models, schemas
 from app.core.security import get_password_hash
+from app.services import ordenados_service
 import pandas as pd
 import io
 from openpyxl import Workbook
@@ -105,10 +106,8 @@ def create_staff(staff: schemas.StaffCreate, db: Session = Depends(get_db)):
             db.commit()
             db.refresh(new_prof)
             
-            # Buscar valor do salário através da relação para devolver ao frontend
-            salario_real = 0.0
-            if new_prof.escalao:
-                salario_real = float(new_prof.escalao.Valor_Base)
+            # Ainda sem Ordenados processados: vencimento pela fórmula do escalão
+            salario_real = ordenados_service.valor_professor(new_prof.escalao)
 
             return {
                 "Staff_id": new_prof.Professor_id,
@@ -178,8 +177,8 @@ def update_staff(staff_id: int, staff_data: schemas.StaffUpdate, db: Session = D
             db.commit()
             db.refresh(prof)
             
-            salario_real = 0.0
-            if prof.escalao: salario_real = float(prof.escalao.Valor_Base)
+            vencimentos = ordenados_service.ultimos_valores(db, models.TipoFuncionarioEnum.Professor, [prof.Professor_id])
+            salario_real = vencimentos.get(prof.Professor_id, ordenados_service.valor_professor(prof.escalao))
 
             return {
                 "Staff_id": prof.Professor_id,
@@ -228,6 +227,8 @@ def read_staff(skip: int = 0, limit: int = 1000, db: Session = Depends(get_db)):
         prof_query = db.query(models.Professor)\
             .options(joinedload(models.Professor.escalao), joinedload(models.Professor.departamento))\
             .all()
+        # Vencimento do último processamento (Ordenados); sem processamento, a fórmula do escalão
+        vencimentos = ordenados_service.ultimos_valores(db, models.TipoFuncionarioEnum.Professor)
             
         results = []
 
@@ -247,7 +248,7 @@ def read_staff(skip: int = 0, limit: int = 1000, db: Session = Depends(get_db)):
 
         for p in prof_query:
             # Ler valores das tabelas relacionadas
-            salario_valor = float(p.escalao.Valor_Base) if p.escalao else 0.0
+            salario_valor = vencimentos.get(p.Professor_id, ordenados_service.valor_professor(p.escalao))
             escalao_nome = p.escalao.Nome if p.escalao else None
             dept_nome = p.departamento.Nome if p.departamento else None
 
@@ -289,6 +290,7 @@ def delete_staff_member(id: int, role: Optional[str] = "staff", db: Session = De
             turmas_diretor = db.query(models.Turma).filter(models.Turma.DiretorT == id).all()
             for t in turmas_diretor: t.DiretorT = None
             db.query(models.TurmaDisciplina).filter(models.TurmaDisciplina.Professor_id == id).delete()
+            db.query(models.ResumoProfessorDisciplina).filter(models.ResumoProfessorDisciplina.Professor_id == id).delete()
             db.query(models.Ocorrencia).filter(models.Ocorrencia.Professor_id == id).delete()
             db.delete(member)
         else:
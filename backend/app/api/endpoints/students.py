@@ -2,9 +2,13 @@ from typing import List, Optional
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query
 from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.exc import IntegrityError
 from app.db.database import get_db
 from app.db import models
 from app.db import schemas
+from app.core import eventos
+from app.services import agregados_service
 import pandas as pd
 import io
 
@@ -197,6 +201,8 @@ def update_student(aluno_id: int, dados: schemas.AlunoUpdate, db: Session = Depe
             
             if not existe_mat:
                 db.add(models.Matricula(Aluno_id=aluno_id, Turma_id=nova_turma.Turma_id))
+                # A turma do aluno nesse ano mudou: refrescar os resumos das suas notas
+                agregados_service.atualizar_agregados_aluno(db, aluno_id)
 
     if db_aluno.encarregado_educacao:
         ee = db_aluno.encarregado_educacao
@@ -236,21 +242,57 @@ def delete_student(aluno_id: int, db: Session = Depends(get_db)):
     
     # Nota: Com matrículas e notas, apagar um aluno pode ser complexo.
     # O ideal é usar cascade na DB ou apagar dependências aqui.
-    db.query(models.Matricula).filter(models.Matricula.Aluno_id == aluno_id).delete()
+    pares_notas = db.query(models.Nota.Disc_id, models.Nota.Ano_letivo).filter(models.Nota.Aluno_id == aluno_id).distinct().all()
     db.query(models.Nota).filter(models.Nota.Aluno_id == aluno_id).delete()
+    # Recalcular resumos antes de apagar as matrículas (a turma do aluno ainda é conhecida)
+    agregados_service.atualizar_agregados_aluno(db, aluno_id, pares_notas)
+    db.query(models.ResumoAlunoAno).filter(models.ResumoAlunoAno.Aluno_id == aluno_id).delete()
+    db.query(models.Matricula).filter(models.Matricula.Aluno_id == aluno_id).delete()
     
     db.delete(aluno)
     db.commit()
     return {"message": "Aluno eliminado"}
 
 # --- 4. GESTÃO DE NOTAS ---
+
+def _evento_nota(db: Session, nota: models.Nota, ano_letivo: Optional[str], apagada: bool = False):
+    """Prepara (canal, payload) para avisar a pauta da turma do aluno; publicar só depois do commit."""
+    turma_id = agregados_service.obter_turma_do_aluno(db, nota.Aluno_id, ano_letivo) if ano_letivo else None
+    return (eventos.canal_turma(turma_id), eventos.celula_nota(nota, apagada)) if turma_id else None
+
+def _publicar_eventos(*lista_eventos):
+    for evento in lista_eventos:
+        if evento: eventos.publicar(*evento)
+
+def _conflito_nota(db: Session, erro: Exception) -> HTTPException:
+    """Desfaz a escrita e traduz o conflito em 409 (o flush pode acontecer antes do commit)."""
+    db.rollback()
+    if isinstance(erro, IntegrityError):
+        return HTTPException(status_code=409, detail="Nota já existe para este aluno/disciplina/ano")
+    return HTTPException(status_code=409, detail="A nota foi alterada por outro utilizador. Recarregue e tente novamente.")
+
 @router.put("/grades/{nota_id}", response_model=schemas.NotaDisplay)
 def update_student_grade(nota_id: int, grade_update: schemas.NotaUpdate, db: Session = Depends(get_db)):
     db_nota = db.query(models.Nota).filter(models.Nota.Nota_id == nota_id).first()
     if not db_nota: raise HTTPException(status_code=404, detail="Nota não encontrada")
+    ano_anterior = db_nota.Ano_letivo
     update_data = grade_update.dict(exclude_unset=True)
+    versao_cliente = update_data.pop("Versao", None)
+    if versao_cliente is not None and versao_cliente != db_nota.Versao:
+        raise HTTPException(status_code=409, detail="A nota foi alterada por outro utilizador. Recarregue e tente novamente.")
     for key, value in update_data.items(): setattr(db_nota, key, value)
-    db.commit()
+    evento_anterior = None
+    try:
+        # O UPDATE ... WHERE Versao = <lida> (version_id_col) sai no flush dos agregados, não só no commit
+        if ano_anterior != db_nota.Ano_letivo:
+            agregados_service.atualizar_agregados_nota(db, db_nota.Aluno_id, db_nota.Disc_id, ano_anterior)
+            evento_anterior = _evento_nota(db, db_nota, ano_anterior, apagada=True)
+        agregados_service.atualizar_agregados_nota(db, db_nota.Aluno_id, db_nota.Disc_id, db_nota.Ano_letivo)
+        evento = _evento_nota(db, db_nota, db_nota.Ano_letivo)
+        db.commit()
+    except (StaleDataError, IntegrityError) as erro:
+        raise _conflito_nota(db, erro)
+    _publicar_eventos(evento_anterior, evento)
     db.refresh(db_nota)
     disciplina = db.query(models.Disciplina).filter(models.Disciplina.Disc_id == db_nota.Disc_id).first()
     return {**db_nota.__dict__, "Disciplina_Nome": disciplina.Nome if disciplina else "Desconhecida"}
@@ -269,7 +311,8 @@ def read_student_grades(aluno_id: int, db: Session = Depends(get_db)):
             "Nota_3P": nota.Nota_3P,
             "Nota_Ex": nota.Nota_Ex,
             "Nota_Final": nota.Nota_Final,
-            "Ano_letivo": nota.Ano_letivo
+            "Ano_letivo": nota.Ano_letivo,
+            "Versao": nota.Versao
         })
     return results
 
@@ -279,7 +322,13 @@ def create_student_grade(aluno_id: int, nota: schemas.NotaCreate, db: Session =
     if not disciplina: raise HTTPException(status_code=404, detail="Disciplina não encontrada")
     nova_nota = models.Nota(Aluno_id=aluno_id, Disc_id=nota.Disc_id, Nota_1P=nota.Nota_1P, Nota_2P=nota.Nota_2P, Nota_3P=nota.Nota_3P, Nota_Ex=nota.Nota_Ex, Nota_Final=nota.Nota_Final, Ano_letivo=nota.Ano_letivo)
     db.add(nova_nota)
-    db.commit()
+    try:
+        agregados_service.atualizar_agregados_nota(db, aluno_id, nota.Disc_id, nota.Ano_letivo)
+        evento = _evento_nota(db, nova_nota, nota.Ano_letivo)
+        db.commit()
+    except IntegrityError as erro: # ux_notas_aluno_disc_ano
+        raise _conflito_nota(db, erro)
+    _publicar_eventos(evento)
     db.refresh(nova_nota)
     return {**nova_nota.__dict__, "Disciplina_Nome": disciplina.Nome}
 
@@ -287,8 +336,14 @@ def create_student_grade(aluno_id: int, nota: schemas.NotaCreate, db: Session =
 def delete_student_grade(nota_id: int, db: Session = Depends(get_db)):
     nota = db.query(models.Nota).filter(models.Nota.Nota_id == nota_id).first()
     if not nota: raise HTTPException(status_code=404, detail="Nota não encontrada")
+    evento = _evento_nota(db, nota, nota.Ano_letivo, apagada=True)
     db.delete(nota)
-    db.commit()
+    try:
+        agregados_service.atualizar_agregados_nota(db, nota.Aluno_id, nota.Disc_id, nota.Ano_letivo)
+        db.commit()
+    except StaleDataError as erro:
+        raise _conflito_nota(db, erro)
+    _publicar_eventos(evento)
     return {"message": "Nota eliminada"}
 
 # --- 5. IMPORT / EXPORT ---
@@ -1,10 +1,16 @@
-from typing import List, Any, Optional
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Dict, List, Any, Optional, Set, Tuple
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import and_, or_, desc
-from app.db.database import get_db
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy import and_, or_, desc, insert, tuple_
+from app.db.database import get_db, SessionLocal
 from app.db import models
 from app.db import schemas 
+from app.db import versoes
+from app.core import eventos
+from app.services import agregados_service
 import pandas as pd
 import io
 from fastapi.responses import StreamingResponse
@@ -13,10 +19,50 @@ router = APIRouter()
 
 # --- ENDPOINTS DE LEITURA ---
 
+def _etag_corresponde(etag: str, if_none_match: Optional[str]) -> bool:
+    """Comparação fraca (RFC 9110): lista separada por vírgulas, ignora W/ e aspas; "*" corresponde a tudo."""
+    if not if_none_match:
+        return False
+    alvo = etag.removeprefix("W/").strip('"')
+    for token in if_none_match.split(","):
+        token = token.strip()
+        if token == "*" or token.removeprefix("W/").strip('"') == alvo:
+            return True
+    return False
+
 @router.get("/", response_model=List[Any])
-def read_turmas(db: Session = Depends(get_db)):
-    turmas = db.query(models.Turma).all()
-    return [{"id": t.Turma_id, "nome": f"{t.Ano}º {t.Turma}", "ano_letivo": t.AnoLetivo} for t in turmas]
+def read_turmas(
+    request: Request,
+    response: Response,
+    ano_letivo: Optional[str] = None,
+    ano: Optional[int] = None,
+    diretor_id: Optional[int] = None,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(1000, ge=1, le=5000),
+    db: Session = Depends(get_db)
+):
+    # ETag = versão da tabela de turmas (+ filtros): lista inalterada -> 304 sem consultar as turmas
+    etag = f'W/"turmas-{versoes.versao_atual(db, "turmas")}-{ano_letivo}-{ano}-{diretor_id}-{skip}-{limit}"'
+    cabecalhos = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_corresponde(etag, request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=cabecalhos)
+
+    query = db.query(models.Turma)
+    if ano_letivo:
+        query = query.filter(models.Turma.AnoLetivo == ano_letivo)
+    if ano:
+        query = query.filter(models.Turma.Ano == ano)
+    if diretor_id:
+        query = query.filter(models.Turma.DiretorT == diretor_id)
+
+    response.headers.update(cabecalhos)
+    response.headers["X-Total-Count"] = str(query.count())
+
+    turmas = query.order_by(desc(models.Turma.AnoLetivo), models.Turma.Ano, models.Turma.Turma).offset(skip).limit(limit).all()
+    return [{
+        "id": t.Turma_id, "nome": f"{t.Ano}º {t.Turma}", "ano_letivo": t.AnoLetivo,
+        "ano": t.Ano, "diretor_id": t.DiretorT
+    } for t in turmas]
 
 @router.get("/{turma_id}/details")
 def get_turma_details(turma_id: int, db: Session = Depends(get_db)):
@@ -67,7 +113,8 @@ def get_turma_details(turma_id: int, db: Session = Depends(get_db)):
                     "p2": nota_real.Nota_2P,
                     "p3": nota_real.Nota_3P,
                     "exame": nota_real.Nota_Ex,  # <--- ADICIONADO LEITURA
-                    "final": nota_real.Nota_Final
+                    "final": nota_real.Nota_Final,
+                    "versao": nota_real.Versao
                 })
             else:
                 lista_notas_final.append({
@@ -75,7 +122,8 @@ def get_turma_details(turma_id: int, db: Session = Depends(get_db)):
                     "aluno_nome": aluno.Nome,
                     "disciplina_id": td.Disc_id,
                     "disciplina_nome": td.disciplina.Nome,
-                    "p1": 0, "p2": 0, "p3": 0, "exame": 0, "final": 0 # <--- ADICIONADO DEFAULT
+                    "p1": 0, "p2": 0, "p3": 0, "exame": 0, "final": 0, # <--- ADICIONADO DEFAULT
+                    "versao": 0
                 })
 
     return {
@@ -92,52 +140,190 @@ def get_turma_details(turma_id: int, db: Session = Depends(get_db)):
         "notas": lista_notas_final
     }
 
+# --- ATUALIZAÇÕES EM TEMPO REAL (SSE) ---
+
+def _turma_existe(turma_id: int) -> bool:
+    # Sessão curta: o stream pode durar horas e não deve prender uma ligação do pool
+    with SessionLocal() as db:
+        return db.query(models.Turma.Turma_id).filter(models.Turma.Turma_id == turma_id).first() is not None
+
+@router.get("/{turma_id}/stream")
+async def stream_pauta_turma(turma_id: int, request: Request, desde: Optional[str] = None):
+    """
+    Server-Sent Events com as células da pauta alteradas nesta turma.
+    Para retomar, o cliente envia o último id recebido (header Last-Event-ID ou ?desde=).
+    Um evento 'reset' indica que houve eventos perdidos e a pauta deve ser recarregada.
+    """
+    if not await run_in_threadpool(_turma_existe, turma_id):
+        raise HTTPException(404, "Turma não encontrada")
+
+    ultimo_id = request.headers.get("last-event-id") or desde
+    return StreamingResponse(
+        eventos.stream_sse(eventos.canal_turma(turma_id), ultimo_id, request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # --- ENDPOINTS DE ESCRITA ---
 
+def _valores_celula(nota_db: Optional[models.Nota]) -> dict:
+    if not nota_db:
+        return {"p1": 0, "p2": 0, "p3": 0, "exame": 0, "final": 0}
+    return {"p1": nota_db.Nota_1P, "p2": nota_db.Nota_2P, "p3": nota_db.Nota_3P, "exame": nota_db.Nota_Ex, "final": nota_db.Nota_Final}
+
+def _ler_celula(db: Session, aluno_id: int, disc_id: int, ano_letivo: str, bloquear: bool = False) -> Optional[models.Nota]:
+    query = db.query(models.Nota).filter(
+        models.Nota.Aluno_id == aluno_id,
+        models.Nota.Disc_id == disc_id,
+        models.Nota.Ano_letivo == ano_letivo
+    )
+    if bloquear:
+        # Leitura com lock: devolve a última versão gravada, não a fotografia da transação
+        query = query.populate_existing().with_for_update(read=True)
+    return query.first()
+
+def _gravar_celula(db: Session, turma: models.Turma, nota: schemas.NotaTurmaPayload):
+    """
+    Grava uma célula da pauta num SAVEPOINT próprio.
+    O UPDATE é condicional à versão lida (version_id_col da Nota); se o cliente enviar `versao`,
+    esta tem de coincidir com a atual. Devolve (nota_db, None) ou (None, conflito).
+    """
+    try:
+        with db.begin_nested():
+            nota_db = _ler_celula(db, nota.aluno_id, nota.disciplina_id, turma.AnoLetivo)
+
+            if nota_db:
+                if nota.versao is not None and nota.versao != nota_db.Versao:
+                    return None, _conflito(nota, nota_db)
+                if nota.p1 is not None: nota_db.Nota_1P = nota.p1
+                if nota.p2 is not None: nota_db.Nota_2P = nota.p2
+                if nota.p3 is not None: nota_db.Nota_3P = nota.p3
+                if nota.exame is not None: nota_db.Nota_Ex = nota.exame # <--- ADICIONADO UPDATE
+                if nota.final is not None: nota_db.Nota_Final = nota.final
+            else:
+                if nota.versao: # O cliente conhecia uma versão que entretanto foi apagada
+                    return None, _conflito(nota, None)
+                nota_db = models.Nota(
+                    Aluno_id=nota.aluno_id, Disc_id=nota.disciplina_id, Ano_letivo=turma.AnoLetivo,
+                    Nota_1P=nota.p1 or 0, Nota_2P=nota.p2 or 0, Nota_3P=nota.p3 or 0, 
+                    Nota_Ex=nota.exame or 0, # <--- ADICIONADO CREATE
+                    Nota_Final=nota.final or 0
+                )
+                db.add(nota_db)
+            db.flush()
+    except (StaleDataError, IntegrityError):
+        # Outro utilizador gravou a mesma célula entre a nossa leitura e o UPDATE/INSERT
+        return None, _conflito(nota, _ler_celula(db, nota.aluno_id, nota.disciplina_id, turma.AnoLetivo, bloquear=True))
+    return nota_db, None
+
+def _conflito(nota: schemas.NotaTurmaPayload, atual: Optional[models.Nota]) -> dict:
+    return {
+        "aluno_id": nota.aluno_id,
+        "disciplina_id": nota.disciplina_id,
+        "versao_enviada": nota.versao,
+        "versao_atual": atual.Versao if atual else 0,
+        "atual": _valores_celula(atual)
+    }
+
 @router.post("/{turma_id}/notas")
 def update_grade(turma_id: int, nota: schemas.NotaTurmaPayload, db: Session = Depends(get_db)): 
     turma = db.query(models.Turma).filter(models.Turma.Turma_id == turma_id).first()
     if not turma: raise HTTPException(404, "Turma não encontrada")
 
-    nota_db = db.query(models.Nota).filter(
-        models.Nota.Aluno_id == nota.aluno_id,
-        models.Nota.Disc_id == nota.disciplina_id,
-        models.Nota.Ano_letivo == turma.AnoLetivo
-    ).first()
+    nota_db, conflito = _gravar_celula(db, turma, nota)
+    if conflito:
+        db.rollback()
+        raise HTTPException(409, {"message": "A nota foi alterada por outro utilizador.", **conflito})
 
-    if nota_db:
-        if nota.p1 is not None: nota_db.Nota_1P = nota.p1
-        if nota.p2 is not None: nota_db.Nota_2P = nota.p2
-        if nota.p3 is not None: nota_db.Nota_3P = nota.p3
-        if nota.exame is not None: nota_db.Nota_Ex = nota.exame # <--- ADICIONADO UPDATE
-        if nota.final is not None: nota_db.Nota_Final = nota.final
-    else:
-        nova_nota = models.Nota(
-            Aluno_id=nota.aluno_id, Disc_id=nota.disciplina_id, Ano_letivo=turma.AnoLetivo,
-            Nota_1P=nota.p1 or 0, Nota_2P=nota.p2 or 0, Nota_3P=nota.p3 or 0, 
-            Nota_Ex=nota.exame or 0, # <--- ADICIONADO CREATE
-            Nota_Final=nota.final or 0
-        )
-        db.add(nova_nota)
-    
+    agregados_service.atualizar_agregados_nota(db, nota.aluno_id, nota.disciplina_id, turma.AnoLetivo)
     db.commit()
-    return {"message": "Nota atualizada"}
+    eventos.publicar(eventos.canal_turma(turma_id), eventos.celula_nota(nota_db))
+    return {"message": "Nota atualizada", "versao": nota_db.Versao}
+
+@router.post("/{turma_id}/notas/lote", response_model=schemas.NotasLoteResultado)
+def update_grades_batch(turma_id: int, dados: schemas.NotasLotePayload, db: Session = Depends(get_db)):
+    """
+    Grava várias células da pauta numa só transação.
+    Conflitos de versão são reportados por célula; as restantes células são gravadas na mesma.
+    """
+    turma = db.query(models.Turma).filter(models.Turma.Turma_id == turma_id).first()
+    if not turma: raise HTTPException(404, "Turma não encontrada")
+
+    gravadas, conflitos = [], []
+    for nota in dados.notas:
+        nota_db, conflito = _gravar_celula(db, turma, nota)
+        if conflito: conflitos.append(conflito)
+        else: gravadas.append(nota_db)
+
+    agregados_service.atualizar_agregados_notas(db, {(n.Aluno_id, n.Disc_id, turma.AnoLetivo) for n in gravadas})
+    db.commit()
+
+    resultado = []
+    for nota_db in gravadas:
+        celula = eventos.celula_nota(nota_db)
+        eventos.publicar(eventos.canal_turma(turma_id), celula)
+        resultado.append(celula)
+    return {"gravadas": resultado, "conflitos": conflitos}
+
+# --- EQUIPAS DOCENTES ---
+
+def _aplicar_atribuicoes(db: Session, turmas: List[models.Turma], desejadas: Dict[int, Set[Tuple[int, int]]]) -> Dict[str, int]:
+    """
+    Substitui as atribuições (disciplina, professor) das turmas indicadas escrevendo apenas a diferença:
+    linhas que deixaram de existir são apagadas e as novas inseridas. As restantes não são tocadas.
+    """
+    ano_por_turma = {t.Turma_id: t.AnoLetivo for t in turmas}
+    atuais = {
+        (td.Turma_id, td.Disc_id, td.Professor_id)
+        for td in db.query(models.TurmaDisciplina).filter(models.TurmaDisciplina.Turma_id.in_(list(ano_por_turma))).all()
+    }
+    pretendidas = {(turma_id, disc_id, prof_id) for turma_id, pares in desejadas.items() for disc_id, prof_id in pares}
+
+    remover = atuais - pretendidas
+    inserir = pretendidas - atuais
+
+    if remover:
+        db.query(models.TurmaDisciplina).filter(
+            tuple_(models.TurmaDisciplina.Turma_id, models.TurmaDisciplina.Disc_id, models.TurmaDisciplina.Professor_id).in_(list(remover))
+        ).delete(synchronize_session=False)
+    if inserir:
+        db.execute(insert(models.TurmaDisciplina), [
+            {"Turma_id": turma_id, "Disc_id": disc_id, "Professor_id": prof_id} for turma_id, disc_id, prof_id in inserir
+        ])
+
+    # Só os professores cujas atribuições mudaram precisam de resumos refrescados
+    afetados = {(prof_id, disc_id, ano_por_turma[turma_id]) for turma_id, disc_id, prof_id in remover | inserir}
+    agregados_service.atualizar_agregados_professores(db, afetados)
+    return {"inseridas": len(inserir), "removidas": len(remover), "inalteradas": len(atuais & pretendidas)}
+
+@router.put("/professores")
+def update_professores_lote(dados: schemas.AtribuicoesLoteUpdate, db: Session = Depends(get_db)):
+    """Atribui as equipas docentes de várias turmas numa única transação (turmas omitidas não são alteradas)."""
+    desejadas: Dict[int, Set[Tuple[int, int]]] = {}
+    for atribuicao in dados.turmas:
+        desejadas.setdefault(atribuicao.turma_id, set()).update((p.disciplina_id, p.professor_id) for p in atribuicao.professores)
+    if not desejadas:
+        return {"message": "Nada a atualizar", "inseridas": 0, "removidas": 0, "inalteradas": 0}
+
+    turmas = db.query(models.Turma).filter(models.Turma.Turma_id.in_(list(desejadas))).all()
+    em_falta = set(desejadas) - {t.Turma_id for t in turmas}
+    if em_falta: raise HTTPException(404, f"Turmas não encontradas: {sorted(em_falta)}")
+
+    try:
+        resumo = _aplicar_atribuicoes(db, turmas, desejadas)
+        db.commit()
+        return {"message": f"Equipas docentes de {len(turmas)} turmas atualizadas", **resumo}
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(400, f"Erro: {str(e)}")
 
 @router.put("/{turma_id}/professores")
 def update_turma_professores(turma_id: int, dados: schemas.TurmaProfessoresUpdate, db: Session = Depends(get_db)): 
     turma = db.query(models.Turma).filter(models.Turma.Turma_id == turma_id).first()
     if not turma: raise HTTPException(404, "Turma não encontrada")
 
-    db.query(models.TurmaDisciplina).filter(models.TurmaDisciplina.Turma_id == turma_id).delete()
-    
-    for item in dados.professores:
-        db.add(models.TurmaDisciplina(
-            Turma_id=turma_id,
-            Disc_id=item.disciplina_id,
-            Professor_id=item.professor_id
-        ))
-    
     try:
+        _aplicar_atribuicoes(db, [turma], {turma_id: {(p.disciplina_id, p.professor_id) for p in dados.professores}})
         db.commit()
         return {"message": "Equipa docente atualizada"}
     except Exception as e:
@@ -196,6 +382,9 @@ def transitar_ano_global(regras: schemas.RegrasTransicao, db: Session = Depends(
     id_mat = get_disciplina_id_por_nome(db, "matemática")
 
     stats = {"transitados": 0, "retidos": 0, "finalistas": 0, "turmas_criadas": 0}
+
+    # Negativas e nota mínima de cada aluno vêm dos resumos materializados (uma query para o ano)
+    resumos = {r.Aluno_id: r for r in db.query(models.ResumoAlunoAno).filter(models.ResumoAlunoAno.Ano_letivo == ano_atual_str).all()}
     turmas_antigas = db.query(models.Turma).filter(models.Turma.AnoLetivo == ano_atual_str).all()
 
     for t_antiga in turmas_antigas:
@@ -230,8 +419,8 @@ def transitar_ano_global(regras: schemas.RegrasTransicao, db: Session = Depends(
             aluno = mat.aluno
             if not aluno: continue
 
-            notas = db.query(models.Nota).filter(models.Nota.Aluno_id == aluno.Aluno_id, models.Nota.Ano_letivo == ano_atual_str).all()
-            negativas_count = sum(1 for n in notas if n.Nota_Final < 10)
+            resumo = resumos.get(aluno.Aluno_id)
+            negativas_count = resumo.Negativas if resumo else 0
             
             # --- Regras de Aprovação PT ---
             aprovado = True
@@ -244,13 +433,15 @@ def transitar_ano_global(regras: schemas.RegrasTransicao, db: Session = Depends(
             elif t_antiga.Ano == 9:
                 if negativas_count > 2: aprovado = False
                 elif negativas_count == 2:
+                    # Só neste caso precisamos das notas individuais (PT e MAT)
+                    notas = db.query(models.Nota).filter(models.Nota.Aluno_id == aluno.Aluno_id, models.Nota.Ano_letivo == ano_atual_str).all()
                     tem_nega_pt = any(n.Nota_Final < 10 and n.Disc_id == id_pt for n in notas)
                     tem_nega_mat = any(n.Nota_Final < 10 and n.Disc_id == id_mat for n in notas)
                     if tem_nega_pt and tem_nega_mat: aprovado = False
             
             # Secundário (10º e 11º)
             elif 10 <= t_antiga.Ano <= 11:
-                tem_nota_minima = any(n.Nota_Final < 6 for n in notas)
+                tem_nota_minima = resumo is not None and resumo.Nota_Minima is not None and resumo.Nota_Minima < 6
                 if negativas_count > 2 or tem_nota_minima: aprovado = False
             
             # 12º Ano
@@ -0,0 +1,88 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable
+from sqlalchemy.orm import Session
+from app.db.database import SessionLocal
+
+# Cache de resultados em memória (por processo), invalidado por versão de dados.
+# - Cada entrada guarda a versão dos dados com que foi calculada (ex: contadores de app/db/versoes.py).
+# - Versão igual: hit. Versão diferente: "stale-while-revalidate" - devolve o valor antigo e
+#   recalcula em segundo plano (uma vez por chave), desde que o valor não seja demasiado antigo.
+# - Sem entrada (ou demasiado antiga): miss, calcula no pedido.
+
+class CacheResultados:
+    def __init__(self, nome: str, max_entradas: int = 128, max_idade_stale: float = 300.0):
+        self.nome = nome
+        self.max_entradas = max_entradas
+        self.max_idade_stale = max_idade_stale
+        self._entradas: "OrderedDict[Hashable, tuple]" = OrderedDict()  # chave -> (versao, valor, calculado_em)
+        self._lock = threading.Lock()
+        self._a_recalcular = set()
+        self._metricas = {"hits": 0, "misses": 0, "stale": 0, "revalidacoes": 0, "erros": 0}
+
+    def obter(self, db: Session, chave: Hashable, versao: Hashable, calcular: Callable[[Session], Any],
+              obter_versao: Callable[[Session], Hashable]) -> Any:
+        """
+        `calcular(db)` produz o valor; `obter_versao(db)` lê a versão atual dos dados
+        (usada pela revalidação em segundo plano, que tem a sua própria sessão).
+        """
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada and entrada[0] == versao:
+                self._entradas.move_to_end(chave)
+                self._metricas["hits"] += 1
+                return entrada[1]
+            if entrada and time.monotonic() - entrada[2] <= self.max_idade_stale:
+                self._metricas["stale"] += 1
+                if chave not in self._a_recalcular:
+                    self._a_recalcular.add(chave)
+                    threading.Thread(target=self._revalidar, args=(chave, calcular, obter_versao), daemon=True).start()
+                return entrada[1]
+            self._metricas["misses"] += 1
+
+        valor = calcular(db)
+        self._guardar(chave, versao, valor)
+        return valor
+
+    def _revalidar(self, chave: Hashable, calcular: Callable[[Session], Any], obter_versao: Callable[[Session], Hashable]):
+        try:
+            with SessionLocal() as db:
+                # Versão lida ANTES do cálculo: uma escrita entretanto volta a marcar a entrada como antiga
+                versao = obter_versao(db)
+                valor = calcular(db)
+            self._guardar(chave, versao, valor)
+            with self._lock:
+                self._metricas["revalidacoes"] += 1
+        except Exception as e:
+            with self._lock:
+                self._metricas["erros"] += 1
+            print(f"Erro ao revalidar cache '{self.nome}' ({chave}): {e}")
+        finally:
+            with self._lock:
+                self._a_recalcular.discard(chave)
+
+    def _guardar(self, chave: Hashable, versao: Hashable, valor: Any):
+        with self._lock:
+            self._entradas[chave] = (versao, valor, time.monotonic())
+            self._entradas.move_to_end(chave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def atualizar(self, chave: Hashable, versao: Hashable, valor: Any):
+        """Guarda um valor calculado fora de `obter` (ex: recálculo desencadeado por uma escrita)."""
+        self._guardar(chave, versao, valor)
+
+    def limpar(self):
+        with self._lock:
+            self._entradas.clear()
+
+    def metricas(self) -> Dict[str, Any]:
+        with self._lock:
+            pedidos = self._metricas["hits"] + self._metricas["misses"] + self._metricas["stale"]
+            return {
+                "cache": self.nome,
+                "entradas": len(self._entradas),
+                **self._metricas,
+                "taxa_acerto": round((self._metricas["hits"] + self._metricas["stale"]) / pedidos, 3) if pedidos else None
+            }
@@ -1,3 +1,4 @@
+from typing import Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
@@ -12,6 +13,13 @@ class Settings(BaseSettings):
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
 
+    # Broker de eventos (SSE). Vazio = em memória (1 worker); "redis://..." para vários workers
+    EVENT_BROKER_URL: Optional[str] = None
+
+    # Pedidos a GET /consultas/ servidos em simultâneo (cada um corre as suas secções em paralelo).
+    # Cada secção usa uma ligação do pool da base de dados: manter secções x pedidos abaixo do tamanho do pool.
+    CONSULTAS_PEDIDOS_PARALELOS: int = 4
+
     # Configuração para ler o ficheiro .env
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
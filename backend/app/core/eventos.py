@@ -0,0 +1,257 @@
+import asyncio
+import itertools
+import json
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict, deque
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+from app.core.config import settings
+
+# Canal de eventos (Server-Sent Events) com broker substituível.
+# - BrokerMemoria: um único processo (uvicorn com 1 worker).
+# - BrokerRedis: vários workers/máquinas (EVENT_BROKER_URL=redis://...).
+# Cada evento tem um id que serve de token de retoma (header Last-Event-ID).
+
+# Evento: (id, dados). None = keepalive (nenhum evento dentro do intervalo).
+Evento = Optional[Tuple[str, Dict[str, Any]]]
+
+EVENTO_RESET = {"tipo": "reset"}  # O cliente perdeu eventos: deve recarregar o estado completo
+
+class Broker(ABC):
+    """Interface comum dos brokers de eventos."""
+
+    @abstractmethod
+    def publicar(self, canal: str, dados: Dict[str, Any]) -> str:
+        ...
+
+    @abstractmethod
+    def subscrever(self, canal: str, ultimo_id: Optional[str] = None, keepalive: float = 15.0) -> AsyncIterator[Evento]:
+        ...
+
+class BrokerMemoria(Broker):
+    """
+    Broker em memória. `publicar` pode ser chamado a partir das threads dos endpoints síncronos;
+    a entrega aos subscritores (asyncio) é feita com call_soon_threadsafe.
+    """
+
+    def __init__(self, historico: int = 500):
+        self._lock = threading.Lock()
+        self._epoca = str(int(time.time()))  # Muda a cada arranque: ids antigos deixam de ser válidos
+        self._seq = itertools.count(1)
+        self._ultimo_seq = 0
+        self._max_historico = historico
+        self._historico = defaultdict(deque)
+        # Canal -> seq do último evento descartado do histórico (a sequência é global, o histórico é por canal)
+        self._descartado: Dict[str, int] = defaultdict(int)
+        self._subscritores = defaultdict(set)
+
+    def _seq_do_id(self, evento_id: Optional[str]) -> Optional[int]:
+        if not evento_id: return None
+        epoca, _, seq = evento_id.partition("-")
+        if epoca != self._epoca or not seq.isdigit(): return -1
+        return int(seq)
+
+    def publicar(self, canal: str, dados: Dict[str, Any]) -> str:
+        with self._lock:
+            self._ultimo_seq = next(self._seq)
+            evento_id = f"{self._epoca}-{self._ultimo_seq}"
+            historico = self._historico[canal]
+            historico.append((evento_id, dados))
+            if len(historico) > self._max_historico:
+                self._descartado[canal] = self._seq_do_id(historico.popleft()[0])
+            subscritores = list(self._subscritores[canal])
+
+        for loop, fila in subscritores:
+            try:
+                loop.call_soon_threadsafe(fila.put_nowait, (evento_id, dados))
+            except RuntimeError:
+                pass  # Loop do subscritor já fechado
+        return evento_id
+
+    async def subscrever(self, canal: str, ultimo_id: Optional[str] = None, keepalive: float = 15.0) -> AsyncIterator[Evento]:
+        loop = asyncio.get_running_loop()
+        fila: asyncio.Queue = asyncio.Queue()
+        entrada = (loop, fila)
+
+        # Registo e leitura do histórico sob o mesmo lock: nenhum evento perdido nem duplicado
+        with self._lock:
+            self._subscritores[canal].add(entrada)
+            pendentes = []
+            seq_cliente = self._seq_do_id(ultimo_id)
+            if seq_cliente is not None:
+                if seq_cliente < 0 or seq_cliente < self._descartado[canal]:
+                    # O id do reset é a posição atual: ao reconectar com ele, o cliente não recebe outro reset
+                    pendentes.append((f"{self._epoca}-{self._ultimo_seq}", EVENTO_RESET))
+                else:
+                    pendentes.extend(e for e in self._historico[canal] if self._seq_do_id(e[0]) > seq_cliente)
+
+        try:
+            for evento in pendentes:
+                yield evento
+            while True:
+                try:
+                    yield await asyncio.wait_for(fila.get(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            with self._lock:
+                self._subscritores[canal].discard(entrada)
+
+class BrokerRedis(Broker):
+    """
+    Broker baseado em Redis Streams (partilhado entre workers).
+    Requer o pacote opcional `redis` (pip install redis).
+    """
+
+    def __init__(self, url: str, historico: int = 1000):
+        try:
+            import redis
+            import redis.asyncio as redis_async
+        except ImportError as e:
+            raise RuntimeError("EVENT_BROKER_URL aponta para Redis mas o pacote 'redis' não está instalado.") from e
+        self._url = url
+        self._historico = historico
+        self._cliente = redis.Redis.from_url(url, decode_responses=True)
+        self._redis_async = redis_async
+
+    def _chave(self, canal: str) -> str:
+        return f"sige:eventos:{canal}"
+
+    def publicar(self, canal: str, dados: Dict[str, Any]) -> str:
+        return self._cliente.xadd(
+            self._chave(canal), {"dados": json.dumps(dados, ensure_ascii=False)},
+            maxlen=self._historico, approximate=True
+        )
+
+    async def subscrever(self, canal: str, ultimo_id: Optional[str] = None, keepalive: float = 15.0) -> AsyncIterator[Evento]:
+        cliente = self._redis_async.Redis.from_url(self._url, decode_responses=True)
+        chave = self._chave(canal)
+        try:
+            cursor = "$"
+            if ultimo_id:
+                cursor = ultimo_id
+                primeiro = await cliente.xrange(chave, count=1)
+                if primeiro and _id_redis_menor(ultimo_id, primeiro[0][0]):
+                    # Retomar a partir do fim do stream (e usar esse id no reset, para não repetir o reset)
+                    ultimo = await cliente.xrevrange(chave, count=1)
+                    cursor = ultimo[0][0] if ultimo else "$"
+                    yield (cursor if ultimo else ultimo_id, EVENTO_RESET)
+
+            while True:
+                resposta = await cliente.xread({chave: cursor}, block=int(keepalive * 1000), count=100)
+                if not resposta:
+                    yield None
+                    continue
+                for _, entradas in resposta:
+                    for evento_id, campos in entradas:
+                        cursor = evento_id
+                        yield (evento_id, json.loads(campos["dados"]))
+        finally:
+            await cliente.aclose()
+
+def _id_redis_menor(a: str, b: str) -> bool:
+    try:
+        return tuple(int(x) for x in a.split("-")) < tuple(int(x) for x in b.split("-"))
+    except ValueError:
+        return True
+
+def criar_broker(url: Optional[str]) -> Broker:
+    if url and url.startswith(("redis://", "rediss://")):
+        return BrokerRedis(url)
+    return BrokerMemoria()
+
+broker: Broker = criar_broker(settings.EVENT_BROKER_URL)
+
+def definir_broker(novo: Broker):
+    """Permite substituir o broker (ex: implementação própria para outro sistema de mensagens)."""
+    global broker
+    broker = novo
+
+def publicar(canal: str, dados: Dict[str, Any]) -> Optional[str]:
+    """Publica sem nunca fazer falhar a escrita que originou o evento."""
+    try:
+        return broker.publicar(canal, dados)
+    except Exception as e:
+        print(f"Erro ao publicar evento em '{canal}': {e}")
+        return None
+
+async def stream_sse(canal: str, ultimo_id: Optional[str], request) -> AsyncIterator[str]:
+    """Formata os eventos de um canal no protocolo text/event-stream."""
+    yield "retry: 3000\n\n"
+    async for evento in broker.subscrever(canal, ultimo_id):
+        if await request.is_disconnected():
+            break
+        if evento is None:
+            yield ": keepalive\n\n"
+            continue
+        evento_id, dados = evento
+        yield f"id: {evento_id}\nevent: {dados.get('tipo', 'message')}\ndata: {json.dumps(dados, ensure_ascii=False)}\n\n"
+
+# --- PRODUTORES COM DEBOUNCE ---
+
+class Debounce:
+    """
+    Junta rajadas de sinais numa única execução de `funcao` (numa thread própria):
+    corre quando passam `espera` segundos sem novos sinais, ou ao fim de `espera_maxima`
+    desde o primeiro sinal da rajada (escritas contínuas não adiam a atualização para sempre).
+    """
+
+    def __init__(self, nome: str, funcao, espera: float = 1.0, espera_maxima: float = 5.0):
+        self.nome = nome
+        self.funcao = funcao
+        self.espera = espera
+        self.espera_maxima = espera_maxima
+        self._condicao = threading.Condition()
+        self._primeiro: Optional[float] = None
+        self._ultimo: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def sinalizar(self):
+        with self._condicao:
+            agora = time.monotonic()
+            if self._primeiro is None:
+                self._primeiro = agora
+            self._ultimo = agora
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._ciclo, daemon=True, name=f"debounce-{self.nome}")
+                self._thread.start()
+            self._condicao.notify()
+
+    def _ciclo(self):
+        while True:
+            with self._condicao:
+                while self._primeiro is None:
+                    self._condicao.wait()
+                while True:
+                    agora = time.monotonic()
+                    prazo = min(self._ultimo + self.espera, self._primeiro + self.espera_maxima)
+                    if agora >= prazo:
+                        break
+                    self._condicao.wait(prazo - agora)
+                self._primeiro = self._ultimo = None
+            try:
+                self.funcao()
+            except Exception as e:
+                print(f"Erro no produtor '{self.nome}': {e}")
+
+# --- CANAIS ---
+
+CANAL_DASHBOARD = "dashboard"
+
+def canal_turma(turma_id: int) -> str:
+    return f"turma:{turma_id}"
+
+def celula_nota(nota, apagada: bool = False) -> Dict[str, Any]:
+    """Payload de uma célula da pauta (mesmos nomes que GET /turmas/{id}/details)."""
+    return {
+        "tipo": "nota",
+        "aluno_id": nota.Aluno_id,
+        "disciplina_id": nota.Disc_id,
+        "p1": 0 if apagada else nota.Nota_1P,
+        "p2": 0 if apagada else nota.Nota_2P,
+        "p3": 0 if apagada else nota.Nota_3P,
+        "exame": 0 if apagada else nota.Nota_Ex,
+        "final": 0 if apagada else nota.Nota_Final,
+        "versao": 0 if apagada else nota.Versao
+    }
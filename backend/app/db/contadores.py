@@ -0,0 +1,207 @@
+import random
+import threading
+from decimal import Decimal
+from typing import Dict, List
+from sqlalchemy import event, func, case, inspect, select, update
+from sqlalchemy.orm import Session, object_session
+from app.db import models
+from app.db.database import SessionLocal
+
+# Contadores do dashboard (nº de alunos, staff, professores e totais de receitas/despesas).
+# Em vez de COUNT(*)/SUM sobre as tabelas inteiras, cada contador é a soma de FATIAS linhas da tabela
+# Contadores (uma escrita soma o seu delta numa fatia ao acaso: escritores concorrentes raramente
+# esperam pela mesma linha):
+# - inserts/deletes pelo ORM: eventos after_insert/after_delete (e after_update nas transações)
+#   acumulam o delta na sessão; no fim de cada flush é aplicado um UPDATE ... SET Valor = Valor + :d
+#   por contador, na mesma transação da escrita;
+# - escritas em massa (insert(Modelo) com listas, query().update()/.delete()): o contador afetado
+#   é recalculado logo a seguir, ainda dentro da transação (exceto com SEM_RECONTAGEM, quando quem
+#   escreve já soma os deltas, ex: somar_transacoes na importação de extratos);
+# - uma reconciliação periódica (e `python manutencao.py reconciliar-contadores`) corrige
+#   qualquer desvio (ex: SQL manual na base de dados).
+
+ALUNOS, STAFF, PROFESSORES = "alunos", "staff", "professores"
+RECEITA_TOTAL, DESPESA_TOTAL = "receita_total", "despesa_total"
+
+CONTAGENS = {
+    models.Aluno: ALUNOS,
+    models.Staff: STAFF,
+    models.Professor: PROFESSORES,
+}
+NOMES = (ALUNOS, STAFF, PROFESSORES, RECEITA_TOTAL, DESPESA_TOTAL)
+
+FATIAS = 8
+INTERVALO_RECONCILIACAO = 3600  # segundos
+
+# execution_options de escritas em massa que aplicam os seus próprios deltas (sem COUNT/SUM a seguir)
+SEM_RECONTAGEM = {"recontar_contadores": False}
+
+# --- CÁLCULO A PARTIR DAS TABELAS ---
+
+def _recontar(conn_ou_sessao, nomes) -> Dict[str, Decimal]:
+    """Valor real de cada contador (COUNT/SUM): usado na reconciliação e após escritas em massa."""
+    valores = {}
+    for modelo, nome in CONTAGENS.items():
+        if nome in nomes:
+            valores[nome] = Decimal(conn_ou_sessao.execute(select(func.count()).select_from(modelo)).scalar() or 0)
+    if RECEITA_TOTAL in nomes or DESPESA_TOTAL in nomes:
+        T = models.Transacao
+        receita, despesa = conn_ou_sessao.execute(select(
+            func.coalesce(func.sum(case((T.Tipo == models.TipoTransacaoEnum.Receita, T.Valor), else_=0)), 0),
+            func.coalesce(func.sum(case((T.Tipo == models.TipoTransacaoEnum.Despesa, T.Valor), else_=0)), 0),
+        )).one()
+        valores[RECEITA_TOTAL], valores[DESPESA_TOTAL] = Decimal(str(receita)), Decimal(str(despesa))
+    return {n: v for n, v in valores.items() if n in nomes}
+
+def _gravar(conn_ou_sessao, valores: Dict[str, Decimal]):
+    """Valor absoluto: fica todo na fatia 0 e as restantes a zero."""
+    C = models.Contador
+    for nome in sorted(valores):
+        conn_ou_sessao.execute(update(C).where(C.Nome == nome).values(Valor=case((C.Fatia == 0, valores[nome]), else_=0)))
+
+# --- EVENTOS ---
+
+def _somar(conn, deltas: Dict[str, Decimal]):
+    """Um UPDATE incremental por contador, numa fatia ao acaso (ordem fixa de nomes contra deadlocks)."""
+    C = models.Contador
+    fatia = random.randrange(FATIAS)
+    for nome in sorted(deltas):
+        if deltas[nome]:
+            conn.execute(update(C).where(C.Nome == nome, C.Fatia == fatia).values(Valor=C.Valor + deltas[nome]))
+
+def _acumular(alvo, nome: str, delta):
+    deltas = object_session(alvo).info.setdefault("contadores_deltas", {})
+    deltas[nome] = deltas.get(nome, 0) + delta
+
+def _contar(sinal: int):
+    def _ouvinte(mapper, conn, alvo):
+        _acumular(alvo, CONTAGENS[type(alvo)], sinal)
+    return _ouvinte
+
+for _modelo in CONTAGENS:
+    event.listen(_modelo, "after_insert", _contar(+1))
+    event.listen(_modelo, "after_delete", _contar(-1))
+
+def _somar_transacao(alvo, tipo, valor, sinal: int):
+    if valor is None:
+        return
+    nome = RECEITA_TOTAL if tipo == models.TipoTransacaoEnum.Receita else DESPESA_TOTAL
+    _acumular(alvo, nome, Decimal(str(valor)) * sinal)
+
+def _anterior(estado, atributo):
+    historico = estado.attrs[atributo].history
+    return historico.deleted[0] if historico.deleted else getattr(estado.object, atributo)
+
+@event.listens_for(models.Transacao, "after_insert")
+def _transacao_inserida(mapper, conn, transacao):
+    _somar_transacao(transacao, transacao.Tipo, transacao.Valor, +1)
+
+@event.listens_for(models.Transacao, "after_delete")
+def _transacao_apagada(mapper, conn, transacao):
+    estado = inspect(transacao)
+    _somar_transacao(transacao, _anterior(estado, "Tipo"), _anterior(estado, "Valor"), -1)
+
+@event.listens_for(models.Transacao, "after_update")
+def _transacao_alterada(mapper, conn, transacao):
+    estado = inspect(transacao)
+    if not (estado.attrs.Tipo.history.has_changes() or estado.attrs.Valor.history.has_changes()):
+        return
+    _somar_transacao(transacao, _anterior(estado, "Tipo"), _anterior(estado, "Valor"), -1)
+    _somar_transacao(transacao, transacao.Tipo, transacao.Valor, +1)
+
+@event.listens_for(Session, "before_flush")
+def _descartar_deltas_pendentes(session, flush_context, instances):
+    # Deltas de um flush anterior que falhou (os eventos correram, o after_flush não)
+    session.info.pop("contadores_deltas", None)
+
+@event.listens_for(Session, "after_flush")
+def _aplicar_deltas(session, flush_context):
+    deltas = session.info.pop("contadores_deltas", None)
+    if deltas:
+        _somar(session.connection(), deltas)
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_apos_rollback(session):
+    session.info.pop("contadores_deltas", None)
+
+@event.listens_for(Session, "do_orm_execute")
+def _contadores_escrita_em_massa(estado):
+    # Sem objetos não há deltas: executar a escrita e recalcular os contadores dessa tabela
+    if not (estado.is_insert or estado.is_update or estado.is_delete) or estado.bind_mapper is None:
+        return
+    if not estado.execution_options.get("recontar_contadores", True):
+        return
+    classe = estado.bind_mapper.class_
+    if classe in CONTAGENS:
+        nomes = {CONTAGENS[classe]}
+    elif classe is models.Transacao:
+        nomes = {RECEITA_TOTAL, DESPESA_TOTAL}
+    else:
+        return
+    resultado = estado.invoke_statement()
+    _gravar(estado.session, _recontar(estado.session, nomes))
+    return resultado
+
+def somar_transacoes(conn, transacoes: List[Dict]):
+    """Deltas de um insert(Transacao) em bloco feito com SEM_RECONTAGEM: um UPDATE por contador."""
+    receita = sum((Decimal(str(t["Valor"])) for t in transacoes if t["Tipo"] == models.TipoTransacaoEnum.Receita), Decimal(0))
+    despesa = sum((Decimal(str(t["Valor"])) for t in transacoes if t["Tipo"] == models.TipoTransacaoEnum.Despesa), Decimal(0))
+    _somar(conn, {RECEITA_TOTAL: receita, DESPESA_TOTAL: despesa})
+
+# --- LEITURA ---
+
+def valores(db: Session) -> Dict[str, Decimal]:
+    """Todos os contadores numa consulta (soma das fatias, pela chave primária)."""
+    C = models.Contador
+    linhas = dict(db.query(C.Nome, func.sum(C.Valor)).filter(C.Nome.in_(NOMES)).group_by(C.Nome).all())
+    return {nome: Decimal(str(linhas.get(nome) or 0)) for nome in NOMES}
+
+# --- RECONCILIAÇÃO ---
+
+def reconciliar_contadores(db: Session) -> Dict[str, str]:
+    """Recalcula todos os contadores e corrige os que divergem. Devolve {nome: "antes -> depois"} dos corrigidos."""
+    fatias: Dict[str, Dict[int, models.Contador]] = {}
+    for c in db.query(models.Contador).with_for_update().all():
+        fatias.setdefault(c.Nome, {})[c.Fatia] = c
+    reais = _recontar(db, NOMES)
+    corrigidos = {}
+    for nome, valor in reais.items():
+        linhas = fatias.get(nome, {})
+        atual = sum((Decimal(str(c.Valor)) for c in linhas.values()), Decimal(0))
+        if len(linhas) == FATIAS and atual == valor:
+            continue
+        if not linhas:
+            corrigidos[nome] = f"- -> {valor}"
+        elif atual != valor:
+            corrigidos[nome] = f"{atual} -> {valor}"
+        # O valor fica na fatia 0; as restantes (criadas se faltarem) a zero
+        for fatia in range(FATIAS):
+            linha = linhas.get(fatia)
+            if linha is None:
+                linha = models.Contador(Nome=nome, Fatia=fatia)
+                db.add(linha)
+            linha.Valor = valor if fatia == 0 else 0
+    db.commit()
+    return corrigidos
+
+def inicializar_contadores(db: Session):
+    """Primeira execução (ou contadores/fatias em falta): criar e preencher."""
+    existentes = set(db.query(models.Contador.Nome, models.Contador.Fatia).all())
+    if {(n, f) for n in NOMES for f in range(FATIAS)} - existentes:
+        reconciliar_contadores(db)
+
+def _ciclo_reconciliacao(parar: threading.Event, intervalo: float):
+    while not parar.wait(intervalo):
+        try:
+            with SessionLocal() as db:
+                corrigidos = reconciliar_contadores(db)
+            if corrigidos:
+                print(f"Contadores corrigidos na reconciliação: {corrigidos}")
+        except Exception as e:
+            print(f"Erro na reconciliação dos contadores: {e}")
+
+def iniciar_reconciliacao_periodica(intervalo: float = INTERVALO_RECONCILIACAO) -> threading.Event:
+    """Thread em segundo plano; devolve o Event que a termina."""
+    parar = threading.Event()
+    threading.Thread(target=_ciclo_reconciliacao, args=(parar, intervalo), daemon=True, name="reconciliar-contadores").start()
+    return parar
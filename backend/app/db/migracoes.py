@@ -0,0 +1,51 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateIndex
+from app.db.database import Base
+from app.db import models  # noqa: F401 (regista os modelos em Base.metadata)
+
+# O projeto não usa Alembic: `create_all` cria tabelas novas mas não altera tabelas existentes.
+# Este passo idempotente acrescenta as colunas e índices novos dos modelos a bases de dados antigas.
+
+def _definicao_coluna(coluna, dialect) -> str:
+    tipo = coluna.type.compile(dialect=dialect)
+    sql = f"{dialect.identifier_preparer.quote(coluna.name)} {tipo}"
+    if coluna.server_default is not None:
+        default = coluna.server_default.arg
+        sql += f" DEFAULT {default.text if hasattr(default, 'text') else repr(str(default))}"
+    if not coluna.nullable:
+        sql += " NOT NULL"
+    return sql
+
+def aplicar_migracoes(engine):
+    inspetor = inspect(engine)
+    tabelas_existentes = set(inspetor.get_table_names())
+    preparer = engine.dialect.identifier_preparer
+
+    with engine.begin() as conn:
+        for tabela in Base.metadata.sorted_tables:
+            if tabela.name not in tabelas_existentes:
+                continue
+
+            # 1. Colunas em falta
+            colunas_db = {c["name"] for c in inspetor.get_columns(tabela.name)}
+            for coluna in tabela.columns:
+                if coluna.name in colunas_db:
+                    continue
+                if not coluna.nullable and coluna.server_default is None:
+                    print(f"⚠️  Coluna {tabela.name}.{coluna.name} é NOT NULL sem default: adicionar manualmente.")
+                    continue
+                conn.execute(text(f"ALTER TABLE {preparer.quote(tabela.name)} ADD COLUMN {_definicao_coluna(coluna, engine.dialect)}"))
+                print(f"🛠️  Coluna adicionada: {tabela.name}.{coluna.name}")
+
+            # 2. Índices em falta
+            indices_db = {i["name"] for i in inspetor.get_indexes(tabela.name)}
+            for indice in tabela.indexes:
+                if indice.name in indices_db:
+                    continue
+                try:
+                    with conn.begin_nested():
+                        conn.execute(CreateIndex(indice))
+                    print(f"🛠️  Índice criado: {indice.name}")
+                except Exception as e:
+                    # Ex: índice único sobre dados antigos duplicados
+                    print(f"⚠️  Não foi possível criar o índice {indice.name}: {e}")
@@ -1,5 +1,5 @@
 import enum
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Date, DECIMAL, Text, Enum
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Date, DateTime, DECIMAL, Text, Enum, Index
 from sqlalchemy.orm import relationship
 from app.db.database import Base
 
@@ -191,10 +191,18 @@ class Nota(Base):
     Nota_Ex = Column(Integer)
     Nota_Final = Column(Integer)
     Ano_letivo = Column(String(20)) # Adicionado length
+    # Controlo de concorrência otimista: cada escrita faz UPDATE ... WHERE Versao = <lida> e incrementa
+    Versao = Column(Integer, nullable=False, default=1, server_default="1")
 
     aluno = relationship("Aluno", back_populates="notas")
     disciplina = relationship("Disciplina")
 
+    __table_args__ = (
+        # Uma célula da pauta por aluno/disciplina/ano (impede inserções concorrentes duplicadas)
+        Index("ux_notas_aluno_disc_ano", "Aluno_id", "Disc_id", "Ano_letivo", unique=True),
+    )
+    __mapper_args__ = {"version_id_col": Versao}
+
 # --- Finanças ---
 
 class Financiamento(Base):
@@ -226,10 +234,17 @@ class Transacao(Base):
     Descricao = Column(Text)
     Fin_id = Column(Integer, ForeignKey("Financiamentos.Fin_id"))
     Fornecedor_id = Column(Integer, ForeignKey("Fornecedores.Fornecedor_id"))
+    Hash_Conteudo = Column(String(64))  # Só nas transações importadas de extratos (deduplicação)
 
     financiamento = relationship("Financiamento")
     fornecedor = relationship("Fornecedor")
 
+    __table_args__ = (
+        Index("ix_transacoes_tipo_data", "Tipo", "Data", "Transacao_id"),  # Histórico de despesas (keyset)
+        Index("ux_transacoes_hash", "Hash_Conteudo", unique=True),
+        Index("ix_transacoes_fornecedor_data", "Fornecedor_id", "Data"),  # Gastos por fornecedor
+    )
+
 class Ordenado(Base):
     __tablename__ = "Ordenados"
     Ordenado_id = Column(Integer, primary_key=True, index=True)
@@ -240,6 +255,179 @@ class Ordenado(Base):
     Valor = Column(DECIMAL(8, 2))
     Data_Pagamento = Column(Date)
     Observacoes = Column(Text)
+    # Fotografia no processamento (custos por departamento/escalão não mudam com transferências posteriores)
+    Depart_id = Column(Integer)
+    Escalao = Column(String(50))
+    Valor_Base = Column(DECIMAL(8, 2))
+    Bonus = Column(DECIMAL(8, 2))
+
+    __table_args__ = (
+        Index("ux_ordenados_funcionario_mes", "Funcionario_id", "Tipo_Funcionario", "Ano", "Mes", unique=True),
+        Index("ix_ordenados_periodo", "Ano", "Mes"),
+    )
+
+# --- Razão de Saldos dos Investimentos (Ledger) ---
+# Atualizado na mesma transação de cada escrita de Transacao (ver app/services/saldos_service.py)
+# e reconstruído com `python manutencao.py reconciliar-saldos`.
+
+class SaldoFinanciamento(Base):
+    __tablename__ = "SaldosFinanciamento"
+    Fin_id = Column(Integer, ForeignKey("Financiamentos.Fin_id"), primary_key=True)
+    Receita_Total = Column(DECIMAL(14, 2), nullable=False, default=0)
+    Despesa_Total = Column(DECIMAL(14, 2), nullable=False, default=0)
+    Qtd_Transacoes = Column(Integer, nullable=False, default=0)
+
+class SaldoMensal(Base):
+    __tablename__ = "SaldosMensais"
+    Ano = Column(Integer, primary_key=True)
+    Mes = Column(Integer, primary_key=True)
+    Fin_id = Column(Integer, primary_key=True)  # 0 = transações sem investimento (sem FK de propósito)
+    Receita_Total = Column(DECIMAL(14, 2), nullable=False, default=0)
+    Despesa_Total = Column(DECIMAL(14, 2), nullable=False, default=0)
+    Qtd_Transacoes = Column(Integer, nullable=False, default=0)
+
+# --- Agregados de Notas (Resumos Materializados) ---
+# Mantidos incrementalmente a cada escrita de notas (ver app/services/agregados_service.py)
+# e reconstruídos de raiz com `python manutencao.py reconstruir-agregados`.
+
+class ResumoAlunoAno(Base):
+    __tablename__ = "ResumoAlunoAno"
+    Aluno_id = Column(Integer, ForeignKey("alunos.Aluno_id"), primary_key=True)
+    Ano_letivo = Column(String(20), primary_key=True, index=True)
+    Turma_id = Column(Integer, ForeignKey("turmas.Turma_id"), nullable=True, index=True)
+    Qtd_Notas = Column(Integer, nullable=False, default=0)
+    Soma_Notas = Column(Integer, nullable=False, default=0)
+    Media = Column(DECIMAL(5, 2))
+    Negativas = Column(Integer, nullable=False, default=0)
+    Nota_Minima = Column(Integer)
+
+    # Ranking por turma (ROW_NUMBER() em /consultas) lido pela ordem do índice
+    __table_args__ = (Index("ix_resumo_aluno_ano_turma_media", "Ano_letivo", "Turma_id", "Media"),)
+
+class ResumoTurmaDisciplina(Base):
+    __tablename__ = "ResumoTurmaDisciplina"
+    Turma_id = Column(Integer, ForeignKey("turmas.Turma_id"), primary_key=True)
+    Disc_id = Column(Integer, ForeignKey("Disciplinas.Disc_id"), primary_key=True)
+    Qtd_Notas = Column(Integer, nullable=False, default=0)
+    Soma_Notas = Column(Integer, nullable=False, default=0)
+    Media = Column(DECIMAL(5, 2))
+    Negativas = Column(Integer, nullable=False, default=0)
+
+class ResumoProfessorDisciplina(Base):
+    __tablename__ = "ResumoProfessorDisciplina"
+    Professor_id = Column(Integer, ForeignKey("Professores.Professor_id"), primary_key=True)
+    Disc_id = Column(Integer, ForeignKey("Disciplinas.Disc_id"), primary_key=True)
+    Ano_letivo = Column(String(20), primary_key=True, index=True)
+    Qtd_Notas = Column(Integer, nullable=False, default=0)
+    Soma_Notas = Column(Integer, nullable=False, default=0)
+    Media = Column(DECIMAL(5, 2))
+    Negativas = Column(Integer, nullable=False, default=0)
+
+# --- Snapshot Analítico (Esquema em Estrela) ---
+# Factos desnormalizados para relatórios: uma linha por nota/falta/transação já com as chaves
+# de turma, ano letivo e professor resolvidas. Atualizados incrementalmente por
+# app/services/snapshot_service.py (sem FKs: o snapshot não bloqueia nem atrasa as escritas).
+
+# Os professores de cada nota são todos os atribuídos à disciplina na turma (TurmasDisciplinas por
+# Turma_id, Disc_id), a mesma regra dos ResumosProfessorDisciplina: junta-se na leitura.
+class FactoNota(Base):
+    __tablename__ = "FactoNotas"
+    Nota_id = Column(Integer, primary_key=True, autoincrement=False)
+    Aluno_id = Column(Integer, nullable=False, index=True)
+    Disc_id = Column(Integer, nullable=False)
+    Ano_letivo = Column(String(20), nullable=False)
+    Turma_id = Column(Integer)
+    Ano_escolar = Column(Integer)
+    Turma = Column(String(10))
+    Nota_1P = Column(Integer)
+    Nota_Final = Column(Integer)
+
+    __table_args__ = (
+        Index("ix_facto_notas_ano_turma", "Ano_letivo", "Turma_id"),
+        Index("ix_facto_notas_ano_disc_nota", "Ano_letivo", "Disc_id", "Nota_Final"),  # Histogramas (índice de cobertura)
+    )
+
+class FactoFalta(Base):
+    __tablename__ = "FactoFaltas"
+    Falta_id = Column(Integer, primary_key=True, autoincrement=False)
+    Aluno_id = Column(Integer, nullable=False, index=True)
+    Disc_id = Column(Integer)
+    Data = Column(Date)
+    Ano_letivo = Column(String(20))
+    Turma_id = Column(Integer)
+    Justificada = Column(Boolean)
+
+    __table_args__ = (Index("ix_facto_faltas_ano_turma", "Ano_letivo", "Turma_id"),)
+
+class FactoTransacao(Base):
+    __tablename__ = "FactoTransacoes"
+    Transacao_id = Column(Integer, primary_key=True, autoincrement=False)
+    Tipo = Column(Enum(TipoTransacaoEnum), nullable=False)
+    Valor = Column(DECIMAL(10, 2))
+    Data = Column(Date)
+    Ano = Column(Integer)
+    Mes = Column(Integer)
+    Ano_letivo = Column(String(20))
+    Fin_id = Column(Integer)
+    Fornecedor_id = Column(Integer)
+
+    __table_args__ = (
+        Index("ix_facto_transacoes_periodo", "Ano", "Mes", "Tipo"),
+        Index("ix_facto_transacoes_fin", "Fin_id", "Tipo"),
+    )
+
+class EstadoSnapshot(Base):
+    __tablename__ = "EstadoSnapshot"
+    Facto = Column(String(50), primary_key=True)
+    Versoes = Column(String(255), nullable=False, default="")  # Marca d'água: versão de cada tabela de origem já refletida
+    Atualizado_Em = Column(DateTime)
+
+class AlteracaoSnapshot(Base):
+    """
+    Registo de alterações às tabelas de origem dos factos, escrito na mesma transação da escrita.
+    Versao = valor do contador da tabela (app/db/versoes.py) nessa transação: como o contador fica
+    bloqueado até ao commit, as versões são atribuídas pela ordem de commit e servem de marca d'água.
+    """
+    __tablename__ = "AlteracoesSnapshot"
+    Seq = Column(Integer, primary_key=True, autoincrement=True)
+    Tabela = Column(String(30), nullable=False)
+    Versao = Column(Integer, nullable=False)
+    Chave = Column(Integer)    # Id afetado (ver ORIGENS em snapshot_service); NULL = reconstruir o facto
+    Apos_Id = Column(Integer)  # Inserção em massa sem ids conhecidos: linhas de origem com id > Apos_Id
+
+    __table_args__ = (Index("ix_alteracoes_snapshot_tabela_versao", "Tabela", "Versao"),)
+
+# --- Estatísticas por Ano Letivo (Dashboard) ---
+# Anos letivos fechados: calculados uma vez e guardados (ver app/services/estatisticas_ano_service.py).
+
+class EstatisticaAnoLetivo(Base):
+    __tablename__ = "EstatisticasAnoLetivo"
+    Ano_letivo = Column(String(20), primary_key=True)
+    Alunos_Matriculados = Column(Integer, nullable=False, default=0)
+    Turmas = Column(Integer, nullable=False, default=0)
+    Professores_Atribuidos = Column(Integer, nullable=False, default=0)
+    Alunos_Avaliados = Column(Integer, nullable=False, default=0)
+    Alunos_Aprovados = Column(Integer, nullable=False, default=0)
+    Calculado_Em = Column(DateTime)
+
+# --- Versões de Dados (ETags / Invalidação de Cache) ---
+# Contador por conjunto de dados, incrementado na mesma transação de cada escrita (ver app/db/versoes.py).
+
+class VersaoDados(Base):
+    __tablename__ = "VersoesDados"
+    Nome = Column(String(50), primary_key=True)
+    Versao = Column(Integer, nullable=False, default=0)
+
+# --- Contadores (Dashboard) ---
+# Totais mantidos por eventos do ORM na mesma transação de cada escrita (ver app/db/contadores.py).
+# Cada contador está repartido por várias fatias (o valor é a soma): escritas concorrentes
+# bloqueiam linhas diferentes em vez de ficarem em fila na mesma.
+
+class Contador(Base):
+    __tablename__ = "Contadores"
+    Nome = Column(String(50), primary_key=True)
+    Fatia = Column(Integer, primary_key=True, default=0, server_default="0")
+    Valor = Column(DECIMAL(16, 2), nullable=False, default=0)
 
 # --- Ai ---
 
@@ -135,9 +135,11 @@ class NotaUpdate(BaseModel):
     Nota_Ex: Optional[int] = None
     Nota_Final: Optional[int] = None
     Ano_letivo: Optional[str] = None # Adicionado para permitir update do ano se necessário
+    Versao: Optional[int] = None # Versão lida pelo cliente (controlo de concorrência)
 
 class NotaDisplay(NotaBase):
     Nota_id: int
+    Versao: Optional[int] = None
     Disciplina_Nome: Optional[str] = "Disciplina Desconhecida"
 
     class Config:
@@ -196,6 +198,15 @@ class NotaTurmaPayload(BaseModel):
     p3: Optional[int] = None
     exame: Optional[int] = None
     final: Optional[int] = None
+    # Versão lida pelo cliente (GET /details). Se diferente da atual, a célula é rejeitada como conflito.
+    versao: Optional[int] = None
+
+class NotasLotePayload(BaseModel):
+    notas: List[NotaTurmaPayload]
+
+class NotasLoteResultado(BaseModel):
+    gravadas: List[Dict[str, Any]] = []
+    conflitos: List[Dict[str, Any]] = []
 
 class ProfessorUpdate(BaseModel):
     disciplina_id: int
@@ -204,6 +215,14 @@ class ProfessorUpdate(BaseModel):
 class TurmaProfessoresUpdate(BaseModel):
     professores: List[ProfessorUpdate]
 
+class AtribuicaoTurma(BaseModel):
+    turma_id: int
+    professores: List[ProfessorUpdate]
+
+class AtribuicoesLoteUpdate(BaseModel):
+    """Equipas docentes de várias turmas (ex: distribuição de serviço de um ano letivo inteiro)."""
+    turmas: List[AtribuicaoTurma]
+
 class RegrasTransicao(BaseModel):
     pass
 
@@ -235,6 +254,8 @@ class ConsultasGeraisResponse(BaseModel):
     alunos_reprovacao: List[AlunoReprovacao]
     top_professores: List[ProfessorMedia]
     bottom_professores: List[ProfessorMedia]
+    # Ano letivo e tempos de cada secção (calculadas em paralelo)
+    metadados: Optional[Dict[str, Any]] = None
 
 # --- ESTRUTURA ESCOLAR (NOVOS SCHEMAS PARA CONFIGURACAO) ---
 
@@ -296,6 +317,74 @@ class BalancoGeral(BaseModel):
     saldo: float
     detalhe_investimentos: List[BalancoInvestimento] = []
 
+class PontoMensal(BaseModel):
+    ano: int
+    mes: int
+    receita: float
+    despesa: float
+    saldo: float
+
+class SerieInvestimento(BaseModel):
+    id: int
+    tipo_investimento: str
+    pontos: List[PontoMensal] = []
+
+class SerieMensal(BaseModel):
+    inicio: str  # AAAA-MM
+    fim: str
+    total: List[PontoMensal] = []
+    investimentos: List[SerieInvestimento] = []
+
+class PrevisaoInvestimento(BaseModel):
+    id: int
+    tipo_investimento: str
+    valor_aprovado: float
+    gasto_acumulado: float
+    saldo_atual: float
+    gasto_medio_mensal: float
+    tendencia_mensal: float  # Variação do gasto mensal por mês (regressão linear)
+    gasto_previsto_proximo_mes: float
+    saldo_previsto_fim_ano: float
+    data_esgotamento: Optional[str] = None  # AAAA-MM (None: não esgota no horizonte da previsão)
+    meses_historico: int
+
+class ImportacaoExtrato(BaseModel):
+    lidas: int
+    inseridas: int
+    duplicadas: int
+    com_erro: int
+    erros: List[str] = []
+
+# --- SCHEMAS DE VENCIMENTOS (ORDENADOS) ---
+
+class ProcessamentoOrdenados(BaseModel):
+    ano: int
+    mes: int = Field(..., ge=1, le=12)
+    data_pagamento: Optional[date] = None
+    substituir: bool = False
+
+class OrdenadoDisplay(BaseModel):
+    Ordenado_id: int
+    Funcionario_id: int
+    Tipo_Funcionario: str
+    Ano: int
+    Mes: str
+    Valor: float
+    Valor_Base: Optional[float] = None
+    Bonus: Optional[float] = None
+    Depart_id: Optional[int] = None
+    Escalao: Optional[str] = None
+    Data_Pagamento: Optional[date] = None
+    class Config:
+        from_attributes = True
+
+class CustoOrdenados(BaseModel):
+    id: Optional[int] = None
+    nome: str
+    qtd_ordenados: int
+    custo_total: float
+    custo_medio_mensal: float
+
 # --- SCHEMAS DE FINANÇAS (EXTENSÃO) ---
 
 class FinanciamentoCreate(BaseModel):
@@ -312,6 +401,37 @@ class FinanciamentoDisplay(BaseModel):
     class Config:
         from_attributes = True
 
+class FornecedorCreate(BaseModel):
+    Nome: str
+    NIF: Optional[str] = None
+    Tipo: Optional[str] = None
+    Telefone: Optional[str] = None
+    Email: Optional[str] = None
+    Morada: Optional[str] = None
+
+class FornecedorDisplay(FornecedorCreate):
+    Fornecedor_id: int
+    class Config:
+        from_attributes = True
+
+class GastoFornecedor(BaseModel):
+    id: int
+    nome: str
+    nif: Optional[str] = None
+    qtd_transacoes: int
+    total: float
+    percentagem: float
+    primeira_data: Optional[date] = None
+    ultima_data: Optional[date] = None
+
+class GastosFornecedores(BaseModel):
+    inicio: date
+    fim: date
+    total: float
+    sem_fornecedor: float
+    qtd_fornecedores: int
+    fornecedores: List[GastoFornecedor] = []
+
 class DespesaCreate(BaseModel):
     descricao: str
     valor: float
@@ -321,8 +441,10 @@ class DespesaHistorico(BaseModel):
     id: int
     descricao: str
     valor: float
-    investimento_id: int
+    investimento_id: Optional[int] = None
     investimento_nome: str
+    data: Optional[date] = None
+    fornecedor_id: Optional[int] = None
     class Config:
         from_attributes = True
 
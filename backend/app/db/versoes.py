@@ -0,0 +1,126 @@
+from datetime import date
+from typing import List, Tuple
+from sqlalchemy import event, inspect, insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app.db import models
+
+# Versões de dados: um contador por tabela "observada", incrementado dentro da transação
+# que a altera. Serve para ETags (304 Not Modified) e para invalidar caches de leitura
+# sem ter de comparar os dados.
+
+# Modelo -> nome do contador
+VERSIONADOS = {
+    models.Turma: "turmas",
+    models.Nota: "notas",
+    models.Matricula: "matriculas",
+    models.TurmaDisciplina: "atribuicoes",
+    models.Falta: "faltas",
+    models.Transacao: "transacoes",
+    models.Financiamento: "financiamentos",
+    models.Fornecedor: "fornecedores",
+}
+
+# Versões por mês ("transacoes:2024-03") para modelos com data: caches de períodos fechados só
+# caducam com escritas nesses meses. Escritas em massa de meses desconhecidos incrementam "<nome>:*".
+POR_MES = {
+    models.Transacao: ("transacoes", "Data"),
+}
+
+def nome_mensal(nome: str, ano: int, mes: int) -> str:
+    return f"{nome}:{ano:04d}-{mes:02d}"
+
+def nomes_periodo(nome: str, inicio: date, fim: date) -> List[str]:
+    """Contadores que cobrem [inicio, fim]: os mensais e o de escritas sem mês conhecido."""
+    nomes = [f"{nome}:*"]
+    ano, mes = inicio.year, inicio.month
+    while (ano, mes) <= (fim.year, fim.month):
+        nomes.append(nome_mensal(nome, ano, mes))
+        ano, mes = (ano + 1, 1) if mes == 12 else (ano, mes + 1)
+    return nomes
+
+def inicializar_versoes(db: Session):
+    """Cria os contadores em falta (evita a corrida de dois INSERT na primeira escrita)."""
+    existentes = {n for (n,) in db.query(models.VersaoDados.Nome).all()}
+    for nome in set(VERSIONADOS.values()) - existentes:
+        db.add(models.VersaoDados(Nome=nome, Versao=0))
+    db.commit()
+
+def versao_atual(db: Session, nome: str) -> int:
+    versao = db.query(models.VersaoDados.Versao).filter(models.VersaoDados.Nome == nome).scalar()
+    return versao or 0
+
+def versoes_atuais(db: Session, nomes) -> Tuple[int, ...]:
+    """Versões de vários contadores numa só consulta (pela ordem pedida)."""
+    linhas = dict(db.query(models.VersaoDados.Nome, models.VersaoDados.Versao).filter(models.VersaoDados.Nome.in_(list(nomes))).all())
+    return tuple(linhas.get(nome, 0) for nome in nomes)
+
+def incrementar_versoes(db: Session, nomes):
+    # Ordem fixa para que transações concorrentes bloqueiem os contadores pela mesma ordem
+    for nome in sorted(set(nomes)):
+        resultado = db.execute(
+            update(models.VersaoDados)
+            .where(models.VersaoDados.Nome == nome)
+            .values(Versao=models.VersaoDados.Versao + 1)
+            .execution_options(synchronize_session=False)
+        )
+        if resultado.rowcount == 0:
+            db.add(models.VersaoDados(Nome=nome, Versao=1))
+
+def _incrementar_mensais(conn, nomes):
+    # Os mensais são criados a pedido: se outra transação criou a linha entretanto, repete o UPDATE
+    tabela = models.VersaoDados.__table__
+    for nome in sorted(set(nomes)):
+        incremento = update(tabela).where(tabela.c.Nome == nome).values(Versao=tabela.c.Versao + 1)
+        if conn.execute(incremento).rowcount:
+            continue
+        try:
+            with conn.begin_nested():
+                conn.execute(insert(tabela).values(Nome=nome, Versao=1))
+        except IntegrityError:
+            conn.execute(incremento)
+
+def _nomes_alterados(objetos):
+    return {VERSIONADOS[type(o)] for o in objetos if type(o) in VERSIONADOS}
+
+def _nomes_mensais(objetos):
+    nomes = set()
+    for objeto in objetos:
+        if type(objeto) not in POR_MES:
+            continue
+        nome, atributo = POR_MES[type(objeto)]
+        # Mês atual e, se a data mudou, o anterior
+        datas = set(inspect(objeto).attrs[atributo].history.sum()) | {getattr(objeto, atributo)}
+        nomes |= {nome_mensal(nome, d.year, d.month) for d in datas if d is not None}
+    return nomes
+
+def _nomes_mensais_em_massa(estado, nome: str, atributo: str):
+    # Só um insert com as linhas como parâmetros diz que meses toca; update/delete vão para "<nome>:*"
+    linhas = estado.parameters
+    if isinstance(linhas, dict):
+        linhas = [linhas]
+    if estado.is_insert and linhas and all(l.get(atributo) is not None for l in linhas):
+        return {nome_mensal(nome, l[atributo].year, l[atributo].month) for l in linhas}
+    return {f"{nome}:*"}
+
+@event.listens_for(Session, "before_flush")
+def _versoes_antes_do_flush(session, flush_context, instances):
+    alterados = set(session.new) | set(session.deleted) | {o for o in session.dirty if session.is_modified(o)}
+    nomes = _nomes_alterados(alterados)
+    if nomes:
+        incrementar_versoes(session, nomes)
+    mensais = _nomes_mensais(alterados)
+    if mensais:
+        _incrementar_mensais(session.connection(), mensais)
+
+@event.listens_for(Session, "do_orm_execute")
+def _versoes_escrita_em_massa(estado):
+    # insert(Modelo) / query(...).update() / .delete() não passam pelo flush
+    if not (estado.is_insert or estado.is_update or estado.is_delete) or estado.bind_mapper is None:
+        return
+    nome = VERSIONADOS.get(estado.bind_mapper.class_)
+    if nome:
+        incrementar_versoes(estado.session, [nome])
+    if estado.bind_mapper.class_ in POR_MES:
+        nome, atributo = POR_MES[estado.bind_mapper.class_]
+        _incrementar_mensais(estado.session.connection(), _nomes_mensais_em_massa(estado, nome, atributo))
@@ -1,10 +1,14 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.api.endpoints import auth, finances, dashboard, students, staff, turmas, disciplinas, consultas, ai_advisor, ai_chat, config_escolar
-from app.db.database import engine, Base
+from app.api.endpoints import auth, finances, dashboard, students, staff, turmas, disciplinas, consultas, ai_advisor, ai_chat, config_escolar, ordenados, fornecedores
+from app.db.database import engine, Base, SessionLocal
+from app.db.migracoes import aplicar_migracoes
+from app.db import versoes, contadores
+from app.services import agregados_service, snapshot_service, saldos_service
 
-# Criar tabelas se não existirem
+# Criar tabelas se não existirem (e acrescentar colunas/índices novos a tabelas antigas)
 Base.metadata.create_all(bind=engine)
+aplicar_migracoes(engine)
 
 app = FastAPI(
     title="Escola API - Migração FastAPI",
@@ -28,11 +32,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Total-Count", "X-Proximo-Cursor"],
 )
 
 # --- ROTAS ---
 app.include_router(auth.router, prefix="/auth", tags=["Autenticação"])
 app.include_router(finances.router, prefix="/financas", tags=["Relatórios Financeiros"])
+app.include_router(fornecedores.router, prefix="/fornecedores", tags=["Fornecedores"])
 app.include_router(dashboard.router, prefix="/dashboard", tags=["Dashboard"])
 app.include_router(staff.router, prefix="/staff", tags=["Gestão de Staff"])
 app.include_router(students.router, prefix="/students", tags=["Gestão de Alunos"])
@@ -42,6 +48,23 @@ app.include_router(consultas.router, prefix="/consultas", tags=["Consultas e Est
 app.include_router(ai_advisor.router, prefix="/ai", tags=["Assistente IA (Relatórios)"])
 app.include_router(ai_chat.router, prefix="/chat", tags=["Assistente IA (Chat)"])
 app.include_router(config_escolar.router, prefix="/config-escolar", tags=["Configuração Escolar"])
+app.include_router(ordenados.router, prefix="/ordenados", tags=["Vencimentos"])
+
+# --- DADOS DERIVADOS ---
+@app.on_event("startup")
+def preparar_dados_derivados():
+    # Primeira execução com dados antigos: construir os resumos de notas, o snapshot analítico e o razão de saldos
+    with SessionLocal() as db:
+        versoes.inicializar_versoes(db)
+        agregados_service.garantir_agregados(db)
+        snapshot_service.garantir_snapshot_atual(db, permitir_total=True)
+        saldos_service.garantir_saldos(db)
+        contadores.inicializar_contadores(db)
+    app.state.parar_reconciliacao = contadores.iniciar_reconciliacao_periodica()
+
+@app.on_event("shutdown")
+def parar_tarefas():
+    app.state.parar_reconciliacao.set()
 
 @app.get("/")
 def read_root():
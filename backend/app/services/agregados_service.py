@@ -0,0 +1,234 @@
+from typing import Iterable, Optional, Set, Tuple
+from sqlalchemy.orm import Session
+from sqlalchemy import func, case, and_, insert, select
+from app.db import models
+
+# Resumos materializados de notas.
+# Cada escrita de uma Nota recalcula apenas as linhas de resumo afetadas
+# (aluno/ano, turma/disciplina e professor/disciplina/ano), em vez de as
+# consultas analíticas varrerem a tabela Notas inteira a cada pedido.
+
+NOTA_NEGATIVA = 10
+
+def _metricas(coluna_nota):
+    """Colunas agregadas comuns aos três níveis de resumo."""
+    return (
+        func.count(coluna_nota),
+        func.coalesce(func.sum(coluna_nota), 0),
+        func.coalesce(func.sum(case((coluna_nota < NOTA_NEGATIVA, 1), else_=0)), 0),
+    )
+
+def _media(soma: int, qtd: int) -> Optional[float]:
+    return round(soma / qtd, 2) if qtd else None
+
+def obter_turma_do_aluno(db: Session, aluno_id: int, ano_letivo: str) -> Optional[int]:
+    """Turma em que o aluno esteve matriculado nesse ano letivo (via Matrícula)."""
+    res = db.query(models.Matricula.Turma_id)\
+        .join(models.Turma, models.Matricula.Turma_id == models.Turma.Turma_id)\
+        .filter(models.Matricula.Aluno_id == aluno_id, models.Turma.AnoLetivo == ano_letivo)\
+        .order_by(models.Matricula.Turma_id.desc()).first()
+    return res[0] if res else None
+
+# --- RECÁLCULO POR CHAVE ---
+
+def _recalcular_aluno(db: Session, aluno_id: int, ano_letivo: str, turma_id: Optional[int]):
+    qtd, soma, negativas = _metricas(models.Nota.Nota_Final)
+    linha = db.query(qtd, soma, negativas, func.min(models.Nota.Nota_Final)).filter(
+        models.Nota.Aluno_id == aluno_id,
+        models.Nota.Ano_letivo == ano_letivo,
+        models.Nota.Nota_Final != None
+    ).one()
+
+    resumo = db.get(models.ResumoAlunoAno, (aluno_id, ano_letivo))
+    if not linha[0]:
+        if resumo: db.delete(resumo)
+        return
+
+    if not resumo:
+        resumo = models.ResumoAlunoAno(Aluno_id=aluno_id, Ano_letivo=ano_letivo)
+        db.add(resumo)
+    resumo.Turma_id = turma_id
+    resumo.Qtd_Notas, resumo.Soma_Notas, resumo.Negativas, resumo.Nota_Minima = linha[0], int(linha[1]), int(linha[2]), linha[3]
+    resumo.Media = _media(resumo.Soma_Notas, resumo.Qtd_Notas)
+
+def _recalcular_turma_disciplina(db: Session, turma_id: int, disc_id: int, ano_letivo: str):
+    qtd, soma, negativas = _metricas(models.Nota.Nota_Final)
+    linha = db.query(qtd, soma, negativas)\
+        .join(models.Matricula, models.Matricula.Aluno_id == models.Nota.Aluno_id)\
+        .filter(
+            models.Matricula.Turma_id == turma_id,
+            models.Nota.Disc_id == disc_id,
+            models.Nota.Ano_letivo == ano_letivo,
+            models.Nota.Nota_Final != None
+        ).one()
+
+    resumo = db.get(models.ResumoTurmaDisciplina, (turma_id, disc_id))
+    if not linha[0]:
+        if resumo: db.delete(resumo)
+        return
+
+    if not resumo:
+        resumo = models.ResumoTurmaDisciplina(Turma_id=turma_id, Disc_id=disc_id)
+        db.add(resumo)
+    resumo.Qtd_Notas, resumo.Soma_Notas, resumo.Negativas = linha[0], int(linha[1]), int(linha[2])
+    resumo.Media = _media(resumo.Soma_Notas, resumo.Qtd_Notas)
+
+def _recalcular_professor(db: Session, professor_id: int, disc_id: int, ano_letivo: str):
+    qtd, soma, negativas = _metricas(models.Nota.Nota_Final)
+    linha = db.query(qtd, soma, negativas).select_from(models.TurmaDisciplina)\
+        .join(models.Turma, models.TurmaDisciplina.Turma_id == models.Turma.Turma_id)\
+        .join(models.Matricula, models.Turma.Turma_id == models.Matricula.Turma_id)\
+        .join(models.Nota, and_(
+            models.Nota.Aluno_id == models.Matricula.Aluno_id,
+            models.Nota.Disc_id == models.TurmaDisciplina.Disc_id,
+            models.Nota.Ano_letivo == models.Turma.AnoLetivo
+        ))\
+        .filter(
+            models.TurmaDisciplina.Professor_id == professor_id,
+            models.TurmaDisciplina.Disc_id == disc_id,
+            models.Turma.AnoLetivo == ano_letivo,
+            models.Nota.Nota_Final != None
+        ).one()
+
+    resumo = db.get(models.ResumoProfessorDisciplina, (professor_id, disc_id, ano_letivo))
+    if not linha[0]:
+        if resumo: db.delete(resumo)
+        return
+
+    if not resumo:
+        resumo = models.ResumoProfessorDisciplina(Professor_id=professor_id, Disc_id=disc_id, Ano_letivo=ano_letivo)
+        db.add(resumo)
+    resumo.Qtd_Notas, resumo.Soma_Notas, resumo.Negativas = linha[0], int(linha[1]), int(linha[2])
+    resumo.Media = _media(resumo.Soma_Notas, resumo.Qtd_Notas)
+
+# --- API DE MANUTENÇÃO INCREMENTAL ---
+
+def atualizar_agregados_nota(db: Session, aluno_id: int, disc_id: int, ano_letivo: Optional[str]):
+    """
+    Chamar depois de criar/alterar/apagar uma Nota (antes do commit).
+    Recalcula só as linhas de resumo que dependem desse par aluno/disciplina.
+    """
+    atualizar_agregados_notas(db, {(aluno_id, disc_id, ano_letivo)})
+
+def atualizar_agregados_notas(db: Session, chaves: Set[Tuple[int, int, Optional[str]]]):
+    """
+    Versão em lote: (Aluno_id, Disc_id, Ano_letivo) de várias notas escritas na mesma transação.
+    Cada resumo de turma/professor é recalculado uma única vez, mesmo que afete muitas notas.
+    """
+    chaves = {c for c in chaves if c[2]}
+    if not chaves: return
+    db.flush()
+
+    alunos, turmas_disc = {}, set()
+    for aluno_id, disc_id, ano_letivo in chaves:
+        if (aluno_id, ano_letivo) not in alunos:
+            alunos[(aluno_id, ano_letivo)] = obter_turma_do_aluno(db, aluno_id, ano_letivo)
+        turma_id = alunos[(aluno_id, ano_letivo)]
+        if turma_id: turmas_disc.add((turma_id, disc_id, ano_letivo))
+
+    for (aluno_id, ano_letivo), turma_id in alunos.items():
+        _recalcular_aluno(db, aluno_id, ano_letivo, turma_id)
+
+    professores = set()
+    for turma_id, disc_id, ano_letivo in turmas_disc:
+        _recalcular_turma_disciplina(db, turma_id, disc_id, ano_letivo)
+        for (prof_id,) in db.query(models.TurmaDisciplina.Professor_id).filter(
+            models.TurmaDisciplina.Turma_id == turma_id,
+            models.TurmaDisciplina.Disc_id == disc_id
+        ).all():
+            professores.add((prof_id, disc_id, ano_letivo))
+
+    for professor_id, disc_id, ano_letivo in professores:
+        _recalcular_professor(db, professor_id, disc_id, ano_letivo)
+
+def atualizar_agregados_aluno(db: Session, aluno_id: int, pares: Optional[Iterable[Tuple[int, str]]] = None):
+    """
+    Recalcula todos os resumos de um aluno (ex: mudança de turma ou eliminação das notas).
+    `pares` (Disc_id, Ano_letivo) permite indicar notas que já foram apagadas.
+    """
+    if pares is None:
+        pares = db.query(models.Nota.Disc_id, models.Nota.Ano_letivo)\
+            .filter(models.Nota.Aluno_id == aluno_id).distinct().all()
+    atualizar_agregados_notas(db, {(aluno_id, disc_id, ano_letivo) for disc_id, ano_letivo in pares})
+
+def atualizar_agregados_professores(db: Session, chaves: Set[Tuple[int, int, str]]):
+    """Recalcula resumos de professores após mudanças nas atribuições (Professor_id, Disc_id, Ano_letivo)."""
+    db.flush()
+    for professor_id, disc_id, ano_letivo in chaves:
+        _recalcular_professor(db, professor_id, disc_id, ano_letivo)
+
+# --- RECONSTRUÇÃO COMPLETA (RECUPERAÇÃO) ---
+
+def reconstruir_agregados(db: Session) -> dict:
+    """
+    Apaga e reconstrói os três níveis de resumo com INSERT ... SELECT agrupados.
+    Usar para recuperação (ex: notas alteradas diretamente na BD).
+    """
+    db.query(models.ResumoAlunoAno).delete()
+    db.query(models.ResumoTurmaDisciplina).delete()
+    db.query(models.ResumoProfessorDisciplina).delete()
+
+    nota = models.Nota.Nota_Final
+    qtd, soma, negativas = _metricas(nota)
+    media = func.round(func.avg(nota), 2)
+
+    # 1. Aluno / Ano Letivo (a turma vem da matrícula desse ano)
+    turma_do_ano = select(func.max(models.Matricula.Turma_id))\
+        .join(models.Turma, models.Matricula.Turma_id == models.Turma.Turma_id)\
+        .where(models.Matricula.Aluno_id == models.Nota.Aluno_id, models.Turma.AnoLetivo == models.Nota.Ano_letivo)\
+        .correlate(models.Nota).scalar_subquery()
+
+    sel_alunos = select(
+        models.Nota.Aluno_id, models.Nota.Ano_letivo, turma_do_ano, qtd, soma, media, negativas, func.min(nota)
+    ).where(nota != None, models.Nota.Ano_letivo != None)\
+     .group_by(models.Nota.Aluno_id, models.Nota.Ano_letivo)
+
+    db.execute(insert(models.ResumoAlunoAno).from_select(
+        ["Aluno_id", "Ano_letivo", "Turma_id", "Qtd_Notas", "Soma_Notas", "Media", "Negativas", "Nota_Minima"], sel_alunos
+    ))
+
+    # 2. Turma / Disciplina
+    sel_turmas = select(models.Matricula.Turma_id, models.Nota.Disc_id, qtd, soma, media, negativas)\
+        .select_from(models.Matricula)\
+        .join(models.Turma, models.Matricula.Turma_id == models.Turma.Turma_id)\
+        .join(models.Nota, and_(
+            models.Nota.Aluno_id == models.Matricula.Aluno_id,
+            models.Nota.Ano_letivo == models.Turma.AnoLetivo
+        ))\
+        .where(nota != None)\
+        .group_by(models.Matricula.Turma_id, models.Nota.Disc_id)
+
+    db.execute(insert(models.ResumoTurmaDisciplina).from_select(
+        ["Turma_id", "Disc_id", "Qtd_Notas", "Soma_Notas", "Media", "Negativas"], sel_turmas
+    ))
+
+    # 3. Professor / Disciplina / Ano Letivo
+    sel_profs = select(
+        models.TurmaDisciplina.Professor_id, models.TurmaDisciplina.Disc_id, models.Turma.AnoLetivo,
+        qtd, soma, media, negativas
+    ).select_from(models.TurmaDisciplina)\
+     .join(models.Turma, models.TurmaDisciplina.Turma_id == models.Turma.Turma_id)\
+     .join(models.Matricula, models.Turma.Turma_id == models.Matricula.Turma_id)\
+     .join(models.Nota, and_(
+         models.Nota.Aluno_id == models.Matricula.Aluno_id,
+         models.Nota.Disc_id == models.TurmaDisciplina.Disc_id,
+         models.Nota.Ano_letivo == models.Turma.AnoLetivo
+     ))\
+     .where(nota != None)\
+     .group_by(models.TurmaDisciplina.Professor_id, models.TurmaDisciplina.Disc_id, models.Turma.AnoLetivo)
+
+    db.execute(insert(models.ResumoProfessorDisciplina).from_select(
+        ["Professor_id", "Disc_id", "Ano_letivo", "Qtd_Notas", "Soma_Notas", "Media", "Negativas"], sel_profs
+    ))
+
+    db.commit()
+    return {
+        "alunos": db.query(models.ResumoAlunoAno).count(),
+        "turmas_disciplinas": db.query(models.ResumoTurmaDisciplina).count(),
+        "professores_disciplinas": db.query(models.ResumoProfessorDisciplina).count()
+    }
+
+def garantir_agregados(db: Session):
+    """Reconstrói os resumos se estiverem vazios mas já existirem notas (ex: primeira execução)."""
+    if db.query(models.ResumoAlunoAno).first() is None and db.query(models.Nota).first() is not None:
+        reconstruir_agregados(db)
@@ -3,7 +3,9 @@ import json
 from google import genai
 from google.genai import types
 from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import func
 from app.db import models
+from app.services import snapshot_service, distribuicao_service, ordenados_service
 from dotenv import load_dotenv
 from datetime import date
 
@@ -19,72 +21,78 @@ def get_school_context(db: Session):
     A IA recebe apenas os factos consumados para gerar a narrativa.
     """
     
+    # Factos analíticos em dia antes de qualquer leitura (faz commit da sessão)
+    snapshot_service.garantir_snapshot_atual(db)
+
     # --- 1. PREPARAR DADOS DE PROFESSORES ---
     profs_db = db.query(models.Professor).options(joinedload(models.Professor.escalao)).all()
     prof_stats = {} 
+    # Vencimento do último processamento (Ordenados); sem processamento, a fórmula do escalão
+    vencimentos = ordenados_service.ultimos_valores(db, models.TipoFuncionarioEnum.Professor)
     
     for p in profs_db:
-        salario = float(p.escalao.Valor_Base) if p.escalao else 0
+        salario = vencimentos.get(p.Professor_id, ordenados_service.valor_professor(p.escalao))
         prof_stats[p.Nome] = {
             "ID": p.Professor_id,
             "Escalao": p.escalao.Nome if p.escalao else "N/A",
             "Salario": salario,
             "Soma_Notas": 0,
-            "Qtd_Notas": 0,
-            "Turmas": set()
+            "Qtd_Notas": 0
         }
 
-    # Mapa de Atribuições: (TurmaID, DiscID) -> Nome Professor
-    # Isto permite saber quem deu a nota X ao aluno Y
-    atribuicoes = db.query(models.TurmaDisciplina).all()
-    mapa_aulas = {}
     prof_id_nome = {p.Professor_id: p.Nome for p in profs_db}
 
-    for a in atribuicoes:
-        key = (a.Turma_id, a.Disc_id)
-        nome_prof = prof_id_nome.get(a.Professor_id)
+    # Média, mediana e taxa de negativas do mesmo histograma (agrupado na BD, todos os anos letivos):
+    # as três usam a mesma atribuição de notas a professores do snapshot, e a média sozinha esconde assimetrias
+    for prof_id, contagens in distribuicao_service.histogramas(db, "professor").items():
+        nome_prof = prof_id_nome.get(prof_id)
         if nome_prof:
-            mapa_aulas[key] = nome_prof
+            prof_stats[nome_prof]["Soma_Notas"] = sum(nota * qtd for nota, qtd in enumerate(contagens))
+            prof_stats[nome_prof]["Qtd_Notas"] = sum(contagens)
+            prof_stats[nome_prof]["Mediana"] = distribuicao_service.percentil(contagens, 50)
+            prof_stats[nome_prof]["Taxa_Negativas"] = round(sum(contagens[:10]) / sum(contagens), 3)
 
     # --- 2. PROCESSAR ALUNOS E ATRIBUIR METRICAS ---
-    alunos_db = db.query(models.Aluno).options(
-        joinedload(models.Aluno.notas).joinedload(models.Nota.disciplina),
-        joinedload(models.Aluno.faltas),
-        joinedload(models.Aluno.turma) 
-    ).all()
+    # Lido do snapshot analítico: cada facto de nota já traz a turma desse ano; os professores são
+    # todos os atribuídos à disciplina nessa turma (a mesma regra do ROI acima)
+    disc_nomes = dict(db.query(models.Disciplina.Disc_id, models.Disciplina.Nome).all())
+    alunos_db = db.query(models.Aluno.Aluno_id, models.Aluno.Nome, models.Turma.Ano, models.Turma.Turma)\
+        .join(models.Turma, models.Aluno.Turma_id == models.Turma.Turma_id).all()  # Ignorar alunos sem turma
+    professores_turma_disc = {}
+    for turma_id, disc_id, prof_id in db.query(models.TurmaDisciplina.Turma_id, models.TurmaDisciplina.Disc_id,
+                                               models.TurmaDisciplina.Professor_id).order_by(models.TurmaDisciplina.Professor_id):
+        if prof_id in prof_id_nome:
+            professores_turma_disc.setdefault((turma_id, disc_id), []).append(prof_id_nome[prof_id])
+    faltas_por_aluno = dict(db.query(models.FactoFalta.Aluno_id, func.count()).group_by(models.FactoFalta.Aluno_id).all())
+
+    notas_por_aluno = {}
+    for n in db.query(models.FactoNota.Aluno_id, models.FactoNota.Disc_id, models.FactoNota.Nota_1P,
+                      models.FactoNota.Nota_Final, models.FactoNota.Turma_id)\
+               .filter(models.FactoNota.Nota_Final.isnot(None)).all():
+        notas_por_aluno.setdefault(n.Aluno_id, []).append(n)
 
     alunos_analise = [] # Lista final de alunos processados
 
-    for aluno in alunos_db:
-        # Ignorar alunos sem turma ou notas
-        if not aluno.turma: continue
-        
-        turma_str = f"{aluno.turma.Ano}º{aluno.turma.Turma}"
+    for aluno_id, nome_aluno, ano_turma, letra_turma in alunos_db:
+        turma_str = f"{ano_turma}º{letra_turma}"
         notas_finais = []
         detalhe_negativas = []
         
         # Analisar cada nota do aluno
-        for n in aluno.notas:
-            if n.Nota_Final is not None:
-                notas_finais.append(n.Nota_Final)
-                
-                # Atribuir estatística ao Professor
-                key_aula = (aluno.Turma_id, n.Disc_id)
-                nome_prof = mapa_aulas.get(key_aula)
-                
-                if nome_prof and nome_prof in prof_stats:
-                    prof_stats[nome_prof]["Soma_Notas"] += n.Nota_Final
-                    prof_stats[nome_prof]["Qtd_Notas"] += 1
-                    prof_stats[nome_prof]["Turmas"].add(turma_str)
+        for n in notas_por_aluno.get(aluno_id, []):
+            notas_finais.append(n.Nota_Final)
+
+            # Professores da disciplina na turma do aluno
+            nome_prof = ", ".join(professores_turma_disc.get((n.Turma_id, n.Disc_id), []))
+
+            # Detetar Quedas Graves (P1 -> Final)
+            p1 = n.Nota_1P or n.Nota_Final
+            queda = n.Nota_Final - p1
 
-                # Detetar Quedas Graves (P1 -> Final)
-                p1 = n.Nota_1P or n.Nota_Final
-                queda = n.Nota_Final - p1
-                
-                if n.Nota_Final < 10:
-                    disc_nome = n.disciplina.Nome if n.disciplina else "Disc"
-                    info_queda = f" (Caiu {abs(queda)} valores)" if queda < -2 else ""
-                    detalhe_negativas.append(f"{disc_nome}: {n.Nota_Final}{info_queda} [Prof: {nome_prof or 'N/A'}]")
+            if n.Nota_Final < 10:
+                disc_nome = disc_nomes.get(n.Disc_id, "Disc")
+                info_queda = f" (Caiu {abs(queda)} valores)" if queda < -2 else ""
+                detalhe_negativas.append(f"{disc_nome}: {n.Nota_Final}{info_queda} [Prof: {nome_prof or 'N/A'}]")
 
         # Se o aluno tiver dados relevantes, guardar
         if notas_finais:
@@ -93,11 +101,11 @@ def get_school_context(db: Session):
             # Só nos interessam alunos com problemas para o relatório (Top Risco)
             if len(detalhe_negativas) >= 2 or media < 9.5:
                 alunos_analise.append({
-                    "Nome": aluno.Nome,
+                    "Nome": nome_aluno,
                     "Turma": turma_str,
                     "Media_Global": round(media, 2),
                     "Total_Negativas": len(detalhe_negativas),
-                    "Faltas_Total": len(aluno.faltas),
+                    "Faltas_Total": faltas_por_aluno.get(aluno_id, 0),
                     "Disciplinas_Criticas": detalhe_negativas
                 })
 
@@ -109,12 +117,14 @@ def get_school_context(db: Session):
     for nome, dados in prof_stats.items():
         if dados["Qtd_Notas"] > 0:
             media_prof = round(dados["Soma_Notas"] / dados["Qtd_Notas"], 2)
+            mediana_prof = dados["Mediana"]
             
             # Lógica de Negócio (Python define a etiqueta, IA apenas lê)
+            # Média e mediana têm de concordar: poucos alunos extremos não chegam para mudar a etiqueta
             tag_roi = "Normal"
-            if dados["Salario"] > 2200 and media_prof < 10:
+            if dados["Salario"] > 2200 and media_prof < 10 and mediana_prof < 10:
                 tag_roi = "ALERTA: Custo Elevado / Baixo Rendimento"
-            elif dados["Salario"] < 1800 and media_prof > 14:
+            elif dados["Salario"] < 1800 and media_prof > 14 and mediana_prof > 14:
                 tag_roi = "DESTAQUE: Talento (Custo Baixo / Alto Rendimento)"
             
             tabela_docentes.append({
@@ -122,6 +132,8 @@ def get_school_context(db: Session):
                 "Escalao": dados["Escalao"],
                 "Salario": f"{dados['Salario']}€",
                 "Media_Alunos": media_prof,
+                "Mediana_Alunos": mediana_prof,
+                "Taxa_Negativas": dados.get("Taxa_Negativas"),
                 "Tag_Gestao": tag_roi
             })
     
@@ -0,0 +1,72 @@
+from typing import Dict, Hashable, List, Optional
+from sqlalchemy.orm import Session
+from sqlalchemy import func, and_
+from app.db import models
+
+# Distribuição de notas (escala 0-20) calculada na base de dados:
+# GROUP BY (dimensão, nota) devolve no máximo 21 linhas por grupo, seja qual for o nº de notas.
+# Mediana e percentis saem do histograma acumulado (percentil "nearest-rank"), sem trazer notas para Python.
+
+ESCALA = range(0, 21)
+PERCENTIS = (10, 25, 50, 75, 90)
+
+# Dimensões disponíveis sobre o snapshot de notas
+DIMENSOES = {
+    "disciplina": (models.FactoNota.Disc_id,),
+    "turma": (models.FactoNota.Ano_escolar, models.FactoNota.Turma),
+    "professor": (models.TurmaDisciplina.Professor_id,),
+}
+
+# Dimensões fora do facto: cada nota conta para todos os professores da disciplina na turma
+# (a mesma atribuição dos ResumosProfessorDisciplina)
+JUNCOES = {
+    "professor": (models.TurmaDisciplina, and_(
+        models.TurmaDisciplina.Turma_id == models.FactoNota.Turma_id,
+        models.TurmaDisciplina.Disc_id == models.FactoNota.Disc_id,
+    )),
+}
+
+def histogramas(db: Session, dimensao: str, ano_letivo: Optional[str] = None) -> Dict[Hashable, List[int]]:
+    """Chave da dimensão -> contagens por nota (índice = nota, 0 a 20)."""
+    F = models.FactoNota
+    colunas = DIMENSOES[dimensao]
+    query = db.query(*colunas, F.Nota_Final, func.count()).select_from(F).filter(F.Nota_Final.isnot(None))
+    if dimensao in JUNCOES:
+        query = query.join(*JUNCOES[dimensao])
+    if ano_letivo:
+        query = query.filter(F.Ano_letivo == ano_letivo)
+    for coluna in colunas:
+        query = query.filter(coluna.isnot(None))
+
+    resultado: Dict[Hashable, List[int]] = {}
+    for *chave, nota, qtd in query.group_by(*colunas, F.Nota_Final).all():
+        chave = chave[0] if len(chave) == 1 else tuple(chave)
+        contagens = resultado.setdefault(chave, [0] * len(ESCALA))
+        contagens[min(max(int(nota), 0), 20)] += qtd
+    return resultado
+
+def percentil(contagens: List[int], p: float) -> Optional[int]:
+    total = sum(contagens)
+    if not total: return None
+    alvo = max(1, -(-total * p // 100))  # ceil(total * p / 100)
+    acumulado = 0
+    for nota, qtd in enumerate(contagens):
+        acumulado += qtd
+        if acumulado >= alvo:
+            return nota
+    return len(contagens) - 1
+
+def resumo_distribuicao(contagens: List[int]) -> dict:
+    total = sum(contagens)
+    soma = sum(nota * qtd for nota, qtd in enumerate(contagens))
+    media = soma / total if total else None
+    variancia = sum(qtd * (nota - media) ** 2 for nota, qtd in enumerate(contagens)) / total if total else None
+    return {
+        "qtd_notas": total,
+        "media": round(media, 2) if media is not None else None,
+        "desvio_padrao": round(variancia ** 0.5, 2) if variancia is not None else None,
+        "mediana": percentil(contagens, 50),
+        "percentis": {f"p{p}": percentil(contagens, p) for p in PERCENTIS},
+        "taxa_negativas": round(sum(contagens[:10]) / total, 3) if total else None,
+        "histograma": contagens,
+    }
@@ -0,0 +1,177 @@
+from datetime import datetime
+from typing import Dict, List, Optional
+from sqlalchemy.orm import Session
+from sqlalchemy import func, select, case, and_, distinct
+from app.db import models, versoes
+from app.core.cache import CacheResultados
+from app.services import snapshot_service
+
+# Estatísticas do dashboard por ano letivo (via Matrícula, não a tabela Alunos inteira):
+# alunos matriculados, turmas, professores com atribuições e taxa de aprovação.
+# - Anos fechados (anteriores ao corrente): calculados uma vez e guardados em EstatisticasAnoLetivo.
+#   Correções tardias num ano fechado: `python manutencao.py reconstruir-estatisticas-anos`.
+# - Ano corrente: calculado a pedido e guardado em cache até mudarem notas, matrículas, turmas ou atribuições.
+
+VERSOES_ANO = ("notas", "matriculas", "turmas", "atribuicoes")
+cache_ano_corrente = CacheResultados("estatisticas_ano", max_entradas=4)
+
+def verificar_reprovacao_aluno(ano_escolar: int, negativas: int, nega_pt: bool, nega_mat: bool, tem_nota_critica: bool):
+    """
+    Aplica as regras oficiais de retenção conforme definido em turmas.py.
+    Recebe os indicadores já agregados (ver indicadores_retencao).
+    """
+    if 5 <= ano_escolar <= 8:
+        return negativas > 3
+    elif ano_escolar == 9:
+        if negativas > 2:
+            return True
+        if negativas == 2:
+            # Verifica se as negativas são simultaneamente em PT e MAT
+            return nega_pt and nega_mat
+        return False
+    elif 10 <= ano_escolar <= 11:
+        return negativas > 2 or tem_nota_critica
+    elif ano_escolar == 12:
+        return negativas > 0
+    return False
+
+def indicadores_retencao(db: Session, ano_letivo: str):
+    """
+    Uma única consulta agrupada sobre o snapshot de notas (turma do ano já resolvida em cada facto):
+    (aluno_id, nome, ano_escolar, turma, negativas, nega_pt, nega_mat, critica) por aluno avaliado.
+    """
+    id_pt = db.query(models.Disciplina.Disc_id).filter(models.Disciplina.Nome.ilike("%português%")).first()
+    id_mat = db.query(models.Disciplina.Disc_id).filter(models.Disciplina.Nome.ilike("%matemática%")).first()
+    id_pt = id_pt[0] if id_pt else None
+    id_mat = id_mat[0] if id_mat else None
+
+    F = models.FactoNota
+    negativa = F.Nota_Final < 10
+    return db.query(
+        F.Aluno_id, models.Aluno.Nome, F.Ano_escolar, F.Turma,
+        func.sum(case((negativa, 1), else_=0)).label('negativas'),
+        func.max(case((and_(negativa, F.Disc_id == id_pt), 1), else_=0)).label('nega_pt'),
+        func.max(case((and_(negativa, F.Disc_id == id_mat), 1), else_=0)).label('nega_mat'),
+        func.max(case((F.Nota_Final < 6, 1), else_=0)).label('critica')
+    ).join(models.Aluno, models.Aluno.Aluno_id == F.Aluno_id)\
+     .filter(F.Ano_letivo == ano_letivo, F.Turma_id.isnot(None))\
+     .group_by(F.Aluno_id, models.Aluno.Nome, F.Ano_escolar, F.Turma).all()
+
+# --- CÁLCULO ---
+
+def anos_letivos(db: Session) -> List[str]:
+    return [a for (a,) in db.query(models.Turma.AnoLetivo).filter(models.Turma.AnoLetivo.isnot(None))
+            .distinct().order_by(models.Turma.AnoLetivo).all()]
+
+def calcular_ano(db: Session, ano_letivo: str) -> dict:
+    """Contagens do ano num único SELECT (subconsultas escalares) + aprovação a partir do snapshot."""
+    T, M, TD = models.Turma, models.Matricula, models.TurmaDisciplina
+    do_ano = T.AnoLetivo == ano_letivo
+    matriculados, turmas, professores = db.execute(select(
+        select(func.count(distinct(M.Aluno_id))).join(T, M.Turma_id == T.Turma_id).where(do_ano).scalar_subquery(),
+        select(func.count()).select_from(T).where(do_ano).scalar_subquery(),
+        select(func.count(distinct(TD.Professor_id))).join(T, TD.Turma_id == T.Turma_id)
+            .where(do_ano, TD.Professor_id.isnot(None)).scalar_subquery(),
+    )).one()
+
+    avaliados = aprovados = 0
+    for _, _, ano_escolar, _, negativas, nega_pt, nega_mat, critica in indicadores_retencao(db, ano_letivo):
+        avaliados += 1
+        if not verificar_reprovacao_aluno(ano_escolar, int(negativas or 0), bool(nega_pt), bool(nega_mat), bool(critica)):
+            aprovados += 1
+
+    return {
+        "ano_letivo": ano_letivo,
+        "alunos_matriculados": matriculados or 0,
+        "turmas": turmas or 0,
+        "professores_atribuidos": professores or 0,
+        "alunos_avaliados": avaliados,
+        "alunos_aprovados": aprovados,
+        "taxa_aprovacao": round(aprovados / avaliados * 100, 1) if avaliados else None,
+    }
+
+def _de_linha(linha: models.EstatisticaAnoLetivo) -> dict:
+    return {
+        "ano_letivo": linha.Ano_letivo,
+        "alunos_matriculados": linha.Alunos_Matriculados,
+        "turmas": linha.Turmas,
+        "professores_atribuidos": linha.Professores_Atribuidos,
+        "alunos_avaliados": linha.Alunos_Avaliados,
+        "alunos_aprovados": linha.Alunos_Aprovados,
+        "taxa_aprovacao": round(linha.Alunos_Aprovados / linha.Alunos_Avaliados * 100, 1) if linha.Alunos_Avaliados else None,
+    }
+
+def _guardar(db: Session, dados: dict):
+    linha = db.get(models.EstatisticaAnoLetivo, dados["ano_letivo"])
+    if linha is None:
+        linha = models.EstatisticaAnoLetivo(Ano_letivo=dados["ano_letivo"])
+        db.add(linha)
+    linha.Alunos_Matriculados = dados["alunos_matriculados"]
+    linha.Turmas = dados["turmas"]
+    linha.Professores_Atribuidos = dados["professores_atribuidos"]
+    linha.Alunos_Avaliados = dados["alunos_avaliados"]
+    linha.Alunos_Aprovados = dados["alunos_aprovados"]
+    linha.Calculado_Em = datetime.now()
+
+# --- LEITURA ---
+
+def estatisticas_anos(db: Session, anos: Optional[List[str]] = None) -> Dict[str, dict]:
+    """
+    Ano letivo -> estatísticas. Anos fechados lidos da tabela (calculados na primeira vez);
+    o ano corrente vem da cache por versões.
+    """
+    todos = anos_letivos(db)
+    corrente = todos[-1] if todos else None
+    pedidos = [a for a in (anos or todos) if a in todos]
+
+    guardados = {l.Ano_letivo: _de_linha(l) for l in db.query(models.EstatisticaAnoLetivo)
+                 .filter(models.EstatisticaAnoLetivo.Ano_letivo.in_(pedidos)).all()}
+    em_falta = [a for a in pedidos if a != corrente and a not in guardados]
+    if em_falta:
+        snapshot_service.garantir_snapshot_atual(db)
+        for ano in em_falta:
+            guardados[ano] = calcular_ano(db, ano)
+            _guardar(db, guardados[ano])
+        db.commit()
+
+    if corrente in pedidos:
+        guardados[corrente] = cache_ano_corrente.obter(
+            db, corrente, versoes.versoes_atuais(db, VERSOES_ANO),
+            calcular=lambda sessao: _calcular_corrente(sessao, corrente),
+            obter_versao=lambda sessao: versoes.versoes_atuais(sessao, VERSOES_ANO)
+        )
+    return {a: guardados[a] for a in pedidos}
+
+def estatisticas_do_ano(db: Session, ano_letivo: Optional[str] = None) -> Optional[dict]:
+    """Estatísticas de um ano letivo (omissão: o corrente); None se o ano não existir."""
+    if not ano_letivo:
+        ano_letivo = db.query(func.max(models.Turma.AnoLetivo)).scalar()
+    return estatisticas_anos(db, [ano_letivo]).get(ano_letivo) if ano_letivo else None
+
+def _calcular_corrente(db: Session, ano_letivo: str) -> dict:
+    snapshot_service.garantir_snapshot_atual(db)
+    return calcular_ano(db, ano_letivo)
+
+def atualizar_ano_corrente(db: Session) -> Optional[dict]:
+    """Recalcula já o ano corrente e substitui a entrada da cache (em vez de esperar pela revalidação)."""
+    corrente = db.query(func.max(models.Turma.AnoLetivo)).scalar()
+    if not corrente:
+        return None
+    versao = versoes.versoes_atuais(db, VERSOES_ANO)
+    dados = _calcular_corrente(db, corrente)
+    cache_ano_corrente.atualizar(corrente, versao, dados)
+    return dados
+
+def reconstruir_estatisticas(db: Session) -> Dict[str, int]:
+    """Recalcula e guarda todos os anos fechados (ex: depois de corrigir notas de um ano já terminado)."""
+    snapshot_service.garantir_snapshot_atual(db)
+    todos = anos_letivos(db)
+    db.query(models.EstatisticaAnoLetivo).delete(synchronize_session=False)
+    resultado = {}
+    for ano in todos[:-1]:
+        dados = calcular_ano(db, ano)
+        _guardar(db, dados)
+        resultado[ano] = dados["alunos_matriculados"]
+    db.commit()
+    cache_ano_corrente.limpar()
+    return resultado
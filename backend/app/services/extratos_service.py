@@ -0,0 +1,252 @@
+import csv
+import hashlib
+import io
+import re
+import unicodedata
+import zipfile
+from collections import Counter
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from app.db import models, contadores
+from app.services import saldos_service
+
+# Importação de extratos bancários (CSV ou xlsx) para Transacoes.
+# - As linhas são lidas em stream (csv.reader / openpyxl read_only) e inseridas em blocos,
+#   tudo numa única transação (uma falha a meio não deixa o extrato importado pela metade).
+#   Linhas inválidas (data, valor, investimento ou fornecedor desconhecido) ficam de fora e são reportadas.
+# - Deduplicação por Hash_Conteudo (índice único): voltar a importar o mesmo extrato (ou um
+#   extrato que se sobrepõe ao anterior) não cria transações repetidas. Movimentos idênticos
+#   no mesmo ficheiro (mesma data, valor e descrição) distinguem-se pela ordem de ocorrência.
+# - Cada bloco é um único insert(Transacao) multi-linha; o razão de saldos e os contadores do dashboard
+#   recebem os deltas do bloco agregados (uma escrita por investimento/mês, não por linha).
+#   Os contadores de versão e o registo do snapshot são atualizados pelos eventos de escrita em massa.
+#
+# Colunas reconhecidas (cabeçalho, sem distinguir maiúsculas/acentos):
+#   Data, Valor, Descricao, Tipo (Receita/Despesa; omissão: sinal do valor),
+#   Investimento (id ou nome do Financiamento), Fornecedor (NIF ou nome)
+
+BLOCO = 1000
+MAX_ERROS = 50
+
+SINONIMOS = {
+    "data": "data", "data movimento": "data", "data valor": "data",
+    "valor": "valor", "montante": "valor", "importancia": "valor",
+    "descricao": "descricao", "descritivo": "descricao", "movimento": "descricao",
+    "tipo": "tipo",
+    "investimento": "investimento", "financiamento": "investimento", "fin_id": "investimento",
+    "fornecedor": "fornecedor", "nif": "fornecedor", "fornecedor_id": "fornecedor",
+}
+
+class ErroLinha(ValueError):
+    pass
+
+def _normalizar(texto) -> str:
+    texto = unicodedata.normalize("NFKD", str(texto or "")).encode("ascii", "ignore").decode()
+    return " ".join(texto.strip().lower().split())
+
+# --- LEITURA EM STREAM ---
+
+def _linhas_csv(ficheiro: BinaryIO) -> Iterator[list]:
+    texto = io.TextIOWrapper(ficheiro, encoding="utf-8-sig", errors="replace", newline="")
+    try:
+        amostra = texto.read(4096)
+        try:
+            dialeto = csv.Sniffer().sniff(amostra, delimiters=";,\t")
+        except csv.Error:
+            dialeto = csv.excel
+        texto.seek(0)
+        yield from csv.reader(texto, dialeto)
+    finally:
+        texto.detach()  # O ficheiro enviado continua a ser do chamador
+
+def _linhas_xlsx(ficheiro: BinaryIO) -> Iterator[tuple]:
+    from openpyxl import load_workbook
+    from openpyxl.utils.exceptions import InvalidFileException
+    try:
+        livro = load_workbook(ficheiro, read_only=True, data_only=True)
+    except (zipfile.BadZipFile, InvalidFileException, KeyError):
+        # Ficheiro corrompido ou que não é um xlsx (KeyError: zip sem as partes de um livro Excel)
+        raise ValueError("Ficheiro xlsx inválido")
+    try:
+        yield from livro.active.iter_rows(values_only=True)
+    finally:
+        livro.close()
+
+def ler_extrato(nome_ficheiro: str, ficheiro: BinaryIO) -> Iterator[Tuple[int, Dict]]:
+    """(nº da linha no ficheiro, {campo: valor}) para cada linha com conteúdo."""
+    nome = (nome_ficheiro or "").lower()
+    if nome.endswith((".xlsx", ".xlsm")):
+        linhas = _linhas_xlsx(ficheiro)
+    elif nome.endswith((".csv", ".txt")):
+        linhas = _linhas_csv(ficheiro)
+    else:
+        raise ValueError("Formato não suportado (use .csv ou .xlsx)")
+
+    cabecalho = next(linhas, None)
+    if not cabecalho:
+        raise ValueError("Ficheiro vazio")
+    campos = [SINONIMOS.get(_normalizar(c)) for c in cabecalho]
+    em_falta = {"data", "valor"} - set(campos)
+    if em_falta:
+        raise ValueError(f"Colunas obrigatórias em falta: {', '.join(sorted(em_falta))}")
+
+    for numero, linha in enumerate(linhas, start=2):
+        if not any(v not in (None, "") for v in linha):
+            continue
+        yield numero, {campo: valor for campo, valor in zip(campos, linha) if campo}
+
+# --- CONVERSÃO ---
+
+def _data(valor) -> date:
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    texto = str(valor or "").strip()
+    for formato in ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y"):
+        try:
+            return datetime.strptime(texto, formato).date()
+        except ValueError:
+            continue
+    raise ErroLinha(f"data inválida '{texto}'")
+
+def _valor(valor) -> Decimal:
+    if isinstance(valor, (int, float, Decimal)):
+        return Decimal(str(valor)).quantize(Decimal("0.01"))
+    texto = str(valor or "").strip().replace("€", "").replace(" ", "")
+    virgula, ponto = texto.rfind(","), texto.rfind(".")
+    if virgula > ponto:  # Formato português: 1.234,56
+        texto = texto.replace(".", "").replace(",", ".")
+    elif virgula >= 0:  # Formato inglês: 1,234.56
+        texto = texto.replace(",", "")
+    elif texto.count(".") > 1:  # Só separadores de milhares: 1.234.567
+        if not re.fullmatch(r"[-+]?\d{1,3}(\.\d{3})+", texto):
+            raise ErroLinha(f"valor inválido '{valor}'")
+        texto = texto.replace(".", "")
+    try:
+        numero = Decimal(texto)
+    except InvalidOperation:
+        raise ErroLinha(f"valor inválido '{valor}'")
+    if not numero.is_finite():
+        raise ErroLinha(f"valor inválido '{valor}'")
+    if numero.as_tuple().exponent < -2:
+        # Ex: "1.234" (mil duzentos e trinta e quatro ou 1,234?): não arredondar em silêncio
+        raise ErroLinha(f"valor ambíguo ou com mais de 2 casas decimais '{valor}' (use 1234 ou 1.234,00)")
+    return numero.quantize(Decimal("0.01"))
+
+def _tipo(texto, valor: Decimal) -> models.TipoTransacaoEnum:
+    normalizado = _normalizar(texto)
+    if not normalizado:
+        return models.TipoTransacaoEnum.Despesa if valor < 0 else models.TipoTransacaoEnum.Receita
+    for tipo in models.TipoTransacaoEnum:
+        if normalizado in (tipo.value.lower(), tipo.value.lower()[0]):
+            return tipo
+    if normalizado in ("debito", "d"):
+        return models.TipoTransacaoEnum.Despesa
+    if normalizado in ("credito", "c"):
+        return models.TipoTransacaoEnum.Receita
+    raise ErroLinha(f"tipo inválido '{texto}'")
+
+class Mapeamentos:
+    """Financiamentos e fornecedores carregados uma vez (id, nome ou NIF -> id)."""
+
+    def __init__(self, db: Session):
+        self.investimentos: Dict[str, int] = {}
+        for fin_id, tipo in db.query(models.Financiamento.Fin_id, models.Financiamento.Tipo).all():
+            self.investimentos[str(fin_id)] = fin_id
+            if tipo:
+                self.investimentos.setdefault(_normalizar(tipo), fin_id)
+        self.fornecedores: Dict[str, int] = {}
+        for forn_id, nome, nif in db.query(models.Fornecedor.Fornecedor_id, models.Fornecedor.Nome, models.Fornecedor.NIF).all():
+            self.fornecedores[str(forn_id)] = forn_id
+            if nif:
+                self.fornecedores[_normalizar(nif)] = forn_id
+            self.fornecedores.setdefault(_normalizar(nome), forn_id)
+
+    @staticmethod
+    def _procurar(tabela: Dict[str, int], valor, descricao: str) -> Optional[int]:
+        if valor in (None, ""):
+            return None
+        chave = _normalizar(int(valor) if isinstance(valor, float) and valor.is_integer() else valor)
+        if chave not in tabela:
+            raise ErroLinha(f"{descricao} desconhecido '{valor}'")
+        return tabela[chave]
+
+    def investimento(self, valor) -> Optional[int]:
+        return self._procurar(self.investimentos, valor, "investimento")
+
+    def fornecedor(self, valor) -> Optional[int]:
+        return self._procurar(self.fornecedores, valor, "fornecedor")
+
+def hash_conteudo(data: date, tipo, valor: Decimal, descricao: str, fin_id, fornecedor_id, ocorrencia: int) -> str:
+    chave = "|".join(str(p) for p in (
+        data.isoformat(), tipo.value, f"{valor:.2f}", _normalizar(descricao), fin_id or "", fornecedor_id or "", ocorrencia
+    ))
+    return hashlib.sha256(chave.encode()).hexdigest()
+
+# --- IMPORTAÇÃO ---
+
+def _inserir_bloco(db: Session, bloco: List[Dict]) -> int:
+    """Insere as transações cujo hash ainda não existe; devolve quantas entraram."""
+    existentes = {h for (h,) in db.query(models.Transacao.Hash_Conteudo)
+                  .filter(models.Transacao.Hash_Conteudo.in_([t["Hash_Conteudo"] for t in bloco])).all()}
+    novas = [t for t in bloco if t["Hash_Conteudo"] not in existentes]
+    if novas:
+        db.execute(insert(models.Transacao).execution_options(**contadores.SEM_RECONTAGEM), novas)
+        conn = db.connection()
+        saldos_service.aplicar_bloco(conn, novas)
+        contadores.somar_transacoes(conn, novas)
+    return len(novas)
+
+def importar_extrato(db: Session, nome_ficheiro: str, ficheiro: BinaryIO, simular: bool = False) -> dict:
+    """
+    Importa o extrato numa única transação (commit no fim; `simular` faz rollback).
+    Linhas inválidas não entram e são reportadas; as restantes são importadas.
+    """
+    mapeamentos = Mapeamentos(db)
+    ocorrencias: Counter = Counter()
+    resultado = {"lidas": 0, "inseridas": 0, "duplicadas": 0, "com_erro": 0, "erros": []}
+    bloco: List[Dict] = []
+
+    try:
+        for numero, campos in ler_extrato(nome_ficheiro, ficheiro):
+            resultado["lidas"] += 1
+            try:
+                data = _data(campos.get("data"))
+                valor = _valor(campos.get("valor"))
+                tipo = _tipo(campos.get("tipo"), valor)
+                descricao = str(campos.get("descricao") or "").strip()
+                fin_id = mapeamentos.investimento(campos.get("investimento"))
+                fornecedor_id = mapeamentos.fornecedor(campos.get("fornecedor"))
+            except ErroLinha as e:
+                resultado["com_erro"] += 1
+                if len(resultado["erros"]) < MAX_ERROS:
+                    resultado["erros"].append(f"Linha {numero}: {e}")
+                continue
+
+            valor = abs(valor)
+            conteudo = (data, tipo, valor, _normalizar(descricao), fin_id, fornecedor_id)
+            ocorrencias[conteudo] += 1
+            bloco.append({
+                "Tipo": tipo, "Valor": valor, "Data": data, "Descricao": descricao or None,
+                "Fin_id": fin_id, "Fornecedor_id": fornecedor_id,
+                "Hash_Conteudo": hash_conteudo(data, tipo, valor, descricao, fin_id, fornecedor_id, ocorrencias[conteudo])
+            })
+            if len(bloco) >= BLOCO:
+                resultado["inseridas"] += _inserir_bloco(db, bloco)
+                bloco = []
+        if bloco:
+            resultado["inseridas"] += _inserir_bloco(db, bloco)
+    except Exception:
+        db.rollback()
+        raise
+
+    resultado["duplicadas"] = resultado["lidas"] - resultado["com_erro"] - resultado["inseridas"]
+    if simular:
+        db.rollback()
+    else:
+        db.commit()
+    return resultado
@@ -0,0 +1,132 @@
+from datetime import date
+from typing import Dict, List, Optional
+from sqlalchemy.orm import Session
+from sqlalchemy import func, and_, insert, select, exists, literal, cast, DECIMAL, Integer
+from app.db import models
+
+# Processamento mensal de vencimentos (tabela Ordenados).
+# Um mês é processado com um INSERT ... SELECT por tipo de funcionário, sem carregar ninguém para Python:
+#   Professor: Valor_Base + Bonus do escalão
+#   Staff:     Salario
+# Idempotente: só entram funcionários que ainda não têm linha nesse mês (NOT EXISTS + índice único);
+# `substituir=True` apaga o mês e volta a processá-lo (ex: depois de corrigir um escalão).
+# Departamento e escalão ficam gravados na linha, pelo que os custos agregados leem só os Ordenados.
+# Professores sem escalão e staff sem salário não têm valor a pagar: ficam de fora e são devolvidos
+# na resposta para serem corrigidos (e o mês reprocessado).
+
+DIMENSOES_CUSTO = ("departamento", "escalao")
+
+def mes_texto(mes: int) -> str:
+    return f"{mes:02d}"
+
+def _ainda_sem_ordenado(tipo: models.TipoFuncionarioEnum, funcionario_id, ano: int, mes: int):
+    O = models.Ordenado
+    return ~exists().where(
+        O.Funcionario_id == funcionario_id, O.Tipo_Funcionario == tipo, O.Ano == ano, O.Mes == mes_texto(mes)
+    )
+
+def _constantes(tipo: models.TipoFuncionarioEnum, ano: int, mes: int, data_pagamento: date):
+    return (
+        literal(tipo, models.Ordenado.Tipo_Funcionario.type),
+        literal(ano),
+        literal(mes_texto(mes)),
+        literal(data_pagamento, models.Ordenado.Data_Pagamento.type),
+    )
+
+COLUNAS = ["Funcionario_id", "Tipo_Funcionario", "Ano", "Mes", "Data_Pagamento", "Depart_id", "Escalao", "Valor_Base", "Bonus", "Valor"]
+
+def _select_professores(ano: int, mes: int, data_pagamento: date):
+    P, E = models.Professor, models.Escalao
+    tipo = models.TipoFuncionarioEnum.Professor
+    bonus = func.coalesce(E.Bonus, 0)
+    return select(
+        P.Professor_id, *_constantes(tipo, ano, mes, data_pagamento), P.Depart_id, E.Nome,
+        E.Valor_Base, bonus, cast(E.Valor_Base + bonus, DECIMAL(8, 2))
+    ).join(E, P.Escalao_id == E.Escalao_id)\
+     .where(_ainda_sem_ordenado(tipo, P.Professor_id, ano, mes))
+
+def _select_staff(ano: int, mes: int, data_pagamento: date):
+    S = models.Staff
+    tipo = models.TipoFuncionarioEnum.Staff
+    return select(
+        S.Staff_id, *_constantes(tipo, ano, mes, data_pagamento), S.Depart_id, S.Escalao,
+        S.Salario, literal(0, DECIMAL(8, 2)), S.Salario
+    ).where(S.Salario.isnot(None), _ainda_sem_ordenado(tipo, S.Staff_id, ano, mes))
+
+def _ignorados(db: Session) -> Dict[str, List[int]]:
+    """Funcionários que o processamento não consegue pagar (LEFT JOIN ao escalão / salário em falta)."""
+    P, E, S = models.Professor, models.Escalao, models.Staff
+    professores = db.query(P.Professor_id).outerjoin(E, P.Escalao_id == E.Escalao_id)\
+        .filter(E.Escalao_id.is_(None)).order_by(P.Professor_id).all()
+    staff = db.query(S.Staff_id).filter(S.Salario.is_(None)).order_by(S.Staff_id).all()
+    return {
+        "professores_sem_escalao": [i for (i,) in professores],
+        "staff_sem_salario": [i for (i,) in staff],
+    }
+
+def processar_ordenados(db: Session, ano: int, mes: int, data_pagamento: Optional[date] = None,
+                        substituir: bool = False) -> dict:
+    """
+    Gera os Ordenados do mês (numa transação) e devolve quantas linhas entraram por tipo e os ids dos
+    funcionários ignorados. Um processamento concorrente do mesmo mês termina em IntegrityError
+    (índice único), que fica para quem chama.
+    """
+    data_pagamento = data_pagamento or date.today()
+    O = models.Ordenado
+    removidos = 0
+    if substituir:
+        removidos = db.query(O).filter(O.Ano == ano, O.Mes == mes_texto(mes)).delete(synchronize_session=False)
+
+    professores = db.execute(insert(O).from_select(COLUNAS, _select_professores(ano, mes, data_pagamento))).rowcount
+    staff = db.execute(insert(O).from_select(COLUNAS, _select_staff(ano, mes, data_pagamento))).rowcount
+    ignorados = _ignorados(db)
+    db.commit()
+    return {"Professor": professores, "Staff": staff, "removidos": removidos, **ignorados}
+
+# --- LEITURA ---
+
+def valor_professor(escalao: Optional[models.Escalao]) -> float:
+    """Vencimento de um professor pela fórmula do processamento (Valor_Base + Bonus do escalão)."""
+    if not escalao:
+        return 0.0
+    return float(escalao.Valor_Base or 0) + float(escalao.Bonus or 0)
+
+def ultimos_valores(db: Session, tipo: models.TipoFuncionarioEnum, ids: Optional[List[int]] = None) -> Dict[int, float]:
+    """Funcionario_id -> Valor do Ordenado do último mês processado (todos os funcionários do tipo ou só `ids`)."""
+    O = models.Ordenado
+    periodo = O.Ano * 100 + cast(O.Mes, Integer)
+    filtros = [O.Tipo_Funcionario == tipo] + ([O.Funcionario_id.in_(ids)] if ids is not None else [])
+    ultimo = select(O.Funcionario_id, func.max(periodo).label("periodo"))\
+        .where(*filtros).group_by(O.Funcionario_id).subquery()
+    linhas = db.query(O.Funcionario_id, O.Valor)\
+        .join(ultimo, and_(ultimo.c.Funcionario_id == O.Funcionario_id, ultimo.c.periodo == periodo))\
+        .filter(O.Tipo_Funcionario == tipo).all()
+    return {funcionario_id: float(valor) for funcionario_id, valor in linhas if valor is not None}
+
+def custos(db: Session, ano: int, mes: Optional[int] = None, dimensao: str = "departamento") -> List[dict]:
+    """Custo de vencimentos agrupado por departamento ou escalão (a partir dos Ordenados processados)."""
+    O = models.Ordenado
+    total = func.coalesce(func.sum(O.Valor), 0)
+    filtros = [O.Ano == ano] + ([O.Mes == mes_texto(mes)] if mes else [])
+
+    if dimensao == "departamento":
+        linhas = db.query(O.Depart_id, models.Departamento.Nome, func.count(), total, func.count(func.distinct(O.Mes)))\
+            .outerjoin(models.Departamento, models.Departamento.Depart_id == O.Depart_id)\
+            .filter(*filtros).group_by(O.Depart_id, models.Departamento.Nome).all()
+        chave = lambda l: {"id": l[0], "nome": l[1] or "Sem departamento"}
+    else:
+        linhas = db.query(O.Escalao, func.count(), total, func.count(func.distinct(O.Mes)))\
+            .filter(*filtros).group_by(O.Escalao).all()
+        linhas = [(None, *l) for l in linhas]
+        chave = lambda l: {"id": None, "nome": l[1] or "Sem escalão"}
+
+    resultado = []
+    for linha in linhas:
+        _, _, qtd, custo, meses = linha
+        resultado.append({
+            **chave(linha),
+            "qtd_ordenados": qtd,
+            "custo_total": float(custo),
+            "custo_medio_mensal": round(float(custo) / meses, 2) if meses else 0.0,
+        })
+    return sorted(resultado, key=lambda r: r["custo_total"], reverse=True)
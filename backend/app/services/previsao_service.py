@@ -0,0 +1,160 @@
+from datetime import date, timedelta
+from typing import List, Optional, Tuple
+import numpy as np
+from sqlalchemy.orm import Session
+from app.db import models
+from app.services import saldos_service
+
+# Previsão do ritmo de gasto (burn rate) de cada investimento.
+# - Série: despesa mensal de cada Financiamento nos meses já fechados (razão SaldosMensais),
+#   numa matriz meses x investimentos.
+# - Tendência: regressão linear (np.linalg.lstsq) resolvida de uma vez para todas as colunas.
+# - Sazonalidade: desvio médio de cada mês do ano em relação à tendência (com >= 12 meses de série).
+# - Projeção mês a mês até ao esgotamento (máx. HORIZONTE_MESES) e saldo previsto no fim do ano.
+# O ajuste dos meses fechados (ajustar_historico) é separável: a projeção aplica-lhe ao vivo o gasto
+# do mês corrente, os saldos acumulados e os valores aprovados.
+
+HISTORICO_MESES = 24
+HORIZONTE_MESES = 60
+MIN_MESES_TENDENCIA = 3
+
+Mes = Tuple[int, int]
+
+def _somar_meses(mes: Mes, n: int) -> Mes:
+    indice = mes[0] * 12 + (mes[1] - 1) + n
+    return indice // 12, indice % 12 + 1
+
+def _ajustar(despesas: np.ndarray, meses_do_ano: np.ndarray):
+    """
+    Tendência e sazonalidade para todas as colunas de uma vez.
+    Devolve (coeficientes 2 x N, sazonalidade 12 x N).
+    """
+    n_meses, n_inv = despesas.shape
+    t = np.arange(n_meses, dtype=float)
+    if n_meses >= MIN_MESES_TENDENCIA:
+        X = np.column_stack([np.ones(n_meses), t])
+        coeficientes, *_ = np.linalg.lstsq(X, despesas, rcond=None)
+    else:
+        coeficientes = np.vstack([despesas.mean(axis=0) if n_meses else np.zeros(n_inv), np.zeros(n_inv)])
+
+    sazonalidade = np.zeros((12, n_inv))
+    if n_meses >= 12:
+        residuos = despesas - (coeficientes[0] + np.outer(t, coeficientes[1]))
+        contagens = np.bincount(meses_do_ano - 1, minlength=12)[:, None]
+        np.add.at(sazonalidade, meses_do_ano - 1, residuos)
+        sazonalidade = np.divide(sazonalidade, contagens, out=np.zeros_like(sazonalidade), where=contagens > 0)
+    return coeficientes, sazonalidade
+
+def periodo_historico(hoje: date) -> Tuple[date, date]:
+    """Primeiro e último dia dos meses fechados que entram na série (para as versões mensais da cache)."""
+    ultimo_fechado = _somar_meses((hoje.year, hoje.month), -1)
+    inicio = _somar_meses(ultimo_fechado, -(HISTORICO_MESES - 1))
+    return date(*inicio, 1), date(hoje.year, hoje.month, 1) - timedelta(days=1)
+
+def ajustar_historico(db: Session, hoje: Optional[date] = None) -> dict:
+    """
+    Série dos meses fechados e respetivo ajuste (tendência + sazonalidade) por investimento.
+    Não depende do mês corrente: pode ficar em cache enquanto esses meses não mudarem.
+    """
+    hoje = hoje or date.today()
+    corrente: Mes = (hoje.year, hoje.month)
+    ultimo_fechado = _somar_meses(corrente, -1)
+    inicio = _somar_meses(ultimo_fechado, -(HISTORICO_MESES - 1))
+
+    fin_ids = [i for (i,) in db.query(models.Financiamento.Fin_id).order_by(models.Financiamento.Fin_id).all()]
+    colunas = {fin_id: j for j, fin_id in enumerate(fin_ids)}
+
+    # Matriz meses x investimentos (só meses fechados; o corrente ainda está a meio)
+    linhas = saldos_service.totais_mensais(db, inicio, ultimo_fechado)
+    meses = [_somar_meses(inicio, i) for i in range(HISTORICO_MESES)]
+    despesas = np.zeros((len(meses), len(fin_ids)))
+    indice_mes = {m: i for i, m in enumerate(meses)}
+    for (ano, mes, fin_id), (_, despesa) in linhas.items():
+        if fin_id in colunas:
+            despesas[indice_mes[(ano, mes)], colunas[fin_id]] = despesa
+
+    # A série começa no primeiro mês com despesas: meses anteriores (sem execução) achatariam a tendência
+    com_dados = np.flatnonzero(despesas.any(axis=1))
+    primeiro = int(com_dados[0]) if com_dados.size else len(meses)
+    serie = despesas[primeiro:]
+    meses_do_ano = np.array([m for _, m in meses[primeiro:]], dtype=int)
+    coeficientes, sazonalidade = _ajustar(serie, meses_do_ano)
+    return {
+        "fin_ids": fin_ids,
+        "meses_historico": len(serie),
+        "gasto_medio": serie.mean(axis=0) if len(serie) else np.zeros(len(fin_ids)),
+        "coeficientes": coeficientes,
+        "sazonalidade": sazonalidade,
+    }
+
+def calcular_previsao(db: Session, hoje: Optional[date] = None, historico: Optional[dict] = None) -> List[dict]:
+    """Projeção a partir do ajuste dos meses fechados (`historico`, calculado se omitido) e dos valores atuais."""
+    hoje = hoje or date.today()
+    corrente: Mes = (hoje.year, hoje.month)
+    historico = historico or ajustar_historico(db, hoje)
+
+    investimentos = db.query(models.Financiamento).order_by(models.Financiamento.Fin_id).all()
+    if not investimentos:
+        return []
+    colunas = {inv.Fin_id: j for j, inv in enumerate(investimentos)}
+
+    # Ajuste alinhado com os investimentos atuais (um investimento novo ainda sem ajuste fica a zero)
+    n_meses = historico["meses_historico"]
+    coeficientes = np.zeros((2, len(investimentos)))
+    sazonalidade = np.zeros((12, len(investimentos)))
+    gasto_medio = np.zeros(len(investimentos))
+    for k, fin_id in enumerate(historico["fin_ids"]):
+        if fin_id in colunas:
+            j = colunas[fin_id]
+            coeficientes[:, j] = historico["coeficientes"][:, k]
+            sazonalidade[:, j] = historico["sazonalidade"][:, k]
+            gasto_medio[j] = historico["gasto_medio"][k]
+
+    # Projeção vetorizada: horizonte x investimentos
+    futuros = [_somar_meses(corrente, i) for i in range(HORIZONTE_MESES)]
+    t_futuro = np.arange(n_meses, n_meses + HORIZONTE_MESES, dtype=float)
+    projecao = coeficientes[0] + np.outer(t_futuro, coeficientes[1])
+    projecao += sazonalidade[np.array([m for _, m in futuros]) - 1]
+    projecao = np.clip(projecao, 0, None)
+
+    # O mês corrente já tem gasto real (lido sempre ao vivo): a projeção desse mês é só o que ainda falta gastar
+    gasto_corrente = np.zeros(len(investimentos))
+    for fin_id, (_, despesa) in saldos_service.totais_periodo(db, corrente[0], [corrente[1]]).items():
+        if fin_id in colunas:
+            gasto_corrente[colunas[fin_id]] = despesa
+    projecao[0] = np.clip(projecao[0] - gasto_corrente, 0, None)
+
+    acumulados = saldos_service.saldos_acumulados(db)
+    aprovado = np.array([float(inv.Valor or 0) for inv in investimentos])
+    gasto = np.array([acumulados.get(inv.Fin_id, (0.0, 0.0))[1] for inv in investimentos])
+    saldo_atual = aprovado - gasto
+    saldo_projetado = saldo_atual - np.cumsum(projecao, axis=0)
+
+    meses_ate_fim_ano = 12 - corrente[1] + 1
+    saldo_fim_ano = saldo_projetado[meses_ate_fim_ano - 1]
+    esgota = saldo_projetado <= 0
+    mes_esgotamento = np.where(esgota.any(axis=0), esgota.argmax(axis=0), -1)
+
+    resultado = []
+    for j, inv in enumerate(investimentos):
+        if saldo_atual[j] <= 0:
+            esgotamento = f"{corrente[0]}-{corrente[1]:02d}"
+        elif mes_esgotamento[j] >= 0:
+            ano, mes = futuros[mes_esgotamento[j]]
+            esgotamento = f"{ano}-{mes:02d}"
+        else:
+            esgotamento = None
+        resultado.append({
+            "id": inv.Fin_id,
+            "tipo_investimento": inv.Tipo or "Sem Nome",
+            "valor_aprovado": round(float(aprovado[j]), 2),
+            "gasto_acumulado": round(float(gasto[j]), 2),
+            "saldo_atual": round(float(saldo_atual[j]), 2),
+            "gasto_medio_mensal": round(float(gasto_medio[j]), 2),
+            "tendencia_mensal": round(float(coeficientes[1, j]), 2),
+            "gasto_previsto_proximo_mes": round(float(projecao[1, j]), 2),
+            "saldo_previsto_fim_ano": round(float(saldo_fim_ano[j]), 2),
+            "data_esgotamento": esgotamento,
+            "meses_historico": n_meses,
+        })
+    return resultado
@@ -0,0 +1,199 @@
+from decimal import Decimal
+from typing import Dict, List, Tuple
+from sqlalchemy import event, func, case, inspect, insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app.db import models
+
+# Razão de saldos (ledger) dos investimentos.
+# SaldoFinanciamento (totais acumulados por investimento) e SaldoMensal (totais por ano/mês/investimento)
+# são atualizados por eventos do mapper de Transacao, na MESMA transação da escrita
+# (criar_despesa, eliminar_despesa e qualquer outro código que escreva Transacao via ORM).
+# Os balanços passam a ser leituras diretas destas linhas em vez de somas sobre as transações.
+#
+# Escritas em massa (query(Transacao).update()/delete(), insert(Transacao) com listas) não passam
+# pelos eventos. Os inserts em bloco da importação de extratos (feitos com contadores.SEM_RECONTAGEM)
+# aplicam os seus deltas com `aplicar_bloco` (e contadores.somar_transacoes). Ao contrário dos contadores,
+# que recalculam os totais depois de qualquer outra escrita em massa, o razão não é recalculado:
+# depois delas corra `python manutencao.py reconciliar-saldos`.
+
+SEM_INVESTIMENTO = 0  # Fin_id usado em SaldoMensal para transações sem investimento
+
+def _dinheiro(valor) -> Decimal:
+    return Decimal(str(valor or 0)).quantize(Decimal("0.01"))
+
+def _tipo(valor) -> str:
+    return valor.value if isinstance(valor, models.TipoTransacaoEnum) else str(valor)
+
+def _deltas(tipo, valor, sinal: int) -> Dict[str, Decimal]:
+    valor = _dinheiro(valor) * sinal
+    receita = _tipo(tipo) == models.TipoTransacaoEnum.Receita.value
+    return {
+        "Receita_Total": valor if receita else Decimal(0),
+        "Despesa_Total": Decimal(0) if receita else valor,
+        "Qtd_Transacoes": sinal,
+    }
+
+def _acumular(conn, tabela, chaves: Dict, deltas: Dict):
+    """UPDATE incremental da linha; se ainda não existir, INSERT (com nova tentativa se outro a criou entretanto)."""
+    condicao = [getattr(tabela.c, k) == v for k, v in chaves.items()]
+    valores = {k: getattr(tabela.c, k) + v for k, v in deltas.items()}
+    if conn.execute(update(tabela).where(*condicao).values(**valores)).rowcount:
+        return
+    try:
+        with conn.begin_nested():
+            conn.execute(insert(tabela).values(**chaves, **deltas))
+    except IntegrityError:
+        conn.execute(update(tabela).where(*condicao).values(**valores))
+
+def _aplicar(conn, fin_id, tipo, valor, data, sinal: int):
+    deltas = _deltas(tipo, valor, sinal)
+    if fin_id is not None:
+        _acumular(conn, models.SaldoFinanciamento.__table__, {"Fin_id": fin_id}, deltas)
+    if data is not None:
+        _acumular(conn, models.SaldoMensal.__table__,
+                  {"Ano": data.year, "Mes": data.month, "Fin_id": fin_id if fin_id is not None else SEM_INVESTIMENTO}, deltas)
+
+def _valor_anterior(estado, atributo):
+    historico = estado.attrs[atributo].history
+    return historico.deleted[0] if historico.deleted else getattr(estado.object, atributo)
+
+@event.listens_for(models.Transacao, "after_insert")
+def _apos_inserir(mapper, conn, transacao):
+    _aplicar(conn, transacao.Fin_id, transacao.Tipo, transacao.Valor, transacao.Data, +1)
+
+@event.listens_for(models.Transacao, "after_delete")
+def _apos_apagar(mapper, conn, transacao):
+    estado = inspect(transacao)
+    _aplicar(conn, _valor_anterior(estado, "Fin_id"), _valor_anterior(estado, "Tipo"),
+             _valor_anterior(estado, "Valor"), _valor_anterior(estado, "Data"), -1)
+
+@event.listens_for(models.Transacao, "after_update")
+def _apos_atualizar(mapper, conn, transacao):
+    estado = inspect(transacao)
+    campos = ("Fin_id", "Tipo", "Valor", "Data")
+    if not any(estado.attrs[c].history.has_changes() for c in campos):
+        return
+    _aplicar(conn, *(_valor_anterior(estado, c) for c in campos), -1)
+    _aplicar(conn, transacao.Fin_id, transacao.Tipo, transacao.Valor, transacao.Data, +1)
+
+# --- INSERTS EM BLOCO ---
+
+def aplicar_bloco(conn, transacoes: List[Dict]):
+    """
+    Deltas de um insert(Transacao) com uma lista de linhas (ex: importação de extratos), somados por
+    investimento e por (ano, mês, investimento): uma escrita por linha do razão e não por transação.
+    """
+    por_investimento: Dict[int, Dict[str, Decimal]] = {}
+    por_mes: Dict[Tuple[int, int, int], Dict[str, Decimal]] = {}
+    for t in transacoes:
+        deltas = _deltas(t["Tipo"], t["Valor"], +1)
+        fin_id, data = t.get("Fin_id"), t.get("Data")
+        chaves = []
+        if fin_id is not None:
+            chaves.append((por_investimento, fin_id))
+        if data is not None:
+            chaves.append((por_mes, (data.year, data.month, fin_id if fin_id is not None else SEM_INVESTIMENTO)))
+        for destino, chave in chaves:
+            acumulado = destino.setdefault(chave, dict.fromkeys(deltas, 0))
+            for campo, valor in deltas.items():
+                acumulado[campo] += valor
+
+    # Ordem fixa: escritas concorrentes bloqueiam as linhas do razão pela mesma ordem
+    for fin_id in sorted(por_investimento):
+        _acumular(conn, models.SaldoFinanciamento.__table__, {"Fin_id": fin_id}, por_investimento[fin_id])
+    for ano, mes, fin_id in sorted(por_mes):
+        _acumular(conn, models.SaldoMensal.__table__, {"Ano": ano, "Mes": mes, "Fin_id": fin_id}, por_mes[(ano, mes, fin_id)])
+
+# --- LEITURA ---
+
+def saldos_acumulados(db: Session) -> Dict[int, Tuple[float, float]]:
+    """Fin_id -> (receita acumulada, despesa acumulada)."""
+    return {
+        fin_id: (float(rec or 0), float(desp or 0))
+        for fin_id, rec, desp in db.query(
+            models.SaldoFinanciamento.Fin_id, models.SaldoFinanciamento.Receita_Total, models.SaldoFinanciamento.Despesa_Total
+        ).all()
+    }
+
+def totais_periodo(db: Session, ano: int, meses: List[int]) -> Dict[int, Tuple[float, float]]:
+    """Fin_id (0 = sem investimento) -> (receita, despesa) nos meses pedidos."""
+    S = models.SaldoMensal
+    return {
+        fin_id: (float(rec or 0), float(desp or 0))
+        for fin_id, rec, desp in db.query(S.Fin_id, func.sum(S.Receita_Total), func.sum(S.Despesa_Total))
+            .filter(S.Ano == ano, S.Mes.in_(meses)).group_by(S.Fin_id).all()
+    }
+
+def totais_mensais(db: Session, inicio: Tuple[int, int], fim: Tuple[int, int]) -> Dict[Tuple[int, int, int], Tuple[float, float]]:
+    """(ano, mês, Fin_id) -> (receita, despesa) entre os meses `inicio` e `fim` (inclusive), numa só consulta."""
+    S = models.SaldoMensal
+    periodo = S.Ano * 100 + S.Mes
+    return {
+        (ano, mes, fin_id): (float(rec or 0), float(desp or 0))
+        for ano, mes, fin_id, rec, desp in db.query(S.Ano, S.Mes, S.Fin_id, S.Receita_Total, S.Despesa_Total)
+            .filter(periodo.between(inicio[0] * 100 + inicio[1], fim[0] * 100 + fim[1])).all()
+    }
+
+# --- RECONCILIAÇÃO ---
+
+def _calcular_a_partir_das_transacoes(db: Session):
+    T = models.Transacao
+    receita = func.coalesce(func.sum(case((T.Tipo == models.TipoTransacaoEnum.Receita, T.Valor), else_=0)), 0)
+    despesa = func.coalesce(func.sum(case((T.Tipo == models.TipoTransacaoEnum.Despesa, T.Valor), else_=0)), 0)
+
+    por_investimento = {
+        fin_id: (_dinheiro(rec), _dinheiro(desp), qtd)
+        for fin_id, rec, desp, qtd in db.query(T.Fin_id, receita, despesa, func.count())
+            .filter(T.Fin_id.isnot(None)).group_by(T.Fin_id).all()
+    }
+    ano, mes = func.extract("year", T.Data), func.extract("month", T.Data)
+    por_mes = {
+        (int(a), int(m), fin_id if fin_id is not None else SEM_INVESTIMENTO): (_dinheiro(rec), _dinheiro(desp), qtd)
+        for a, m, fin_id, rec, desp, qtd in db.query(ano, mes, T.Fin_id, receita, despesa, func.count())
+            .filter(T.Data.isnot(None)).group_by(ano, mes, T.Fin_id).all()
+    }
+    return por_investimento, por_mes
+
+def reconciliar_saldos(db: Session) -> Dict[str, int]:
+    """
+    Recalcula o razão a partir das transações, corrige-o e devolve quantas linhas divergiam.
+    Bloqueia primeiro o razão (SELECT ... FOR UPDATE, pela mesma ordem dos eventos) e só depois soma as
+    transações: uma escrita em curso termina antes da soma (e entra nela) ou espera pelo fim da
+    reconciliação para aplicar o seu delta - nunca é sobreposta por um total calculado antes dela.
+    """
+    db.commit()  # Transação nova: a leitura consistente das transações começa depois dos bloqueios
+
+    atuais_inv = {s.Fin_id: s for s in db.query(models.SaldoFinanciamento).with_for_update().all()}
+    atuais_mes = {(s.Ano, s.Mes, s.Fin_id): s for s in db.query(models.SaldoMensal).with_for_update().all()}
+    por_investimento, por_mes = _calcular_a_partir_das_transacoes(db)
+
+    def _acertar(atuais, esperados, criar):
+        divergencias = 0
+        for chave, (rec, desp, qtd) in esperados.items():
+            linha = atuais.pop(chave, None)
+            if linha is None:
+                db.add(criar(chave, rec, desp, qtd))
+                divergencias += 1
+            elif (_dinheiro(linha.Receita_Total), _dinheiro(linha.Despesa_Total), linha.Qtd_Transacoes) != (rec, desp, qtd):
+                linha.Receita_Total, linha.Despesa_Total, linha.Qtd_Transacoes = rec, desp, qtd
+                divergencias += 1
+        for linha in atuais.values():  # Sem transações: só diverge se não estiver a zeros
+            if linha.Qtd_Transacoes or _dinheiro(linha.Receita_Total) or _dinheiro(linha.Despesa_Total):
+                divergencias += 1
+            db.delete(linha)
+        return divergencias
+
+    resultado = {
+        "SaldoFinanciamento": _acertar(atuais_inv, por_investimento, lambda k, r, d, q: models.SaldoFinanciamento(
+            Fin_id=k, Receita_Total=r, Despesa_Total=d, Qtd_Transacoes=q)),
+        "SaldoMensal": _acertar(atuais_mes, por_mes, lambda k, r, d, q: models.SaldoMensal(
+            Ano=k[0], Mes=k[1], Fin_id=k[2], Receita_Total=r, Despesa_Total=d, Qtd_Transacoes=q)),
+    }
+    db.commit()
+    return resultado
+
+def garantir_saldos(db: Session):
+    """Primeira execução com transações antigas: construir o razão."""
+    if db.query(models.SaldoMensal).first() is None and db.query(models.Transacao).first() is not None:
+        reconciliar_saldos(db)
@@ -0,0 +1,381 @@
+import threading
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from sqlalchemy.orm import Session
+from sqlalchemy import event, func, insert, inspect, select, and_
+from app.db import models, versoes
+from app.db.database import SessionLocal
+from app.core import eventos
+
+# Snapshot analítico (esquema em estrela).
+# Os relatórios (consultas, IA, dashboard) leem factos desnormalizados em vez de
+# juntarem Professor ⋈ TurmaDisciplina ⋈ Turma ⋈ Matricula ⋈ Nota a cada pedido.
+#
+# Atualização incremental, guiada pelo registo de alterações (AlteracoesSnapshot):
+# - cada escrita numa tabela de origem regista, na mesma transação, a chave afetada e a versão
+#   do contador dessa tabela (app/db/versoes.py);
+# - EstadoSnapshot.Versoes é a marca d'água de cada facto: só são aplicadas as alterações com
+#   versão entre a marca e a versão atual, recopiando as linhas afetadas (inserções, edições e remoções);
+# - matrículas e turmas mudam as chaves desnormalizadas: recopiam-se as notas/faltas dos alunos
+#   envolvidos, não o facto inteiro. Os professores não ficam no facto (junta-se TurmasDisciplinas
+#   por turma/disciplina na leitura), pelo que as atribuições não o alteram.
+# Depois de cada commit relevante uma thread em segundo plano põe os factos em dia; os pedidos de
+# leitura só aplicam o que ainda falte. Reconstruções totais (primeira execução, escritas em massa
+# sem chaves conhecidas) nunca correm num pedido: ficam para essa thread, o arranque ou
+# `python manutencao.py reconstruir-snapshot` (ex: depois de SQL manual na base de dados).
+
+LOTE = 5000
+
+# Facto -> contadores (tabelas de origem) de que depende; o primeiro é o da própria tabela de origem
+DEPENDENCIAS = {
+    "notas": ("notas", "matriculas", "turmas"),
+    "faltas": ("faltas", "matriculas", "turmas"),
+    "transacoes": ("transacoes",),
+}
+
+# Tabela de origem -> (modelo, coluna registada como Chave)
+ORIGENS = {
+    "notas": (models.Nota, models.Nota.Nota_id),
+    "faltas": (models.Falta, models.Falta.Falta_id),
+    "transacoes": (models.Transacao, models.Transacao.Transacao_id),
+    "matriculas": (models.Matricula, models.Matricula.Aluno_id),
+    "turmas": (models.Turma, models.Turma.Turma_id),
+}
+_POR_MODELO = {modelo: (tabela, coluna) for tabela, (modelo, coluna) in ORIGENS.items()}
+# Tabelas cuja Chave é a própria chave primária (ids novos de inserções em massa são > max(id))
+_CHAVE_PRIMARIA = {
+    tabela for tabela, (modelo, coluna) in ORIGENS.items()
+    if [c.name for c in inspect(modelo).primary_key] == [coluna.name]
+}
+
+_lock = threading.Lock()
+
+def ano_letivo_da_data(data: date) -> str:
+    """Ano letivo (setembro a agosto) a que pertence uma data."""
+    inicio = data.year if data.month >= 9 else data.year - 1
+    return f"{inicio}/{inicio + 1}"
+
+def _assinatura(marca: Dict[str, int]) -> str:
+    return ",".join(f"{nome}={versao}" for nome, versao in marca.items())
+
+def _ler_assinatura(texto: Optional[str]) -> Optional[Dict[str, int]]:
+    try:
+        return {nome: int(versao) for nome, versao in (par.split("=") for par in texto.split(","))} if texto else None
+    except ValueError:
+        return None  # Formato antigo: o facto é reconstruído uma vez
+
+def _lotes(ids) -> Iterable[List[int]]:
+    ids = sorted(ids)
+    for i in range(0, len(ids), LOTE):
+        yield ids[i:i + LOTE]
+
+# --- REGISTO DE ALTERAÇÕES ---
+
+def _registar(conn, tabela: str, chaves: Iterable[Optional[int]], apos_id: Optional[int] = None):
+    """Corre depois do incremento do contador da tabela (versoes.py): a versão lida é a desta transação."""
+    versao = conn.execute(select(models.VersaoDados.Versao).where(models.VersaoDados.Nome == tabela)).scalar() or 0
+    linhas = [{"Tabela": tabela, "Versao": versao, "Chave": chave, "Apos_Id": apos_id} for chave in chaves]
+    if linhas:
+        conn.execute(insert(models.AlteracaoSnapshot), linhas)
+
+@event.listens_for(Session, "before_flush")
+def _alteracoes_antes_do_flush(session, flush_context, instances):
+    pendentes = session.info.setdefault("snapshot_pendentes", [])
+    for obj in set(session.new) | set(session.deleted) | {o for o in session.dirty if session.is_modified(o)}:
+        origem = _POR_MODELO.get(type(obj))
+        if origem:
+            if obj not in session.new:
+                getattr(obj, origem[1].key)  # Carrega o valor (atributos expirados) antes de a linha mudar
+            pendentes.append(obj)
+
+@event.listens_for(Session, "after_flush")
+def _registar_apos_flush(session, flush_context):
+    # Depois do flush: os objetos novos já têm id
+    por_tabela: Dict[str, Set[int]] = {}
+    for obj in session.info.pop("snapshot_pendentes", []):
+        tabela, coluna = _POR_MODELO[type(obj)]
+        estado = inspect(obj)
+        valores = set(estado.attrs[coluna.key].history.deleted) | {estado.dict.get(coluna.key)}
+        por_tabela.setdefault(tabela, set()).update(v for v in valores if v is not None)
+    for tabela, chaves in por_tabela.items():
+        _registar(session.connection(), tabela, chaves)
+    if por_tabela:
+        session.info["snapshot_alterado"] = True
+
+def _chaves_em_massa(estado, tabela: str, coluna) -> Tuple[List[Optional[int]], Optional[int]]:
+    """(chaves, apos_id) de uma escrita em massa; ([None], None) se não for possível saber quais."""
+    conn = estado.session.connection()
+    if estado.is_insert:
+        parametros = estado.parameters
+        parametros = parametros if isinstance(parametros, list) else [parametros] if parametros else []
+        if parametros and all(coluna.key in p for p in parametros):
+            return sorted({p[coluna.key] for p in parametros}), None
+        if tabela in _CHAVE_PRIMARIA:
+            return [None], conn.execute(select(func.coalesce(func.max(coluna), 0))).scalar()
+        return [None], None
+    if estado.is_update and tabela not in _CHAVE_PRIMARIA:
+        return [None], None  # O UPDATE pode mudar a própria chave
+    condicao = estado.statement.whereclause
+    if condicao is None:
+        return [None], None
+    return [c for (c,) in conn.execute(select(coluna).where(condicao).distinct()) if c is not None], None
+
+@event.listens_for(Session, "do_orm_execute")
+def _registar_escrita_em_massa(estado):
+    # insert(Modelo) / query(...).update() / .delete() não passam pelo flush; chaves lidas antes da escrita
+    if not (estado.is_insert or estado.is_update or estado.is_delete) or estado.bind_mapper is None:
+        return
+    origem = _POR_MODELO.get(estado.bind_mapper.class_)
+    if not origem:
+        return
+    tabela, coluna = origem
+    chaves, apos_id = _chaves_em_massa(estado, tabela, coluna)
+    _registar(estado.session.connection(), tabela, chaves, apos_id)
+    estado.session.info["snapshot_alterado"] = True
+
+@event.listens_for(Session, "after_commit")
+def _atualizar_apos_commit(session):
+    if session.info.pop("snapshot_alterado", False):
+        atualizador.sinalizar()
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_apos_rollback(session):
+    session.info.pop("snapshot_alterado", None)
+    session.info.pop("snapshot_pendentes", None)
+
+def _chaves_alteradas(db: Session, tabela: str, desde: int, ate: int) -> Optional[Set[int]]:
+    """Chaves alteradas com versão em ]desde, ate]; None se for preciso reconstruir."""
+    A = models.AlteracaoSnapshot
+    chaves, apos = set(), None
+    for chave, apos_id in db.query(A.Chave, A.Apos_Id).filter(A.Tabela == tabela, A.Versao > desde, A.Versao <= ate).distinct():
+        if chave is not None:
+            chaves.add(chave)
+        elif apos_id is not None:
+            apos = apos_id if apos is None else min(apos, apos_id)
+        else:
+            return None
+    if apos is not None:
+        coluna = ORIGENS[tabela][1]
+        chaves.update(i for (i,) in db.query(coluna).filter(coluna > apos).all())
+    return chaves
+
+def _limpar_registo(db: Session):
+    """Remove as alterações já refletidas em todos os factos que dependem da tabela."""
+    marcas = {e.Facto: _ler_assinatura(e.Versoes) for e in db.query(models.EstadoSnapshot).all()}
+    A = models.AlteracaoSnapshot
+    for tabela in ORIGENS:
+        aplicadas = [(marcas.get(f) or {}).get(tabela) for f, deps in DEPENDENCIAS.items() if tabela in deps]
+        if aplicadas and None not in aplicadas:
+            db.query(A).filter(A.Tabela == tabela, A.Versao <= min(aplicadas)).delete(synchronize_session=False)
+    db.commit()
+
+# --- AUXILIARES ---
+
+def _alunos_das_turmas(db: Session, turmas: Set[int], facto) -> Set[int]:
+    """Alunos matriculados nas turmas, mais os que o facto ainda lá tem (matrículas/turmas apagadas)."""
+    alunos = set()
+    for lote in _lotes(turmas):
+        alunos.update(a for (a,) in db.query(models.Matricula.Aluno_id).filter(models.Matricula.Turma_id.in_(lote)).distinct())
+        alunos.update(a for (a,) in db.query(facto.Aluno_id).filter(facto.Turma_id.in_(lote)).distinct())
+    return alunos
+
+def _ids_dos_alunos(db: Session, alunos: Set[int], modelo_origem, id_origem, facto, id_facto) -> Set[int]:
+    ids = set()
+    for lote in _lotes(alunos):
+        ids.update(i for (i,) in db.query(id_origem).filter(modelo_origem.Aluno_id.in_(lote)))
+        ids.update(i for (i,) in db.query(id_facto).filter(facto.Aluno_id.in_(lote)))
+    return ids
+
+def _copiar(db: Session, facto, id_facto, consulta, id_origem, converter, ids: Optional[Set[int]]) -> int:
+    """Recopia as linhas `ids` do facto (None = todas, por páginas de chave)."""
+    copiadas = 0
+    if ids is None:
+        db.query(facto).delete(synchronize_session=False)
+        ultimo = 0
+        while True:
+            linhas = consulta.filter(id_origem > ultimo).order_by(id_origem).limit(LOTE).all()
+            if not linhas: break
+            db.execute(insert(facto), converter(db, linhas))
+            ultimo, copiadas = linhas[-1][0], copiadas + len(linhas)
+        return copiadas
+    for lote in _lotes(ids):
+        db.query(facto).filter(id_facto.in_(lote)).delete(synchronize_session=False)
+        linhas = consulta.filter(id_origem.in_(lote)).all()
+        if linhas:
+            db.execute(insert(facto), converter(db, linhas))
+            copiadas += len(linhas)
+    return copiadas
+
+# --- FACTO NOTAS ---
+
+def _select_factos_notas():
+    """SELECT das notas já com a turma (matrícula desse ano) resolvida."""
+    turma_ano = select(
+        models.Matricula.Aluno_id, models.Turma.AnoLetivo, func.max(models.Matricula.Turma_id).label("turma_id")
+    ).join(models.Turma, models.Matricula.Turma_id == models.Turma.Turma_id)\
+     .group_by(models.Matricula.Aluno_id, models.Turma.AnoLetivo).subquery()
+
+    return select(
+        models.Nota.Nota_id, models.Nota.Aluno_id, models.Nota.Disc_id, models.Nota.Ano_letivo,
+        turma_ano.c.turma_id, models.Turma.Ano, models.Turma.Turma,
+        models.Nota.Nota_1P, models.Nota.Nota_Final
+    ).select_from(models.Nota)\
+     .outerjoin(turma_ano, and_(turma_ano.c.Aluno_id == models.Nota.Aluno_id, turma_ano.c.AnoLetivo == models.Nota.Ano_letivo))\
+     .outerjoin(models.Turma, models.Turma.Turma_id == turma_ano.c.turma_id)
+
+COLUNAS_FACTO_NOTA = ["Nota_id", "Aluno_id", "Disc_id", "Ano_letivo", "Turma_id", "Ano_escolar", "Turma", "Nota_1P", "Nota_Final"]
+
+def _afetados_notas(db: Session, alteradas: Dict[str, Set[int]]) -> Set[int]:
+    F = models.FactoNota
+    alunos = alteradas["matriculas"] | _alunos_das_turmas(db, alteradas["turmas"], F)
+    return alteradas["notas"] | _ids_dos_alunos(db, alunos, models.Nota, models.Nota.Nota_id, F, F.Nota_id)
+
+def _atualizar_notas(db: Session, ids: Optional[Set[int]]) -> int:
+    F = models.FactoNota
+    if ids is None:
+        db.query(F).delete(synchronize_session=False)
+        return db.execute(insert(F).from_select(COLUNAS_FACTO_NOTA, _select_factos_notas())).rowcount
+    copiadas = 0
+    for lote in _lotes(ids):
+        db.query(F).filter(F.Nota_id.in_(lote)).delete(synchronize_session=False)
+        novas = _select_factos_notas().where(models.Nota.Nota_id.in_(lote))
+        copiadas += db.execute(insert(F).from_select(COLUNAS_FACTO_NOTA, novas)).rowcount
+    return copiadas
+
+# --- FACTO FALTAS ---
+
+def _turmas_por_aluno_ano(db: Session, pares) -> Dict[Tuple[int, str], int]:
+    alunos = {a for a, _ in pares}
+    if not alunos: return {}
+    linhas = db.query(models.Matricula.Aluno_id, models.Turma.AnoLetivo, func.max(models.Matricula.Turma_id))\
+        .join(models.Turma, models.Matricula.Turma_id == models.Turma.Turma_id)\
+        .filter(models.Matricula.Aluno_id.in_(list(alunos)))\
+        .group_by(models.Matricula.Aluno_id, models.Turma.AnoLetivo).all()
+    return {(a, ano): t for a, ano, t in linhas}
+
+def _linhas_faltas(db: Session, faltas) -> List[dict]:
+    anos = {f.Falta_id: ano_letivo_da_data(f.Data) if f.Data else None for f in faltas}
+    turmas = _turmas_por_aluno_ano(db, {(f.Aluno_id, anos[f.Falta_id]) for f in faltas})
+    return [{
+        "Falta_id": f.Falta_id, "Aluno_id": f.Aluno_id, "Disc_id": f.Disc_id, "Data": f.Data,
+        "Ano_letivo": anos[f.Falta_id], "Turma_id": turmas.get((f.Aluno_id, anos[f.Falta_id])),
+        "Justificada": f.Justificada
+    } for f in faltas]
+
+def _afetados_faltas(db: Session, alteradas: Dict[str, Set[int]]) -> Set[int]:
+    F = models.FactoFalta
+    alunos = alteradas["matriculas"] | _alunos_das_turmas(db, alteradas["turmas"], F)
+    return alteradas["faltas"] | _ids_dos_alunos(db, alunos, models.Falta, models.Falta.Falta_id, F, F.Falta_id)
+
+def _atualizar_faltas(db: Session, ids: Optional[Set[int]]) -> int:
+    consulta = db.query(models.Falta.Falta_id, models.Falta.Aluno_id, models.Falta.Disc_id, models.Falta.Data, models.Falta.Justificada)
+    return _copiar(db, models.FactoFalta, models.FactoFalta.Falta_id, consulta, models.Falta.Falta_id, _linhas_faltas, ids)
+
+# --- FACTO TRANSAÇÕES ---
+
+def _linhas_transacoes(db: Session, transacoes) -> List[dict]:
+    return [{
+        "Transacao_id": t.Transacao_id, "Tipo": t.Tipo, "Valor": t.Valor, "Data": t.Data,
+        "Ano": t.Data.year if t.Data else None, "Mes": t.Data.month if t.Data else None,
+        "Ano_letivo": ano_letivo_da_data(t.Data) if t.Data else None,
+        "Fin_id": t.Fin_id, "Fornecedor_id": t.Fornecedor_id
+    } for t in transacoes]
+
+def _afetados_transacoes(db: Session, alteradas: Dict[str, Set[int]]) -> Set[int]:
+    return alteradas["transacoes"]
+
+def _atualizar_transacoes(db: Session, ids: Optional[Set[int]]) -> int:
+    T = models.Transacao
+    consulta = db.query(T.Transacao_id, T.Tipo, T.Valor, T.Data, T.Fin_id, T.Fornecedor_id)
+    return _copiar(db, models.FactoTransacao, models.FactoTransacao.Transacao_id, consulta, T.Transacao_id, _linhas_transacoes, ids)
+
+# --- ORQUESTRAÇÃO ---
+
+FACTOS = {
+    "notas": (_afetados_notas, _atualizar_notas),
+    "faltas": (_afetados_faltas, _atualizar_faltas),
+    "transacoes": (_afetados_transacoes, _atualizar_transacoes),
+}
+
+def _versoes_origem(db: Session) -> Dict[str, int]:
+    nomes = sorted({n for deps in DEPENDENCIAS.values() for n in deps})
+    return dict(zip(nomes, versoes.versoes_atuais(db, nomes)))
+
+def _ids_afetados(db: Session, facto: str, marca: Optional[Dict[str, int]], alvo: Dict[str, int]) -> Optional[Set[int]]:
+    """Ids do facto a recopiar para passar da marca ao alvo; None = reconstrução total."""
+    if marca is None or set(marca) != set(alvo):
+        return None
+    alteradas = {}
+    for tabela in alvo:
+        if alvo[tabela] < marca[tabela]:
+            return None  # Contador reposto
+        chaves = _chaves_alteradas(db, tabela, marca[tabela], alvo[tabela]) if alvo[tabela] > marca[tabela] else set()
+        if chaves is None:
+            return None
+        alteradas[tabela] = chaves
+    return FACTOS[facto][0](db, alteradas)
+
+def _atualizar(db: Session, permitir_total: bool, forcar: bool = False) -> Dict[str, int]:
+    atuais = _versoes_origem(db)
+    alvos = {facto: {n: atuais[n] for n in deps} for facto, deps in DEPENDENCIAS.items()}
+    estados = {e.Facto: e.Versoes for e in db.query(models.EstadoSnapshot).all()}
+    pendentes = [f for f, alvo in alvos.items() if forcar or estados.get(f) != _assinatura(alvo)]
+    if not pendentes:
+        db.rollback()  # Termina a transação de leitura para as consultas seguintes verem dados recentes
+        return {}
+
+    copiadas = {}
+    with _lock:
+        for facto in pendentes:
+            alvo = alvos[facto]
+            # Bloqueia a linha de estado: outro processo a atualizar o mesmo facto espera por este
+            estado = db.query(models.EstadoSnapshot).filter(models.EstadoSnapshot.Facto == facto).with_for_update().first()
+            if not estado:
+                estado = models.EstadoSnapshot(Facto=facto, Versoes="")
+                db.add(estado)
+            marca = _ler_assinatura(estado.Versoes)
+            if not forcar and marca and set(marca) == set(alvo) and all(marca[n] >= alvo[n] for n in alvo):
+                db.commit()  # Já atualizado por outro pedido/processo
+                continue
+
+            ids = None if forcar else _ids_afetados(db, facto, marca, alvo)
+            if ids is None and not permitir_total:
+                db.rollback()
+                atualizador.sinalizar()  # A reconstrução fica para a thread; até lá lê-se o facto anterior
+                continue
+
+            copiadas[facto] = FACTOS[facto][1](db, ids)
+            if ids is None:
+                # Caches calculadas sobre o facto antigo (com as versões atuais) deixam de ser válidas
+                versoes.incrementar_versoes(db, [DEPENDENCIAS[facto][0]])
+            estado.Versoes = _assinatura(alvo)
+            estado.Atualizado_Em = datetime.now()
+            db.commit()
+        _limpar_registo(db)
+    return copiadas
+
+def _atualizar_em_segundo_plano():
+    with SessionLocal() as db:
+        _atualizar(db, permitir_total=True)
+
+atualizador = eventos.Debounce("snapshot", _atualizar_em_segundo_plano, espera=0.5, espera_maxima=5.0)
+
+def garantir_snapshot_atual(db: Session, forcar: bool = False, permitir_total: bool = False) -> Dict[str, int]:
+    """
+    Põe os factos em dia com as tabelas de origem (no-op barato se nada mudou).
+    Aplica apenas as alterações registadas desde a última atualização. Reconstruções totais só correm
+    com `permitir_total` (arranque, manutenção e a thread); num pedido ficam para a thread e até lá
+    lê-se o facto anterior.
+    Deve ser chamado ANTES de qualquer leitura na sessão: faz commit, pelo que as
+    leituras seguintes veem os factos atualizados.
+    Devolve as linhas copiadas por facto (só os factos que foram atualizados).
+    """
+    return _atualizar(db, permitir_total=permitir_total or forcar, forcar=forcar)
+
+def reconstruir_snapshot(db: Session) -> Dict[str, int]:
+    garantir_snapshot_atual(db, forcar=True)
+    return {
+        "FactoNotas": db.query(models.FactoNota).count(),
+        "FactoFaltas": db.query(models.FactoFalta).count(),
+        "FactoTransacoes": db.query(models.FactoTransacao).count(),
+    }
@@ -0,0 +1,144 @@
+"""
+Benchmark de concorrência na escrita de notas (controlo otimista por versão).
+
+Vários clientes em paralelo fazem leitura-modificação-escrita sobre as células de UMA turma:
+cada cliente lê a pauta, incrementa o 1º período de uma célula (de 20 volta a 1) e grava com a
+versão lida, repetindo em caso de conflito (HTTP 409 / conflito no lote).
+
+No fim verifica que não houve atualizações perdidas: a variação total na BD tem de ser igual à
+soma das variações das gravações aceites. As notas originais são repostas no fim. Qualquer outro
+erro de um cliente (timeout, resposta inesperada) interrompe a verificação e é mostrado.
+
+ATENÇÃO: correr contra uma base de dados de testes (os valores do 1º período são alterados).
+
+Uso:
+    python benchmarks/concorrencia_notas.py --url http://127.0.0.1:8000 --turma 1 --clientes 20 --escritas 50
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def pedido(metodo, url, corpo=None):
+    dados = json.dumps(corpo).encode() if corpo is not None else None
+    req = urllib.request.Request(url, data=dados, method=metodo, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=30) as resp:
+            return resp.status, json.loads(resp.read() or b"null")
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b"null")
+
+
+def ler_celulas(base, turma_id, disciplina_id):
+    _, detalhes = pedido("GET", f"{base}/turmas/{turma_id}/details")
+    return {n["aluno_id"]: n for n in detalhes["notas"] if n["disciplina_id"] == disciplina_id}
+
+
+def cliente(base, turma_id, disciplina_id, alunos, escritas, modo, metricas, lock):
+    aceites, conflitos, variacao, latencias = 0, 0, 0, []
+    while aceites < escritas:
+        aluno_id = random.choice(alunos)
+        celula = ler_celulas(base, turma_id, disciplina_id)[aluno_id]
+        anterior = celula["p1"] or 0
+        novo = anterior % 20 + 1  # Fica sempre na escala 1-20
+        payload = {
+            "aluno_id": aluno_id, "disciplina_id": disciplina_id,
+            "p1": novo, "versao": celula["versao"]
+        }
+
+        inicio = time.perf_counter()
+        if modo == "lote":
+            status, resp = pedido("POST", f"{base}/turmas/{turma_id}/notas/lote", {"notas": [payload]})
+            ok = status == 200 and not resp["conflitos"]
+        else:
+            status, resp = pedido("POST", f"{base}/turmas/{turma_id}/notas", payload)
+            ok = status == 200
+        latencias.append((time.perf_counter() - inicio) * 1000)
+        if status not in (200, 409):
+            raise RuntimeError(f"HTTP {status} ao gravar a nota do aluno {aluno_id}: {resp}")
+
+        if ok:
+            aceites += 1
+            variacao += novo - anterior
+        else:
+            conflitos += 1
+
+    with lock:
+        metricas["aceites"] += aceites
+        metricas["conflitos"] += conflitos
+        metricas["variacao"] += variacao
+        metricas["latencias"].extend(latencias)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--turma", type=int, required=True)
+    parser.add_argument("--disciplina", type=int, help="Disc_id (por omissão a primeira da turma)")
+    parser.add_argument("--clientes", type=int, default=20)
+    parser.add_argument("--escritas", type=int, default=25, help="Gravações aceites por cliente")
+    parser.add_argument("--alunos", type=int, default=3, help="Nº de células disputadas (menos = mais contenção)")
+    parser.add_argument("--modo", choices=["unitario", "lote"], default="unitario")
+    args = parser.parse_args()
+
+    base = args.url.rstrip("/")
+    _, detalhes = pedido("GET", f"{base}/turmas/{args.turma}/details")
+    disciplina_id = args.disciplina or detalhes["professores"][0]["disciplina_id"]
+    originais = ler_celulas(base, args.turma, disciplina_id)
+    alunos = list(originais)[:args.alunos]
+    soma_inicial = sum(originais[a]["p1"] or 0 for a in alunos)
+
+    print(f"🏁 Turma {args.turma} | Disciplina {disciplina_id} | {args.clientes} clientes x {args.escritas} escritas | {len(alunos)} células | modo {args.modo}")
+    metricas, lock = {"aceites": 0, "conflitos": 0, "variacao": 0, "latencias": []}, threading.Lock()
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clientes) as pool:
+        futuros = [
+            pool.submit(cliente, base, args.turma, disciplina_id, alunos, args.escritas, args.modo, metricas, lock)
+            for _ in range(args.clientes)
+        ]
+    duracao = time.perf_counter() - inicio
+
+    erros = []
+    for futuro in futuros:
+        try:
+            futuro.result()
+        except Exception as e:
+            erros.append(e)
+
+    if erros:
+        # As métricas dos clientes que falharam não foram somadas: a verificação não seria fiável
+        print(f"   ❌ {len(erros)} de {args.clientes} clientes falharam (ex: {erros[0]!r}); resultados descartados")
+    else:
+        finais = ler_celulas(base, args.turma, disciplina_id)
+        incremento = sum(finais[a]["p1"] or 0 for a in alunos) - soma_inicial
+        lat = sorted(metricas["latencias"])
+
+        print(f"   ⏱️  Duração: {duracao:.2f}s | Escritas aceites/s: {metricas['aceites'] / duracao:.1f}")
+        print(f"   ✅ Aceites: {metricas['aceites']} | ⚔️  Conflitos: {metricas['conflitos']} ({metricas['conflitos'] / max(len(lat), 1):.0%} das tentativas)")
+        print(f"   📊 Latência escrita: p50 {statistics.median(lat):.1f} ms | p95 {lat[int(len(lat) * 0.95) - 1]:.1f} ms | máx {lat[-1]:.1f} ms")
+        if incremento == metricas["variacao"]:
+            print(f"   🔒 Sem atualizações perdidas (variação na BD = {incremento})")
+        else:
+            print(f"   ❌ ATUALIZAÇÕES PERDIDAS: variação na BD {incremento} != soma das gravações aceites {metricas['variacao']}")
+
+    # Repor os valores originais
+    for aluno_id in alunos:
+        atual = ler_celulas(base, args.turma, disciplina_id)[aluno_id]
+        pedido("POST", f"{base}/turmas/{args.turma}/notas", {
+            "aluno_id": aluno_id, "disciplina_id": disciplina_id,
+            "p1": originais[aluno_id]["p1"], "versao": atual["versao"]
+        })
+    if erros:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import argparse
+import enum
+import json
+import os
+import shutil
+from datetime import date, datetime
+from typing import Dict, List, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import select, func, and_
+from sqlalchemy import Integer, String, Text, Date, DateTime, Boolean, DECIMAL, Enum
+
+from app.db.database import engine
+from app.db import models
+
+# Exportação analítica em Parquet (colunar), particionada por ano letivo:
+#
+#   <destino>/notas/ano_letivo=2024-2025/part-0.parquet
+#   <destino>/faltas/ano_letivo=2024-2025/part-0.parquet
+#   <destino>/matriculas/...   <destino>/transacoes/...
+#
+# Leitura nos notebooks: pd.read_parquet("<destino>/notas") ou pyarrow.dataset (partições hive).
+# - Os dados são lidos da BD em blocos por chave (WHERE id > :ultimo ORDER BY id LIMIT :bloco) e escritos
+#   bloco a bloco: memória constante. (O mysql-connector não tem cursores do lado do servidor e guarda
+#   o resultado inteiro em memória, pelo que stream_results não chegaria.)
+# - Incremental: anos já exportados não são reescritos (anos fechados não mudam);
+#   o ano letivo corrente é sempre reexportado, e um ano exportado enquanto estava aberto é
+#   reexportado uma vez depois de fechar. Use --substituir para reexportar tudo.
+# - Faltas e transações são atribuídas ao ano letivo pela data (setembro a agosto).
+
+BLOCO = 50_000
+MANIFESTO = "_manifesto.json"
+
+
+def _tipo_arrow(tipo_sql) -> pa.DataType:
+    if isinstance(tipo_sql, Boolean): return pa.bool_()
+    if isinstance(tipo_sql, Integer): return pa.int64()
+    if isinstance(tipo_sql, DECIMAL): return pa.decimal128(tipo_sql.precision or 18, tipo_sql.scale or 2)
+    if isinstance(tipo_sql, DateTime): return pa.timestamp("s")
+    if isinstance(tipo_sql, Date): return pa.date32()
+    if isinstance(tipo_sql, (String, Text, Enum)): return pa.string()
+    return pa.string()
+
+
+def _inicio_ano_letivo(ano_letivo: str) -> date:
+    return date(int(ano_letivo[:4]), 9, 1)
+
+
+def _intervalo(coluna_data, ano_letivo: str):
+    """Filtro por intervalo de datas (usa o índice; sem funções sobre a coluna)."""
+    inicio = _inicio_ano_letivo(ano_letivo)
+    return and_(coluna_data >= inicio, coluna_data < date(inicio.year + 1, 9, 1))
+
+
+# Conjunto exportado -> (chave primária, função (ano_letivo) -> SELECT com as colunas a exportar).
+# A chave é a primeira coluna de cada SELECT: serve de cursor para ler em blocos.
+CONJUNTOS = {
+    "notas": (models.Nota.Nota_id, lambda ano: select(
+        models.Nota.Nota_id, models.Nota.Aluno_id, models.Nota.Disc_id, models.Nota.Ano_letivo,
+        models.Nota.Nota_1P, models.Nota.Nota_2P, models.Nota.Nota_3P, models.Nota.Nota_Ex, models.Nota.Nota_Final
+    ).where(models.Nota.Ano_letivo == ano)),
+
+    "faltas": (models.Falta.Falta_id, lambda ano: select(
+        models.Falta.Falta_id, models.Falta.Aluno_id, models.Falta.Disc_id, models.Falta.Data, models.Falta.Justificada
+    ).where(_intervalo(models.Falta.Data, ano))),
+
+    "matriculas": (models.Matricula.Matricula_id, lambda ano: select(
+        models.Matricula.Matricula_id, models.Matricula.Aluno_id, models.Matricula.Turma_id,
+        models.Turma.Ano, models.Turma.Turma, models.Turma.AnoLetivo
+    ).join(models.Turma, models.Matricula.Turma_id == models.Turma.Turma_id)
+     .where(models.Turma.AnoLetivo == ano)),
+
+    "transacoes": (models.Transacao.Transacao_id, lambda ano: select(
+        models.Transacao.Transacao_id, models.Transacao.Tipo, models.Transacao.Valor, models.Transacao.Data,
+        models.Transacao.Descricao, models.Transacao.Fin_id, models.Transacao.Fornecedor_id
+    ).where(_intervalo(models.Transacao.Data, ano))),
+}
+
+
+def _schema(stmt) -> pa.Schema:
+    return pa.schema([pa.field(c.name, _tipo_arrow(c.type)) for c in stmt.selected_columns])
+
+
+def _valor(v):
+    return v.value if isinstance(v, enum.Enum) else v
+
+
+def anos_letivos(conn) -> List[str]:
+    """Anos letivos com dados em qualquer dos conjuntos."""
+    anos = {a for (a,) in conn.execute(select(models.Turma.AnoLetivo).distinct()) if a}
+    anos |= {a for (a,) in conn.execute(select(models.Nota.Ano_letivo).distinct()) if a}
+    for coluna in (models.Falta.Data, models.Transacao.Data):
+        minimo, maximo = conn.execute(select(func.min(coluna), func.max(coluna))).one()
+        if minimo and maximo:
+            primeiro = minimo.year if minimo.month >= 9 else minimo.year - 1
+            ultimo = maximo.year if maximo.month >= 9 else maximo.year - 1
+            anos |= {f"{a}/{a + 1}" for a in range(primeiro, ultimo + 1)}
+    return sorted(anos)
+
+
+def exportar_particao(conn, nome: str, ano_letivo: str, destino: str) -> int:
+    """Escreve uma partição bloco a bloco. Vai para uma pasta temporária e só no fim substitui a anterior."""
+    chave, consulta = CONJUNTOS[nome]
+    stmt = consulta(ano_letivo)
+    schema = _schema(stmt)
+    pasta = os.path.join(destino, nome, f"ano_letivo={ano_letivo.replace('/', '-')}")
+    temporaria = pasta + ".tmp"
+    shutil.rmtree(temporaria, ignore_errors=True)
+    os.makedirs(temporaria)
+
+    linhas, ultimo = 0, None
+    with pq.ParquetWriter(os.path.join(temporaria, "part-0.parquet"), schema, compression="zstd") as escritor:
+        while True:
+            pagina = stmt if ultimo is None else stmt.where(chave > ultimo)
+            bloco = conn.execute(pagina.order_by(chave).limit(BLOCO)).all()
+            if not bloco:
+                break
+            colunas = {campo.name: [_valor(linha[i]) for linha in bloco] for i, campo in enumerate(schema)}
+            escritor.write_table(pa.table(colunas, schema=schema))
+            linhas += len(bloco)
+            ultimo = bloco[-1][0]
+
+    shutil.rmtree(pasta, ignore_errors=True)
+    os.replace(temporaria, pasta)
+    return linhas
+
+
+def exportar_parquet(destino: str = "export_parquet", anos: Optional[List[str]] = None, substituir: bool = False):
+    print(f"🔄 A iniciar exportação Parquet para '{destino}'...")
+    os.makedirs(destino, exist_ok=True)
+    caminho_manifesto = os.path.join(destino, MANIFESTO)
+    manifesto: Dict = {}
+    if os.path.exists(caminho_manifesto):
+        with open(caminho_manifesto, encoding="utf-8") as f:
+            manifesto = json.load(f)
+
+    with engine.connect() as conn:
+        disponiveis = anos_letivos(conn)
+        if not disponiveis:
+            print("❌ Sem dados para exportar.")
+            return
+        corrente = disponiveis[-1]
+
+        for ano in (anos or disponiveis):
+            for nome in CONJUNTOS:
+                chave = f"{nome}/{ano}"
+                # Entradas sem "aberto" (manifestos antigos) contam como abertas: reexportadas uma vez
+                fechado = chave in manifesto and not manifesto[chave].get("aberto", True)
+                if fechado and not substituir and ano != corrente and not anos:
+                    print(f"   ⏭️  {chave} já exportado ({manifesto[chave]['linhas']} linhas)")
+                    continue
+                linhas = exportar_particao(conn, nome, ano, destino)
+                manifesto[chave] = {
+                    "linhas": linhas,
+                    "exportado_em": datetime.now().isoformat(timespec="seconds"),
+                    "aberto": ano == corrente,  # Ainda pode mudar: reexportar quando o ano fechar
+                }
+                print(f"   ✅ {chave}: {linhas} linhas")
+
+                # Manifesto atualizado a cada partição: uma exportação interrompida retoma onde parou
+                with open(caminho_manifesto, "w", encoding="utf-8") as f:
+                    json.dump(manifesto, f, ensure_ascii=False, indent=2, sort_keys=True)
+
+    print(f"\n🚀 Exportação concluída: {destino}")
+
+
+# ======================================================
+# EXECUÇÃO DIRETA
+# ======================================================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exportação analítica (Parquet particionado por ano letivo).")
+    parser.add_argument("--destino", default="export_parquet")
+    parser.add_argument("--anos", nargs="*", help="Anos letivos a (re)exportar, ex: 2023/2024 (omissão: os novos + o corrente)")
+    parser.add_argument("--substituir", action="store_true", help="Reexportar todos os anos")
+    args = parser.parse_args()
+    exportar_parquet(args.destino, args.anos, args.substituir)
@@ -0,0 +1,70 @@
+import argparse
+from app.db.database import SessionLocal, engine, Base
+from app.db.migracoes import aplicar_migracoes
+from app.db import contadores
+from app.services import agregados_service, snapshot_service, saldos_service, estatisticas_ano_service
+
+
+def reconstruir_agregados():
+    print("📈 A reconstruir resumos de notas (aluno/ano, turma/disciplina, professor/disciplina)...")
+    with SessionLocal() as db:
+        totais = agregados_service.reconstruir_agregados(db)
+    for nome, qtd in totais.items():
+        print(f"   ✅ {nome}: {qtd} linhas")
+
+
+def reconstruir_snapshot():
+    print("⭐ A reconstruir o snapshot analítico (factos de notas, faltas e transações)...")
+    with SessionLocal() as db:
+        totais = snapshot_service.reconstruir_snapshot(db)
+    for nome, qtd in totais.items():
+        print(f"   ✅ {nome}: {qtd} linhas")
+
+
+def reconciliar_saldos():
+    print("💰 A reconciliar o razão de saldos dos investimentos com as transações...")
+    with SessionLocal() as db:
+        divergencias = saldos_service.reconciliar_saldos(db)
+    for nome, qtd in divergencias.items():
+        print(f"   {'✅' if qtd == 0 else '🔧'} {nome}: {qtd} linhas corrigidas")
+
+
+def reconciliar_contadores():
+    print("🔢 A reconciliar os contadores do dashboard (alunos, staff, professores, receitas, despesas)...")
+    with SessionLocal() as db:
+        corrigidos = contadores.reconciliar_contadores(db)
+    if not corrigidos:
+        print("   ✅ Todos os contadores estavam certos")
+    for nome, alteracao in corrigidos.items():
+        print(f"   🔧 {nome}: {alteracao}")
+
+
+def reconstruir_estatisticas_anos():
+    print("📅 A recalcular as estatísticas dos anos letivos fechados (dashboard)...")
+    with SessionLocal() as db:
+        anos = estatisticas_ano_service.reconstruir_estatisticas(db)
+    for ano, matriculados in anos.items():
+        print(f"   ✅ {ano}: {matriculados} alunos matriculados")
+
+
+COMANDOS = {
+    "reconstruir-agregados": reconstruir_agregados,
+    "reconstruir-snapshot": reconstruir_snapshot,
+    "reconciliar-saldos": reconciliar_saldos,
+    "reconciliar-contadores": reconciliar_contadores,
+    "reconstruir-estatisticas-anos": reconstruir_estatisticas_anos,
+}
+
+
+# ======================================================
+# EXECUÇÃO DIRETA
+# ======================================================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tarefas de manutenção da base de dados.")
+    parser.add_argument("comando", choices=sorted(COMANDOS))
+    args = parser.parse_args()
+
+    # Garante que as tabelas derivadas existem antes de as preencher
+    Base.metadata.create_all(bind=engine)
+    aplicar_migracoes(engine)
+    COMANDOS[args.comando]()
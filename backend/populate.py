@@ -10,6 +10,10 @@ from app.db.models import (
     TurmaDisciplina, Falta, Ocorrencia, TipoOcorrenciaEnum, Matricula
 )
 from app.core.security import get_password_hash
+from app.services.agregados_service import reconstruir_agregados
+from app.db import versoes  # noqa: F401 (regista os contadores de versão das tabelas)
+from app.db import contadores  # noqa: F401 (regista os contadores do dashboard)
+from app.services import saldos_service  # noqa: F401 (regista o razão de saldos dos investimentos)
 
 # --- DADOS GERAIS (RESTURADOS DO TEU ORIGINAL) ---
 
@@ -250,6 +254,9 @@ def populate_advanced():
 
         
         db.commit()
+
+        print("📈 A construir resumos de notas...")
+        reconstruir_agregados(db)
         print("✅ Base de Dados Populada com Sucesso!")
 
     except Exception as e:
@@ -25,6 +25,7 @@ interface Nota {
     p3: number; 
     exame: number; 
     final: number; 
+    versao?: number;
 }
 
 interface TurmaDetails { info: { id: number; nome: string; ano_letivo: string; diretor: string }; professores: ProfessorDisc[]; alunos: Aluno[]; notas: Nota[]; }
@@ -85,6 +86,23 @@ const ClassesPage = () => {
   };
 
   useEffect(() => { loadDetails(); }, [selectedTurmaId]);
+
+  // Tempo real (SSE): aplica apenas as células alteradas por outros professores
+  useEffect(() => {
+    if (!selectedTurmaId) return;
+    const source = new EventSource(`${api.defaults.baseURL}/turmas/${selectedTurmaId}/stream`);
+    source.addEventListener("nota", (e) => {
+        const cel = JSON.parse((e as MessageEvent).data);
+        setDetails(prev => prev ? {
+            ...prev,
+            notas: prev.notas.map(n => (n.aluno_id === cel.aluno_id && n.disciplina_id === cel.disciplina_id)
+                ? { ...n, p1: cel.p1 ?? 0, p2: cel.p2 ?? 0, p3: cel.p3 ?? 0, exame: cel.exame ?? 0, final: cel.final ?? 0, versao: cel.versao ?? n.versao }
+                : n)
+        } : prev);
+    });
+    source.addEventListener("reset", () => loadDetails());
+    return () => source.close();
+  }, [selectedTurmaId]);
   const handleYearChange = (year: string) => { setSelectedYear(year); setSelectedTurmaId(""); setDetails(null); };
 
   // EXPORT
@@ -134,15 +152,20 @@ const ClassesPage = () => {
   const saveGrades = async () => {
     setIsSavingGrades(true);
     try {
-        const promises = tempGrades.map(n => api.post(`/turmas/${selectedTurmaId}/notas`, { 
+        const res = await api.post(`/turmas/${selectedTurmaId}/notas/lote`, { notas: tempGrades.map(n => ({ 
             aluno_id: n.aluno_id, 
             disciplina_id: parseInt(selectedDiscForGrades), 
             p1: n.p1, p2: n.p2, p3: n.p3, 
             exame: n.exame,
-            final: n.final 
-        }));
-        await Promise.all(promises); 
-        toast({ title: "Sucesso", description: "Pauta guardada corretamente." });
+            final: n.final,
+            versao: n.versao
+        })) });
+        const conflitos = res.data.conflitos || [];
+        if (conflitos.length > 0) {
+            toast({ variant: "destructive", title: "Conflito", description: `${conflitos.length} nota(s) foram alteradas por outro utilizador e não foram gravadas. Reveja os valores atuais.` });
+        } else {
+            toast({ title: "Sucesso", description: "Pauta guardada corretamente." });
+        }
         setIsEditingGrades(false); 
         loadDetails(); 
     } catch (e) { 
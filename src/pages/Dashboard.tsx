@@ -9,6 +9,10 @@ interface DashboardStats {
   total_staff: number;
   financial_balance: number;
   monthly_revenue: number;
+  monthly_expenses: number;
+  ano_letivo?: string;
+  total_classes?: number;
+  pass_rate?: number | null;
 }
 
 const Dashboard = () => {
@@ -30,6 +34,14 @@ const Dashboard = () => {
     };
 
     fetchStats();
+
+    // Tempo real (SSE): o servidor envia os números novos depois de cada rajada de escritas
+    const source = new EventSource(`${api.defaults.baseURL}/dashboard/stream`);
+    source.addEventListener("stats", (e) => {
+      setStats(JSON.parse((e as MessageEvent).data).stats);
+    });
+    source.addEventListener("reset", () => fetchStats());
+    return () => source.close();
   }, []);
 
   return (
@@ -79,7 +91,12 @@ const Dashboard = () => {
             </CardHeader>
             <CardContent>
               <div className="text-2xl font-bold">{stats.total_students}</div>
-              <p className="text-xs text-muted-foreground">Matriculados</p>
+              <p className="text-xs text-muted-foreground">
+                {stats.ano_letivo ? `Matriculados em ${stats.ano_letivo} (${stats.total_classes} turmas)` : "Matriculados"}
+              </p>
+              {stats.pass_rate != null && (
+                <p className="text-xs text-muted-foreground">Taxa de aprovação: {stats.pass_rate}%</p>
+              )}
             </CardContent>
           </Card>
 
@@ -99,12 +116,12 @@ const Dashboard = () => {
           {/* Nota: Quando o João adicionar active_classes ao backend, mudamos isto */}
           <Card className="hover:shadow-md transition-shadow">
             <CardHeader className="flex flex-row items-center justify-between space-y-0 pb-2">
-              <CardTitle className="text-sm font-medium">Receita</CardTitle>
+              <CardTitle className="text-sm font-medium">Receita do Mês</CardTitle>
               <TrendingUp className="h-4 w-4 text-muted-foreground" />
             </CardHeader>
             <CardContent>
               <div className="text-2xl font-bold">{formatCurrency(stats.monthly_revenue)}</div>
-              <p className="text-xs text-muted-foreground">Total acumulado</p>
+              <p className="text-xs text-muted-foreground">Despesa do mês: {formatCurrency(stats.monthly_expenses)}</p>
             </CardContent>
           </Card>
 
@@ -1,4 +1,4 @@
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
 import { 
   Table, 
@@ -16,7 +16,8 @@ import {
   Loader2, 
   AlertCircle,
   Pencil, // CORREÇÃO: Adicionado o import do Pencil para resolver o erro
-  Trash2
+  Trash2,
+  Upload
 } from "lucide-react";
 import { Alert, AlertDescription, AlertTitle } from "@/components/ui/alert";
 import { Button } from "@/components/ui/button";
@@ -48,8 +49,10 @@ interface Despesa {
   id: number;
   descricao: string;
   valor: number;
-  investimento_id: number;
+  investimento_id: number | null;
   investimento_nome: string;
+  data?: string | null;
+  fornecedor_id?: number | null;
 }
 
 interface InvestimentoHistorico {
@@ -62,6 +65,8 @@ interface InvestimentoHistorico {
 const Finances = () => {
   const [data, setData] = useState<BalancoGeral | null>(null);
   const [historico, setHistorico] = useState<Despesa[]>([]);
+  const [cursorDespesas, setCursorDespesas] = useState<string | null>(null);
+  const extratoInputRef = useRef<HTMLInputElement>(null);
   const [historicoInvestimentos, setHistoricoInvestimentos] = useState<InvestimentoHistorico[]>([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState<string>("");
@@ -94,9 +99,12 @@ const Finances = () => {
       const result = await response.json();
       setData(result);
 
-      // Buscar histórico de despesas
+      // Buscar histórico de despesas (primeira página; as seguintes vêm com "Carregar mais")
       const histResponse = await fetch(`http://127.0.0.1:8000/financas/despesas`);
-      if (histResponse.ok) setHistorico(await histResponse.json());
+      if (histResponse.ok) {
+        setHistorico(await histResponse.json());
+        setCursorDespesas(histResponse.headers.get("X-Proximo-Cursor"));
+      }
 
       // Histórico de investimentos
       const histInvestRes = await fetch(`http://127.0.0.1:8000/financas/investimentos`);
@@ -114,6 +122,38 @@ const Finances = () => {
     fetchFinances();
   }, [anoAtual]);
 
+  // --- Importar extrato bancário (CSV/xlsx) ---
+  const handleImportarExtrato = async (event: React.ChangeEvent<HTMLInputElement>) => {
+    const file = event.target.files?.[0];
+    if (!file) return;
+    const formDataUpload = new FormData();
+    formDataUpload.append("file", file);
+    try {
+      const response = await fetch("http://127.0.0.1:8000/financas/importar", { method: "POST", body: formDataUpload });
+      const result = await response.json();
+      if (!response.ok) {
+        alert(result.detail || "Erro ao importar extrato.");
+        return;
+      }
+      const erros = result.erros.length ? `\n\n${result.erros.join("\n")}` : "";
+      alert(`Importação concluída: ${result.inseridas} novas, ${result.duplicadas} já existentes, ${result.com_erro} com erro.${erros}`);
+      fetchFinances();
+    } catch (err) {
+      alert("Erro ao enviar ficheiro.");
+    } finally {
+      if (extratoInputRef.current) extratoInputRef.current.value = "";
+    }
+  };
+
+  const carregarMaisDespesas = async () => {
+    if (!cursorDespesas) return;
+    const res = await fetch(`http://127.0.0.1:8000/financas/despesas?cursor=${encodeURIComponent(cursorDespesas)}`);
+    if (!res.ok) return;
+    const pagina: Despesa[] = await res.json();
+    setHistorico(prev => [...prev, ...pagina]);
+    setCursorDespesas(res.headers.get("X-Proximo-Cursor"));
+  };
+
   // Função para formatar dinheiro (Euro)
   const formatMoney = (value: number) => {
     return new Intl.NumberFormat("pt-PT", {
@@ -194,7 +234,7 @@ const Finances = () => {
   const handleEditDespesa = (despesa: Despesa) => {
     setDescricao(despesa.descricao);
     setValor(despesa.valor);
-    setInvestimentoId(despesa.investimento_id.toString());
+    setInvestimentoId(despesa.investimento_id?.toString() ?? "");
     setEditDespesaId(despesa.id);
     setOpenDespesaModal(true);
   };
@@ -232,6 +272,10 @@ const Finances = () => {
     <div className="space-y-6 fade-in p-6">
       <div className="flex justify-between items-center">
         <h1 className="text-3xl font-bold tracking-tight">Gestão Financeira</h1>
+        <input type="file" ref={extratoInputRef} onChange={handleImportarExtrato} accept=".csv, .xlsx" className="hidden" />
+        <Button variant="outline" onClick={() => extratoInputRef.current?.click()} className="gap-2">
+          <Upload size={16} /> Importar Extrato
+        </Button>
       </div>
 
       {/* Cartões de Resumo */}
@@ -508,6 +552,11 @@ const Finances = () => {
                 )}
               </TableBody>
             </Table>
+            {cursorDespesas && (
+              <Button variant="outline" size="sm" className="w-full mt-2" onClick={carregarMaisDespesas}>
+                Carregar mais
+              </Button>
+            )}
           </CardContent>
         </Card>
         